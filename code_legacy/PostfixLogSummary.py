@@ -1,14 +1,15 @@
 #!/usr/bin/env python
+from __future__ import print_function
 import argparse
-import collections
 import os
-import re
 import sys
-import time
 
-import Config
-
-TIME_FORMAT = "%b %d %H:%M:%S"
+from starttls_policy import policy
+from starttls_policy.maillog import correlate
+from starttls_policy.maillog import follow
+from starttls_policy.maillog import parse
+from starttls_policy.maillog import summary
+from starttls_policy.maillog import timestamps
 
 # TODO: There's more to be learned from postfix logs!  Here's one sample
 # observed during failures from the sender vagrant vm:
@@ -26,79 +27,145 @@ TIME_FORMAT = "%b %d %H:%M:%S"
 #
 # Also:
 # Oct 10 19:12:13 sender postfix/smtp[1711]: 62D3F481249: to=<vagrant@valid-example-recipient.com>, relay=valid-example-recipient.com[192.168.33.7]:25, delay=0.07, delays=0.03/0.01/0.03/0, dsn=4.7.4, status=deferred (TLS is required, but was not offered by host valid-example-recipient.com[192.168.33.7])
-def get_counts(input, config, earliest_timestamp):
-  seen_trusted = False
-
-  counts = collections.defaultdict(lambda: collections.defaultdict(int))
-  tls_deferred = collections.defaultdict(int)
-  # Typical line looks like:
-  # Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established to valid-example-recipient.com[192.168.33.7]:25: TLSv1.1 with cipher AECDH-AES256-SHA (256/256 bits)
-  # indicate a problem that should be alerted on.
-  # ([^[]*) <--- any group of characters that is not "["
-  # Log lines for when a message is deferred for a TLS-related reason. These
-  deferred_re = re.compile("relay=([^[ ]*).* status=deferred.*TLS")
-  # Log lines for when a TLS connection was successfully established. These can
-  # indicate the difference between Untrusted, Trusted, and Verified certs.
-  connected_re = re.compile("([A-Za-z]+) TLS connection established to ([^[]*)")
-  mx_to_domain_mapping = config.get_mx_to_domain_policy_map()
-
-  timestamp = 0
-  for line in sys.stdin:
-    timestamp = time.strptime(line[0:15], TIME_FORMAT)
-    if timestamp < earliest_timestamp:
-      continue
-    deferred = deferred_re.search(line)
-    connected = connected_re.search(line)
-    if connected:
-      validation = connected.group(1)
-      mx_hostname = connected.group(2).lower()
-      if validation == "Trusted" or validation == "Verified":
-        seen_trusted = True
-      address_domains = config.get_address_domains(mx_hostname, mx_to_domain_mapping)
-      if address_domains:
-        domains_str = [ a.domain for a in address_domains ]
-        d = ', '.join(domains_str)
-        counts[d][validation] += 1
-        counts[d]["all"] += 1
-    elif deferred:
-      mx_hostname = deferred.group(1).lower()
-      tls_deferred[mx_hostname] += 1
+def summarize(log_counts, config):
+  """Attribute a maillog.summary.LogCounts to the mail domains of a
+  policy.Config."""
+  counts = log_counts.domain_counts(config.get_domains_for_mx)
+  return (counts, log_counts.deferred, log_counts.seen_trusted)
+
+def get_counts(chunks, config, earliest_timestamp, decoder=None):
+  """Count TLS events logged at or after earliest_timestamp, in seconds
+  since the epoch, in chunks of whole log lines."""
+  if decoder is None:
+    decoder = timestamps.TimestampDecoder()
+  # Only lines that are TLS events are looked at; see maillog.parse.
+  log_counts = summary.LogCounts().add_matches(
+    parse.match_chunks(chunks), decoder, earliest_timestamp)
+  (counts, tls_deferred, seen_trusted) = summarize(log_counts, config)
+  timestamp = earliest_timestamp if log_counts.last is None else log_counts.last
   return (counts, tls_deferred, seen_trusted, timestamp)
 
+def correlated(chunks, domain_outcomes):
+  """Pass chunks of log lines through, joining their lines into delivery
+  outcomes on the way. Messages still queued at the end are counted too."""
+  correlator = correlate.Correlator()
+  decoder = timestamps.TimestampDecoder()
+  for chunk in chunks:
+    domain_outcomes.add_all(correlator.add_chunk(chunk, decoder))
+    yield chunk
+  domain_outcomes.add_all(correlator.flush())
+
+def read_timestamp(filename):
+  """Read the time of the last line processed, in seconds since the epoch.
+  Older versions wrote it as a syslog timestamp, like "Jun 12 06:24:14"."""
+  with open(filename) as f:
+    text = f.read().strip()
+  try:
+    return float(text)
+  except ValueError:
+    return timestamps.TimestampDecoder().decode(text)
+
+def print_deferred(tls_deferred):
+  if len(tls_deferred) > 0:
+    print("Some mail was deferred due to TLS problems:")
+    for (k, v) in tls_deferred.items():
+      print("%s: %s" % (k, v))
+
+def print_outcomes(domain_outcomes):
+  print("Deliveries of %d messages, by recipient domain:" % domain_outcomes.messages)
+  for domain, outcomes in sorted(domain_outcomes.counts.items()):
+    # Sorted by status, then validation level, with plaintext (None) first.
+    for (status, validation), count in sorted(
+        outcomes.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+      print(domain, status, validation or "plaintext", count)
+    if domain_outcomes.tls_problems[domain]:
+      print(domain, "TLS problems", domain_outcomes.tls_problems[domain])
+
 def print_summary(counts):
   for mx_hostname, validations in counts.items():
     for validation, validation_count in validations.items():
       if validation == "all":
         continue
-      print mx_hostname, validation, validation_count / validations["all"], "of", validations["all"]
+      print(mx_hostname, validation, validation_count / validations["all"], "of",
+            validations["all"])
 
 if __name__ == "__main__":
   arg_parser = argparse.ArgumentParser(description='Detect delivery problems'
     ' in Postfix log files that may be caused by security policies')
   arg_parser.add_argument('-c', action="store_true", dest="cron", default=False)
-  arg_parser.add_argument("policy_file", nargs='?',
-    default=os.path.join("examples", "starttls-everywhere.json"),
+  arg_parser.add_argument("policy_file", nargs='?', default="policy.json",
     help="STARTTLS Everywhere policy file")
 
+  arg_parser.add_argument("--log", metavar="FILE",
+    help="Postfix log file to read, instead of standard input. Only lines"
+    " added since the last run are read.")
+  arg_parser.add_argument("--checkpoint", metavar="FILE",
+    default="/tmp/starttls-everywhere-log-position.json",
+    help="where to remember how far --log has been read")
+  arg_parser.add_argument("--follow", action="store_true", default=False,
+    help="keep reading --log as it grows, like tail -F, and report TLS"
+    " deferrals as they are logged")
+  arg_parser.add_argument("--backfill", metavar="FILE", nargs="+",
+    help="plain, gzip or zstd compressed log files, such as rotated"
+    " maillog.N.gz, to count in parallel. No position is saved.")
+  arg_parser.add_argument("--workers", type=int, default=0,
+    help="processes to use with --backfill; 0 is one per CPU")
+  arg_parser.add_argument("--outcomes", action="store_true", default=False,
+    help="also join the lines of each message into delivery outcomes, and"
+    " print them by recipient domain. Not with --follow or --backfill.")
+  arg_parser.add_argument("--interval", type=float, default=follow.DEFAULT_INTERVAL,
+    help="seconds to wait for more lines with --follow")
+
   args = arg_parser.parse_args()
-  config = Config.Config()
-  config.load_from_json_file(args.policy_file)
-
-  last_timestamp_processed = 0
-  timestamp_file = '/tmp/starttls-everywhere-last-timestamp-processed.txt'
-  if os.path.isfile(timestamp_file):
-    last_timestamp_processed = time.strptime(open(timestamp_file).read(), TIME_FORMAT)
-  (counts, tls_deferred, seen_trusted, latest_timestamp) = get_counts(sys.stdin, config, last_timestamp_processed)
-  with open(timestamp_file, "w") as f:
-    f.write(time.strftime(TIME_FORMAT, latest_timestamp))
-
-  # If not running in cron, print an overall summary of log lines seen from known hosts.
-  if not args.cron:
-    print_summary(counts)
-    if not seen_trusted:
-      print 'No Trusted connections seen! Probably need to install a CAfile.'
+  if args.follow and not args.log:
+    arg_parser.error("--follow needs --log")
+  if args.backfill and args.log:
+    arg_parser.error("--backfill and --log can't be used together")
+  if args.outcomes and (args.follow or args.backfill):
+    arg_parser.error("--outcomes can't be used with --follow or --backfill")
+  config = policy.Config(args.policy_file)
+  config.load()
 
-  if len(tls_deferred) > 0:
-    print "Some mail was deferred due to TLS problems:"
-    for (k, v) in tls_deferred.iteritems():
-      print "%s: %s" % (k, v)
+  if args.follow:
+    # Report TLS deferrals as they're logged, until interrupted.
+    follower = follow.LogFollower(args.log, args.checkpoint)
+    for chunk in follower.follow(args.interval):
+      (_, tls_deferred, _, _) = get_counts([chunk], config, 0)
+      print_deferred(tls_deferred)
+      sys.stdout.flush()
+      follower.save()
+  else:
+    domain_outcomes = correlate.DomainOutcomes()
+    def read(chunks):
+      if args.outcomes:
+        return correlated(chunks, domain_outcomes)
+      return chunks
+
+    if args.backfill:
+      log_counts = summary.count_files(args.backfill, workers=args.workers or None)
+      (counts, tls_deferred, seen_trusted) = summarize(log_counts, config)
+    elif args.log:
+      # The checkpoint skips what was read before, so no line is too old.
+      follower = follow.LogFollower(args.log, args.checkpoint)
+      (counts, tls_deferred, seen_trusted, _) = get_counts(read(follower.chunks()), config, 0)
+      follower.save()
+    else:
+      last_timestamp_processed = 0
+      timestamp_file = '/tmp/starttls-everywhere-last-timestamp-processed.txt'
+      if os.path.isfile(timestamp_file):
+        last_timestamp_processed = read_timestamp(timestamp_file)
+      stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+      (counts, tls_deferred, seen_trusted, latest_timestamp) = get_counts(
+        read(parse.read_chunks(stdin)), config, last_timestamp_processed)
+      with open(timestamp_file, "w") as f:
+        f.write(repr(latest_timestamp))
+
+    # If not running in cron, print an overall summary of log lines seen from known hosts.
+    if not args.cron:
+      print_summary(counts)
+      if not seen_trusted:
+        print('No Trusted connections seen! Probably need to install a CAfile.')
+    if args.outcomes:
+      print_outcomes(domain_outcomes)
+
+    print_deferred(tls_deferred)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+""" Benchmarks extraction of TLS events from Postfix logs.
+
+Writes a synthetic maillog of the given size, where most lines are the
+usual smtpd, cleanup, qmgr and smtp chatter and a few percent are TLS
+events, then runs it through `maillog.parse` and through the per-line
+loop the old PostfixLogSummary.get_counts used: a strptime and two regex
+searches on every decoded line. The strptime and timestamps modes time
+decoding the timestamp of every line, without matching anything. The
+backfill mode splits the log into gzipped rotated files first, untimed,
+and counts them with `maillog.summary.count_files` in --workers
+processes. The correlate mode joins every smtp and qmgr line into
+message outcomes with `maillog.correlate`; the synthetic queue IDs never
+repeat, so it also exercises eviction. Reports lines and megabytes per
+second.
+
+    python benchmarks/maillog_benchmark.py --size-mb 256 2048
+    python benchmarks/maillog_benchmark.py --modes backfill --workers 1 4 8
+"""
+from __future__ import print_function
+import argparse
+import functools
+import glob
+import gzip
+import io
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from starttls_policy.maillog import correlate
+from starttls_policy.maillog import parse
+from starttls_policy.maillog import summary
+from starttls_policy.maillog import timestamps
+
+TIME_FORMAT = '%b %d %H:%M:%S'
+# (weight, template) of synthetic log lines.
+LINES = [
+    (20, '{stamp} relay postfix/smtpd[{pid}]: connect from client{n}.example[192.0.2.{octet}]'),
+    (20, '{stamp} relay postfix/smtpd[{pid}]: disconnect from client{n}.example'
+         '[192.0.2.{octet}] ehlo=2 starttls=1 mail=1 rcpt=1 data=1 quit=1 commands=7'),
+    (20, '{stamp} relay postfix/cleanup[{pid}]: {qid}: message-id=<{n}@client{n}.example>'),
+    (20, '{stamp} relay postfix/qmgr[{pid}]: {qid}: from=<user{n}@client{n}.example>, '
+         'size={n}, nrcpt=1 (queue active)'),
+    (15, '{stamp} relay postfix/smtp[{pid}]: {qid}: to=<user@domain{n}.example>, '
+         'relay=mx{n}.domain{n}.example[198.51.100.{octet}]:25, delay=0.4, '
+         'delays=0.01/0/0.2/0.2, dsn=2.0.0, status=sent (250 2.0.0 OK)'),
+    (5, '{stamp} relay postfix/smtp[{pid}]: Trusted TLS connection established to '
+        'mx{n}.domain{n}.example[198.51.100.{octet}]:25: TLSv1.2 with cipher '
+        'ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)'),
+    (1, '{stamp} relay postfix/smtp[{pid}]: {qid}: to=<user@domain{n}.example>, '
+        'relay=mx{n}.domain{n}.example[198.51.100.{octet}]:25, delay=0.07, '
+        'dsn=4.7.4, status=deferred (TLS is required, but was not offered by host '
+        'mx{n}.domain{n}.example[198.51.100.{octet}])'),
+    ]
+
+
+def write_log(filename, size, seed=0):
+    """ Writes about `size` bytes of synthetic log.
+    :returns int: number of lines. """
+    rand = random.Random(seed)
+    templates = [template for weight, template in LINES for _ in range(weight)]
+    count = written = 0
+    second = 0
+    with io.open(filename, 'w', encoding='ascii', newline='\n') as f:
+        while written < size:
+            batch = []
+            for _ in range(10000):
+                second += rand.random() < 0.01
+                stamp = time.strftime(TIME_FORMAT, time.gmtime(1528000000 + second))
+                batch.append(rand.choice(templates).format(
+                    stamp=stamp, pid=rand.randrange(1000, 30000),
+                    qid='{:011X}'.format(rand.getrandbits(44)), n=rand.randrange(5000),
+                    octet=rand.randrange(1, 255)))
+            text = '\n'.join(batch) + '\n'
+            f.write(text)
+            written += len(text)
+            count += len(batch)
+    return count
+
+def run_legacy(filename):
+    """ The per-line loop of the old get_counts, without the attribution. """
+    deferred_re = re.compile('relay=([^[ ]*).* status=deferred.*TLS')
+    connected_re = re.compile('([A-Za-z]+) TLS connection established to ([^[]*)')
+    found = 0
+    with io.open(filename, encoding='ascii') as f:
+        for line in f:
+            time.strptime(line[0:15], TIME_FORMAT)
+            deferred = deferred_re.search(line)
+            connected = connected_re.search(line)
+            if connected or deferred:
+                found += 1
+    return found
+
+def run_parser(filename):
+    """ `maillog.parse`, decoding the timestamps of matching lines only. """
+    found = 0
+    decoder = timestamps.TimestampDecoder()
+    with open(filename, 'rb') as f:
+        for match in parse.matches(f):
+            decoder.decode(match.line)
+            found += 1
+    return found
+
+def run_strptime(filename):
+    """ strptime on every line. """
+    with open(filename, 'rb') as f:
+        for line in f:
+            time.strptime(line[0:15].decode('ascii'), TIME_FORMAT)
+    return 0
+
+def run_timestamps(filename):
+    """ `maillog.timestamps` on every line. """
+    decoder = timestamps.TimestampDecoder()
+    with open(filename, 'rb') as f:
+        for line in f:
+            decoder.decode(line)
+    return 0
+
+def run_correlate(filename):
+    """ `maillog.correlate` over every line, with its default bounds. """
+    correlator = correlate.Correlator()
+    decoder = timestamps.TimestampDecoder()
+    found = 0
+    with open(filename, 'rb') as f:
+        for chunk in parse.read_chunks(f):
+            found += len(correlator.add_chunk(chunk, decoder))
+    return found + len(correlator.flush())
+
+def write_archives(filename, count):
+    """ Splits a log into `count` gzipped files of about the same size,
+    like rotated logs, a line at a time. """
+    size = -(-os.path.getsize(filename) // count)
+    with open(filename, 'rb') as f:
+        for i in range(count):
+            with gzip.open('{}.{}.gz'.format(filename, count - i), 'wb') as archive:
+                written = 0
+                for line in f:
+                    archive.write(line)
+                    written += len(line)
+                    if written >= size:
+                        break
+
+def run_backfill(filename, workers=None):
+    """ `maillog.summary.count_files` over the archives of the log. """
+    counts = summary.count_files(sorted(glob.glob(filename + '.*.gz')), workers=workers)
+    return sum(counts.connected.values()) + sum(counts.deferred.values())
+
+MODES = {
+    'backfill': run_backfill,
+    'correlate': run_correlate,
+    'legacy': run_legacy,
+    'parser': run_parser,
+    'strptime': run_strptime,
+    'timestamps': run_timestamps,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=int, nargs='+', default=[64, 256],
+                         help='sizes of the synthetic logs')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES),
+                         default=['parser', 'legacy'])
+    parser.add_argument('--archives', type=int, default=8,
+                         help='rotated files to split the log into, for backfill')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                         help='processes to use for backfill')
+    args = parser.parse_args()
+    print('{:>10} {:>8} {:>10} {:>8} {:>9} {:>12} {:>8}'.format(
+        'mode', 'MB', 'lines', 'events', 'time', 'lines/s', 'MB/s'))
+    tmp = tempfile.mkdtemp()
+    try:
+        for size_mb in args.size_mb:
+            filename = os.path.join(tmp, 'maillog')
+            lines = write_log(filename, size_mb * 1024 * 1024)
+            runs = []
+            for mode in args.modes:
+                if mode == 'backfill':
+                    write_archives(filename, args.archives)
+                    runs.extend(('backfill/{}'.format(workers),
+                                 functools.partial(run_backfill, workers=workers))
+                                for workers in args.workers)
+                else:
+                    runs.append((mode, MODES[mode]))
+            for name, run in runs:
+                start = time.time()
+                events = run(filename)
+                elapsed = time.time() - start
+                print('{:>10} {:>8} {:>10} {:>8} {:>8.2f}s {:>12.0f} {:>8.1f}'.format(
+                    name, size_mb, lines, events, elapsed, lines / elapsed, size_mb / elapsed))
+                sys.stdout.flush()
+            for name in glob.glob(filename + '*'):
+                os.remove(name)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+""" Benchmarks aggregation of Google's STARTTLS delivery data.
+
+Writes a synthetic report CSV of each size, then aggregates it with the
+streaming `report.aggregate.Aggregator`, with `report.ingest` across
+worker processes, and the way the old ProcessGoogleSTARTTLSDomains.py
+did, keeping a set of every fraction per suffix. Reports rows per second
+and peak memory. Each run is a process of its own, so memory figures
+don't carry over.
+
+    python benchmarks/report_benchmark.py --rows 100000 1000000 10000000
+"""
+from __future__ import print_function
+import argparse
+import collections
+import csv
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from starttls_policy.report import aggregate
+from starttls_policy.report import ingest
+
+REGIONS = [('001', 'World'), ('019', 'Americas'), ('150', 'Europe'), ('142', 'Asia')]
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process, in MiB. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+def write_report(filename, rows, suffixes, seed=0):
+    """ Writes a report CSV with `rows` rows over `suffixes` address suffixes. """
+    rand = random.Random(seed)
+    with io.open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Address Suffix', 'Hostname Suffix', 'Direction',
+                         'UN M.49 Region Code', 'Region Name', 'Fraction Encrypted'])
+        for _ in range(rows):
+            index = rand.randrange(suffixes)
+            code, name = rand.choice(REGIONS)
+            writer.writerow(['domain{}.example'.format(index), 'mx{}.example'.format(index % 97),
+                             rand.choice(('inbound', 'outbound')), code, name,
+                             '{:.6f}'.format(1 - rand.random() ** 8)])
+
+def aggregate_with_sets(filename):
+    """ The old ProcessGoogleSTARTTLSDomains.py, for comparison. """
+    fractions = collections.defaultdict(set)
+    fractions['gmail.com'] = set([1])
+    with aggregate.open_report(filename) as f:
+        for row in aggregate.read_rows(f):
+            if row[2] == 'outbound':
+                try:
+                    fractions[aggregate.normalize_suffix(row[0])].add(float(row[5]))
+                except ValueError:
+                    pass
+    return sorted(suffix for suffix, values in fractions.items()
+                  if min(values) >= aggregate.DEFAULT_THRESHOLD)
+
+def run_once(filename, mode, rows, workers=None, chunk_size=ingest.DEFAULT_CHUNK_SIZE):
+    """ Aggregates a report once and returns a dict of stats. Peak memory
+    in parallel mode is that of the parent process only. """
+    start = time.time()
+    if mode == 'sets':
+        candidates = len(aggregate_with_sets(filename))
+    elif mode == 'parallel':
+        aggregator = ingest.ingest([filename], workers=workers, chunk_size=chunk_size)
+        candidates = sum(1 for _ in aggregator.candidates())
+    else:
+        candidates = sum(1 for _ in aggregate.aggregate([filename]).candidates())
+    elapsed = time.time() - start
+    return {
+        'mode': mode,
+        'rows': rows,
+        'candidates': candidates,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000],
+                        help='numbers of rows in the synthetic reports')
+    parser.add_argument('--suffixes', type=int, default=50000,
+                        help='distinct address suffixes in each report')
+    parser.add_argument('--modes', nargs='+', choices=['streaming', 'parallel', 'sets'],
+                        default=['streaming', 'parallel', 'sets'])
+    parser.add_argument('--workers', type=int, help='processes for parallel mode')
+    parser.add_argument('--chunk-size', type=int, default=ingest.DEFAULT_CHUNK_SIZE,
+                        help='bytes per chunk in parallel mode')
+    parser.add_argument('--one', nargs=3, metavar=('FILE', 'MODE', 'ROWS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.one is not None:
+        filename, mode, rows = args.one
+        print(json.dumps(run_once(filename, mode, int(rows), args.workers, args.chunk_size)))
+        return
+    row = '{mode:>10} {rows:>10} {candidates:>10} {seconds:>8.2f}s {rows_per_second:>11.0f} ' \
+          '{peak_rss_mb:>8.1f}'
+    print('{:>10} {:>10} {:>10} {:>9} {:>11} {:>8}'.format(
+        'mode', 'rows', 'candidates', 'time', 'rows/s', 'RSS MiB'))
+    tmp = tempfile.mkdtemp()
+    try:
+        for rows in args.rows:
+            filename = os.path.join(tmp, 'report-{}.csv'.format(rows))
+            write_report(filename, rows, args.suffixes)
+            for mode in args.modes:
+                argv = [sys.executable, os.path.abspath(__file__), '--one', filename, mode,
+                        str(rows), '--chunk-size', str(args.chunk_size)]
+                if args.workers:
+                    argv.extend(['--workers', str(args.workers)])
+                output = subprocess.check_output(argv)
+                print(row.format(**json.loads(output.decode('utf-8'))))
+                sys.stdout.flush()
+            os.remove(filename)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
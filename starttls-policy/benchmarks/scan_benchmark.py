@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+""" Benchmarks the scanner against a fake mail network on loopback.
+
+For each number of synthetic mail domains, resolves their MX records from
+a stub DNS server, probes the MX hosts through the scheduler and the scan
+pipeline, and records the results the way CheckSTARTTLS.py does. Reports
+throughput, probe latency and peak memory. Each size runs in a process of
+its own, so memory figures don't carry over from one to the next. The
+fake servers run in the same process as the scanner, so the figures are
+best compared with each other rather than with scans of real hosts.
+
+    python benchmarks/scan_benchmark.py --domains 1000 10000 100000
+"""
+from __future__ import print_function
+import argparse
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from starttls_policy.scan import cache
+from starttls_policy.scan import certs
+from starttls_policy.scan import certstore
+from starttls_policy.scan import db
+from starttls_policy.scan import pipeline
+from starttls_policy.scan import probe
+from starttls_policy.scan import resolver
+from starttls_policy.scan import schedule
+from starttls_policy.tests import fakenet
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of a list of numbers. """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def peak_rss_mb():
+    """ Peak resident memory of this process, in MiB. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+
+class TimedProbe(object):
+    """ Wraps a probe function and records how long each call took. """
+
+    def __init__(self, probe_func):
+        self._probe = probe_func
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.failures = 0
+
+    def __call__(self, host, address=None, **kwargs):
+        start = time.time()
+        result = self._probe(host, address, **kwargs)
+        elapsed = time.time() - start
+        with self._lock:
+            self.latencies.append(elapsed)
+            if not result.starttls:
+                self.failures += 1
+        return result
+
+
+def run_once(args, domains):
+    """ Scans `domains` synthetic mail domains and returns a dict of stats. """
+    options = dict(latency=args.latency, failure=args.failure, failure_rate=args.failure_rate)
+    with fakenet.FakeMailNetwork(servers=args.servers, domains=domains,
+                                 server_options=lambda index: options) as net:
+        tmp = tempfile.mkdtemp()
+        try:
+            dns = resolver.Resolver(nameservers=[net.nameserver], port=net.dns_port)
+            scheduler = schedule.Scheduler(workers=args.workers, per_ip=args.per_ip,
+                                           per_provider=args.per_provider,
+                                           ip_rate=None, provider_rate=None)
+            timed = TimedProbe(functools.partial(probe.probe, port=net.smtp_port))
+            probe_func = scheduler.wrap(timed)
+            if args.cache:
+                probe_func = cache.ProbeCache(probe=probe_func).get
+            scan_db = db.ScanDB(os.path.join(tmp, 'scans.sqlite'))
+            cert_store = certstore.CertStore(os.path.join(tmp, 'certs'))
+            start = time.time()
+            resolved = ((domain, mx_records) for domain, mx_records, error
+                        in dns.resolve_many(net.domains) if error is None)
+            scan = pipeline.Pipeline(probe_func, network_workers=4 * args.workers)
+            scanned = 0
+            for result in scan.run(db.plan_rescans(scan_db, resolved)):
+                if result.error is not None:
+                    continue
+                scan_db.record_certs(result.certs.values())
+                observations = []
+                for probed in result.probes:
+                    leaf = (result.certs.get(certs.fingerprint(probed.chain[0]))
+                            if probed.chain else None)
+                    names = leaf.names if leaf is not None else []
+                    observations.append(cert_store.observe(probed, names=names))
+                scan_db.record(result.domain, observations)
+                scanned += 1
+            elapsed = time.time() - start
+            scheduler.close()
+            scan_db.close()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    probes = len(timed.latencies)
+    return {
+        'domains': scanned,
+        'probes': probes,
+        'failed': timed.failures,
+        'seconds': elapsed,
+        'probes_per_second': probes / elapsed,
+        'domains_per_second': scanned / elapsed,
+        'p50_ms': 1000 * percentile(timed.latencies, 0.5),
+        'p99_ms': 1000 * percentile(timed.latencies, 0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        }
+
+def _child_args(args, domains):
+    argv = [sys.executable, os.path.abspath(__file__), '--one', str(domains),
+            '--servers', str(args.servers), '--workers', str(args.workers),
+            '--per-ip', str(args.per_ip), '--per-provider', str(args.per_provider),
+            '--latency', str(args.latency), '--failure-rate', str(args.failure_rate)]
+    if args.failure:
+        argv.extend(['--failure', args.failure])
+    if args.cache:
+        argv.append('--cache')
+    return argv
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--domains', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of synthetic mail domains to scan')
+    parser.add_argument('--servers', type=int, default=50, help='fake SMTP servers')
+    parser.add_argument('--workers', type=int, default=schedule.DEFAULT_WORKERS)
+    parser.add_argument('--per-ip', type=int, default=8)
+    parser.add_argument('--per-provider', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each server waits before its greeting')
+    parser.add_argument('--failure', choices=['drop', 'tempfail', 'tls'],
+                        help='failure to inject into some connections')
+    parser.add_argument('--failure-rate', type=float, default=0.05,
+                        help='fraction of connections that fail, with --failure')
+    parser.add_argument('--cache', action='store_true',
+                        help='probe each MX host once, as CheckSTARTTLS.py does; by '
+                        'default every domain is probed to measure probe throughput')
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.one is not None:
+        print(json.dumps(run_once(args, args.one)))
+        return
+    header = '{:>8} {:>8} {:>7} {:>8} {:>9} {:>10} {:>8} {:>8} {:>8}'
+    row = '{domains:>8} {probes:>8} {failed:>7} {seconds:>7.1f}s {probes_per_second:>9.1f} ' \
+          '{domains_per_second:>10.1f} {p50_ms:>8.1f} {p99_ms:>8.1f} {peak_rss_mb:>8.1f}'
+    print(header.format('domains', 'probes', 'failed', 'time', 'probes/s', 'domains/s',
+                        'p50 ms', 'p99 ms', 'RSS MiB'))
+    for domains in args.domains:
+        stats = json.loads(subprocess.check_output(_child_args(args, domains)).decode('utf-8'))
+        print(row.format(**stats))
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -51,7 +51,23 @@ setup(
             'pytest',
             'pylint',
             'mock',
-        ]
+            # For generating test certificates.
+            'cryptography',
+        ],
+        # Dependencies of the starttls_policy.scan tools.
+        'scan': [
+            'cryptography',
+            'dnspython',
+            'pyOpenSSL',
+        ],
+        # Dependencies of the starttls_policy.report tools.
+        'report': [
+            'numpy',
+        ],
+        # Reading zstd compressed logs with starttls_policy.maillog.
+        'maillog': [
+            'zstandard',
+        ],
     }
 )
 
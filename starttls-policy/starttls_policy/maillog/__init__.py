@@ -0,0 +1 @@
+""" Tools for summarizing how Postfix delivered mail over TLS, from its logs. """
@@ -0,0 +1,220 @@
+""" Joining the log lines of each delivery into per-message outcomes.
+
+Postfix logs a delivery attempt in pieces. An smtp process first logs
+its connection, as 'connect to' on failure or 'TLS connection established
+to' with the validation level of the MX certificate. It then logs the
+result for each recipient, as 'QUEUEID: to=<...>, relay=..., status=...',
+and later qmgr logs 'QUEUEID: removed' once the message leaves the queue.
+Only the status line has the queue ID, so the connection is tied to it by
+the pid of the smtp process, and attempts are gathered by queue ID until
+the message is removed.
+
+Both tables are bounded. A message or connection is dropped once it's
+gone `max_age` seconds of log time without a new line, and the least
+recently updated is dropped when a table is full. A message dropped
+before its removal is still reported, as incomplete. So memory stays
+flat, however long the log is.
+"""
+import collections
+import re
+
+DEFAULT_MAX_MESSAGES = 100000
+DEFAULT_MAX_CONNECTIONS = 10000
+# Postfix retries deferred mail at least every maximal_backoff_time, by
+# default 4000s, so a message is usually logged far more often than this.
+DEFAULT_MAX_AGE = 24 * 3600
+# Every line we're after is from one of these; see _PROGRAM.
+_SMTP_HINT = b'mtp['
+_QMGR_HINT = b'/qmgr['
+_PROGRAM = re.compile(br' postfix[\w.-]*/(smtp|lmtp|qmgr)\[(\d+)\]: ')
+_TLS = re.compile(br'([A-Za-z]+) TLS connection established to ([^[]*)')
+_CONNECT = re.compile(br'connect to ([^[]*)')
+_STATUS = re.compile(br'([0-9A-Za-z]+): to=<([^>]*)>,(?: orig_to=<[^>]*>,)?'
+                     br' relay=([^[ ,]*).*? status=([a-z]+)(?: \((.*)\))?')
+_REMOVED = b': removed'
+
+Delivery = collections.namedtuple('Delivery', [
+    'time',         # when the status was logged, in seconds since the epoch
+    'domain',       # lowercased recipient domain
+    'mx_hostname',  # lowercased relay hostname, 'none' if there was no connection
+    'validation',   # of the TLS connection to the relay, as in parse.Match;
+                    # None without TLS
+    'status',       # 'sent', 'deferred', 'bounced', 'expired', ...
+    'tls_problem',  # whether the status is explained by a TLS problem
+    ])
+
+MessageOutcome = collections.namedtuple('MessageOutcome', [
+    'queue_id',    # Postfix queue ID
+    'first',       # time of its first delivery attempt
+    'last',        # time of its last line
+    'deliveries',  # tuple of `Delivery`, in log order
+    'complete',    # whether qmgr logged its removal; False if it was evicted
+    ])
+
+# Last connection of an smtp process; validation is None without TLS.
+_Connection = collections.namedtuple('_Connection', ['time', 'mx_hostname', 'validation'])
+
+
+def _decode(name):
+    return name.decode('ascii', 'replace').lower()
+
+
+class _Message(object):
+    """ Deliveries of a queued message so far. """
+    __slots__ = ('first', 'last', 'deliveries')
+
+    def __init__(self, time):
+        self.first = self.last = time
+        self.deliveries = []
+
+
+class Correlator(object):
+    """ Joins the lines of a Postfix log, in order, into `MessageOutcome`s.
+    Not safe to share between threads.
+    """
+
+    def __init__(self, max_messages=DEFAULT_MAX_MESSAGES,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_age=DEFAULT_MAX_AGE):
+        """ :param max_messages int: most messages to hold at once.
+        :param max_connections int: most smtp processes to hold at once.
+        :param max_age float: seconds of log time after which a message or
+            connection with no new line is dropped. """
+        self.max_messages = max_messages
+        self.max_connections = max_connections
+        self.max_age = max_age
+        # Least recently updated first.
+        self._messages = collections.OrderedDict()
+        self._connections = collections.OrderedDict()
+        # Messages dropped before their removal was logged.
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._messages)
+
+    def _outcome(self, queue_id, message, complete):
+        return MessageOutcome(queue_id, message.first, message.last,
+                              tuple(message.deliveries), complete)
+
+    def _evict(self, now, finished):
+        """ Drops what's too old, or too much. """
+        oldest = now - self.max_age
+        messages = self._messages
+        while messages:
+            queue_id, message = next(iter(messages.items()))
+            if message.last >= oldest and len(messages) <= self.max_messages:
+                break
+            del messages[queue_id]
+            self.evicted += 1
+            finished.append(self._outcome(queue_id, message, False))
+        connections = self._connections
+        while connections:
+            pid, connection = next(iter(connections.items()))
+            if connection.time >= oldest and len(connections) <= self.max_connections:
+                break
+            del connections[pid]
+
+    def add(self, line, timestamp):
+        """ Takes the next log line, as bytes.
+        :returns list: `MessageOutcome`s of messages finished by it, or
+            dropped to make room. """
+        finished = []
+        if _SMTP_HINT not in line and _QMGR_HINT not in line:
+            return finished
+        found = _PROGRAM.search(line)
+        if found is None:
+            return finished
+        program, pid = found.groups()
+        body = line[found.end():]
+        if program == b'qmgr':
+            if body.endswith(_REMOVED):
+                queue_id = body[:-len(_REMOVED)].decode('ascii', 'replace')
+                message = self._messages.pop(queue_id, None)
+                if message is not None:
+                    message.last = timestamp
+                    finished.append(self._outcome(queue_id, message, True))
+            else:
+                self._add_status(body, None, timestamp)
+        else:
+            tls = _TLS.match(body)
+            connect = None if tls else _CONNECT.match(body)
+            if tls is not None:
+                self._set_connection(pid, _Connection(
+                    timestamp, _decode(tls.group(2)), tls.group(1).decode('ascii')))
+            elif connect is not None:
+                self._set_connection(pid, _Connection(timestamp, _decode(connect.group(1)), None))
+            else:
+                self._add_status(body, pid, timestamp)
+        self._evict(timestamp, finished)
+        return finished
+
+    def _set_connection(self, pid, connection):
+        self._connections.pop(pid, None)
+        self._connections[pid] = connection
+
+    def _add_status(self, body, pid, timestamp):
+        found = _STATUS.match(body)
+        if found is None:
+            return
+        queue_id, recipient, relay, status, reason = found.groups()
+        queue_id = queue_id.decode('ascii')
+        mx_hostname = _decode(relay)
+        validation = None
+        connection = self._connections.get(pid) if pid is not None else None
+        if connection is not None and connection.mx_hostname == mx_hostname:
+            validation = connection.validation
+        status = status.decode('ascii')
+        delivery = Delivery(timestamp, _decode(recipient.rpartition(b'@')[2]), mx_hostname,
+                            validation, status,
+                            status != 'sent' and reason is not None and b'TLS' in reason)
+        message = self._messages.pop(queue_id, None)
+        if message is None:
+            message = _Message(timestamp)
+        message.last = timestamp
+        message.deliveries.append(delivery)
+        self._messages[queue_id] = message
+
+    def add_chunk(self, chunk, decoder):
+        """ Takes the next chunk of whole log lines, as from
+        `parse.read_chunks`.
+        :param decoder timestamps.TimestampDecoder: for the log.
+        :returns list: `MessageOutcome`s finished by the chunk. """
+        finished = []
+        for line in chunk.split(b'\n'):
+            if _SMTP_HINT in line or _QMGR_HINT in line:
+                finished.extend(self.add(line, decoder.decode(line)))
+        return finished
+
+    def flush(self):
+        """ Ends the log: every message still held, as incomplete.
+        :returns list: `MessageOutcome`s. """
+        finished = [self._outcome(queue_id, message, False)
+                    for queue_id, message in self._messages.items()]
+        self._messages.clear()
+        self._connections.clear()
+        return finished
+
+
+class DomainOutcomes(object):
+    """ Deliveries counted by recipient domain, over `MessageOutcome`s. """
+
+    def __init__(self):
+        # domain -> (status, validation) -> deliveries
+        self.counts = collections.defaultdict(collections.Counter)
+        # domain -> deliveries not sent because of a TLS problem
+        self.tls_problems = collections.Counter()
+        self.messages = 0
+
+    def add(self, outcome):
+        """ Counts the deliveries of a `MessageOutcome`. """
+        self.messages += 1
+        for delivery in outcome.deliveries:
+            self.counts[delivery.domain][(delivery.status, delivery.validation)] += 1
+            if delivery.tls_problem:
+                self.tls_problems[delivery.domain] += 1
+
+    def add_all(self, outcomes):
+        """ Counts each of `outcomes`.
+        :returns DomainOutcomes: self. """
+        for outcome in outcomes:
+            self.add(outcome)
+        return self
@@ -0,0 +1,196 @@
+""" Reading only the new part of a log, across runs and rotations.
+
+A `LogFollower` checkpoints where it stopped as the device and inode of
+the log file, the byte offset just past the last whole line it read, and
+a hash of that line. Resuming is a seek. Before seeking, the hash is
+checked, and the log is read from the start if the file was truncated or
+replaced. If the log was rotated since the checkpoint, the rest of the
+rotated file, found by its inode, is read before the new one.
+
+`follow` keeps reading as the log grows, like `tail -F`. It reopens the
+log when it is rotated and rereads it when it is truncated.
+"""
+import collections
+import hashlib
+import io
+import json
+import os
+import time
+
+from starttls_policy import util
+from starttls_policy.maillog import parse
+
+DEFAULT_INTERVAL = 1.0
+
+Position = collections.namedtuple('Position', [
+    'device',       # st_dev of the log file
+    'inode',        # st_ino of the log file
+    'offset',       # bytes read, up to the end of the last whole line
+    'line_length',  # length of that line, including its newline
+    'line_hash',    # hex SHA-256 of that line
+    ])
+
+
+def _line_hash(line):
+    return hashlib.sha256(line).hexdigest()
+
+def load_position(filename):
+    """ Reads a `Position` saved by `save_position`, or None if there's none. """
+    if not os.path.exists(filename):
+        return None
+    with io.open(filename, encoding='utf-8') as f:
+        state = json.load(f)
+    return Position(*[state[field] for field in Position._fields])
+
+def save_position(filename, position):
+    """ Writes a `Position`, and syncs it to disk. """
+    data = json.dumps(dict(zip(Position._fields, position)), sort_keys=True)
+    util.write_atomically(filename, data.encode('utf-8'), sync=True)
+
+
+class LogFollower(object):
+    """ Reads a log file in chunks of whole lines, from where the last run
+    stopped. Not safe to share between threads.
+    """
+
+    def __init__(self, filename, checkpoint=None, rotated=None,
+                 chunk_size=parse.CHUNK_SIZE):
+        """ :param checkpoint str: file the position is saved to by `save`,
+            and resumed from. Without one, the log is read from the start.
+        :param rotated list: where rotation moves the log to, checked in
+            order for the file last read; defaults to `filename`.1. """
+        self.filename = filename
+        self.checkpoint = checkpoint
+        self.rotated = [filename + '.1'] if rotated is None else rotated
+        self.chunk_size = chunk_size
+        self._file = None
+        self._identity = None
+        self._offset = 0
+        self._last_line = b''
+        # Files to read after the current one, when catching up on a rotation.
+        self._pending = []
+
+    @property
+    def position(self):
+        """ `Position` just past the last chunk returned, or None. """
+        if self._identity is None:
+            return None
+        return Position(self._identity[0], self._identity[1], self._offset,
+                        len(self._last_line), _line_hash(self._last_line))
+
+    def save(self):
+        """ Saves the position to the checkpoint file. Call it once the
+        chunks read so far have been dealt with. """
+        position = self.position
+        if self.checkpoint is not None and position is not None:
+            save_position(self.checkpoint, position)
+
+    def close(self):
+        """ Closes the log file. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self, filename, offset=0, last_line=b''):
+        self.close()
+        self._file = open(filename, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        self._file.seek(offset)
+        self._offset = offset
+        self._last_line = last_line
+
+    def _matches(self, filename, position):
+        """ The last line read, if `filename` is the file of `position`
+        and still has it; otherwise None. """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        if (stat.st_dev, stat.st_ino) != (position.device, position.inode):
+            return None
+        if stat.st_size < position.offset:
+            return None
+        with open(filename, 'rb') as f:
+            f.seek(position.offset - position.line_length)
+            line = f.read(position.line_length)
+        if _line_hash(line) != position.line_hash:
+            return None
+        return line
+
+    def _start(self):
+        """ Opens the log where the checkpoint says, or at its start. """
+        position = None
+        if self.checkpoint is not None:
+            position = load_position(self.checkpoint)
+        if position is not None:
+            for name in [self.filename] + self.rotated:
+                line = self._matches(name, position)
+                if line is None:
+                    continue
+                self._open(name, position.offset, line)
+                if name != self.filename:
+                    self._pending = [self.filename]
+                return
+        self._open(self.filename)
+
+    def _read(self):
+        """ Reads whole lines up to the end of the current file. A last line
+        without a newline is left for next time. """
+        rest = b''
+        while True:
+            data = self._file.read(self.chunk_size)
+            if not data:
+                break
+            chunk = rest + data if rest else data
+            end = chunk.rfind(b'\n') + 1
+            if not end:
+                rest = chunk
+                continue
+            rest = chunk[end:]
+            chunk = chunk[:end]
+            self._offset += end
+            self._last_line = chunk[chunk.rfind(b'\n', 0, end - 1) + 1:]
+            yield chunk
+        if rest:
+            self._file.seek(self._offset)
+
+    def _next_file(self):
+        """ Moves to the file to read next, if there is one. The log counts
+        as rotated once its name refers to a new file, and as truncated once
+        it is shorter than what was read.
+        :returns bool: whether there may be more to read. """
+        if self._pending:
+            self._open(self._pending.pop(0))
+            return True
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        if (stat.st_dev, stat.st_ino) != self._identity:
+            self._open(self.filename)
+            return True
+        if stat.st_size < self._offset:
+            self._open(self.filename)
+            return True
+        return False
+
+    def chunks(self):
+        """ Iterates chunks of whole lines, as bytes, from the checkpoint up
+        to the current end of the log. Can be called again to get lines
+        written since. """
+        if self._file is None:
+            self._start()
+        while True:
+            for chunk in self._read():
+                yield chunk
+            if not self._next_file():
+                return
+
+    def follow(self, interval=DEFAULT_INTERVAL, sleep=time.sleep):
+        """ Like `chunks`, but never stops: at the end of the log, waits
+        `interval` seconds for more. """
+        while True:
+            for chunk in self.chunks():
+                yield chunk
+            sleep(interval)
@@ -0,0 +1,104 @@
+""" Fast extraction of TLS events from Postfix logs.
+
+Nearly every line in a mail log is irrelevant to TLS. Input is read in
+large binary chunks, and each chunk is searched for a marker that every
+interesting line contains, in C, without splitting the chunk into lines.
+Only the lines around a hit are cut out, checked against a cheaper
+substring, and then matched with one combined pattern. Nothing is decoded
+except the hostnames of matching lines.
+"""
+import collections
+import re
+
+CHUNK_SIZE = 1024 * 1024
+CONNECTED = 'connected'
+DEFERRED = 'deferred'
+# Every line we're after contains this.
+_MARKER = b'TLS'
+_CONNECTED_HINT = b' TLS connection established to '
+_DEFERRED_HINT = b'status=deferred'
+# Typical lines look like, wrapped here:
+# Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established
+#     to valid-example-recipient.com[192.168.33.7]:25: TLSv1.1 with cipher
+#     AECDH-AES256-SHA (256/256 bits)
+# Oct 10 19:12:13 sender postfix/smtp[1711]: 62D3F481249:
+#     to=<vagrant@valid-example-recipient.com>,
+#     relay=valid-example-recipient.com[192.168.33.7]:25, delay=0.07,
+#     delays=0.03/0.01/0.03/0, dsn=4.7.4, status=deferred (TLS is required, but
+#     was not offered by host valid-example-recipient.com[192.168.33.7])
+# The first can tell Untrusted, Trusted and Verified certificates apart;
+# the second is mail deferred for a TLS-related reason.
+# ([^[]*) <--- any group of characters that is not "["
+_PATTERN = re.compile(br'([A-Za-z]+) TLS connection established to ([^[]*)'
+                      br'|relay=([^[ ]*).* status=deferred.*TLS')
+
+Match = collections.namedtuple('Match', [
+    'kind',        # CONNECTED or DEFERRED
+    'line',        # the whole log line, as bytes without the newline
+    'mx_hostname', # lowercased MX hostname
+    'validation',  # 'Anonymous', 'Untrusted', 'Trusted' or 'Verified'
+                   # for CONNECTED, None for DEFERRED
+    ])
+
+
+def _decode(name):
+    return name.decode('ascii', 'replace').lower()
+
+def match_line(line):
+    """ Matches one log line, as bytes.
+    :returns Match: or None if the line isn't a TLS event. """
+    if _CONNECTED_HINT not in line and _DEFERRED_HINT not in line:
+        return None
+    found = _PATTERN.search(line)
+    if found is None:
+        return None
+    validation, connected_host, deferred_host = found.groups()
+    if connected_host is not None:
+        return Match(CONNECTED, line, _decode(connected_host), validation.decode('ascii'))
+    return Match(DEFERRED, line, _decode(deferred_host), None)
+
+def match_chunk(chunk, start=0, end=None):
+    """ Iterates the `Match` of each TLS event in part of a chunk of log
+    lines. `start` and `end` must be line boundaries. """
+    end = len(chunk) if end is None else end
+    find = chunk.find
+    position = find(_MARKER, start, end)
+    while position >= 0:
+        line_start = max(chunk.rfind(b'\n', start, position) + 1, start)
+        line_end = find(b'\n', position, end)
+        if line_end < 0:
+            line_end = end
+        match = match_line(chunk[line_start:line_end])
+        if match is not None:
+            yield match
+        position = find(_MARKER, line_end, end)
+
+def read_chunks(f, chunk_size=CHUNK_SIZE):
+    """ Reads a binary file in chunks of whole lines, of about `chunk_size`
+    bytes; a line longer than that is a chunk of its own. """
+    rest = b''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        chunk = rest + data if rest else data
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            rest = chunk
+            continue
+        rest = chunk[end:]
+        yield chunk[:end]
+    if rest:
+        yield rest
+
+def match_chunks(chunks):
+    """ Iterates the `Match` of each TLS event in chunks of whole lines, as
+    from `read_chunks` or `follow.LogFollower.chunks`. """
+    for chunk in chunks:
+        for match in match_chunk(chunk):
+            yield match
+
+def matches(f, chunk_size=CHUNK_SIZE):
+    """ Iterates the `Match` of each TLS event in a log file opened in
+    binary mode. """
+    return match_chunks(read_chunks(f, chunk_size))
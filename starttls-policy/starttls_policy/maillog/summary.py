@@ -0,0 +1,148 @@
+""" Counting TLS events in Postfix logs, one file per worker process.
+
+A `LogCounts` counts events by MX hostname, which is all a log line
+says. Attributing hostnames to mail domains is left until the end, since
+a log has few distinct MX hostnames however long it is. Counts from
+different files merge by adding, so files can be counted in parallel,
+and rotated, gzip or zstd compressed logs are counted in a pool of
+processes. Merging goes in time order, by the first event in each file.
+"""
+import collections
+import gzip
+import multiprocessing
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from starttls_policy.maillog import parse
+from starttls_policy.maillog import timestamps
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Validation levels where the certificate of the MX was checked.
+_TRUSTED = ('Trusted', 'Verified')
+
+
+def open_log(filename):
+    """ Opens a log file for reading in binary mode, decompressing it if it's
+    compressed with gzip or zstd. Compression is told by content, not name.
+    :raises ValueError: for a zstd file, if zstandard isn't installed. """
+    f = open(filename, 'rb')
+    magic = f.read(len(_ZSTD_MAGIC))
+    f.seek(0)
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if magic == _ZSTD_MAGIC:
+        if zstandard is None:
+            f.close()
+            raise ValueError('{} is compressed with zstd; reading it needs zstandard,'
+                             ' from the "maillog" extra'.format(filename))
+        return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+    return f
+
+
+class LogCounts(object):
+    """ TLS events counted by MX hostname. Plain counters only, so it can
+    be pickled back from worker processes. """
+
+    def __init__(self):
+        # (mx_hostname, validation) -> connections
+        self.connected = collections.Counter()
+        # mx_hostname -> deliveries deferred for a TLS problem
+        self.deferred = collections.Counter()
+        # Times of the first and last events counted, in seconds since the epoch.
+        self.first = None
+        self.last = None
+
+    @property
+    def seen_trusted(self):
+        """ Whether any connection checked the MX's certificate. """
+        return any(validation in _TRUSTED for _, validation in self.connected)
+
+    def add(self, match, timestamp):
+        """ Counts a `parse.Match` logged at `timestamp`. """
+        if match.kind == parse.CONNECTED:
+            self.connected[(match.mx_hostname, match.validation)] += 1
+        else:
+            self.deferred[match.mx_hostname] += 1
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+
+    def add_matches(self, matches, decoder, earliest=None):
+        """ Counts `parse.Match`es, skipping those logged before `earliest`.
+        :param decoder timestamps.TimestampDecoder: for the log they're from.
+        :returns LogCounts: self. """
+        for match in matches:
+            timestamp = decoder.decode(match.line)
+            if earliest is not None and timestamp < earliest:
+                continue
+            self.add(match, timestamp)
+        return self
+
+    def merge(self, other):
+        """ Adds the counts of another `LogCounts`, of a later part of the log. """
+        self.connected.update(other.connected)
+        self.deferred.update(other.deferred)
+        if self.first is None:
+            self.first = other.first
+        if other.last is not None:
+            self.last = other.last
+
+    def domain_counts(self, attribute):
+        """ Connections per group of mail domains, as counted by the
+        PostfixLogSummary tool.
+        :param attribute: function from an MX hostname to the sorted mail
+            domains it serves; hostnames with none aren't counted.
+        :returns dict: of ', '-joined domains to a dict of validation levels,
+            and 'all', to connections. """
+        counts = collections.defaultdict(collections.Counter)
+        for (mx_hostname, validation), count in self.connected.items():
+            domains = attribute(mx_hostname)
+            if domains:
+                key = ', '.join(domains)
+                counts[key][validation] += count
+                counts[key]['all'] += count
+        return counts
+
+
+def count_file(job):
+    """ Counts the TLS events in one log file. A top-level function so
+    process pools can run it.
+    Traditional syslog timestamps have no year; it's inferred from the
+    file's modification time.
+    :param job tuple: (filename, earliest), where events logged before
+        `earliest` aren't counted; None counts everything.
+    :returns LogCounts: """
+    filename, earliest = job
+    decoder = timestamps.TimestampDecoder(reference=os.path.getmtime(filename))
+    f = open_log(filename)
+    try:
+        return LogCounts().add_matches(parse.matches(f), decoder, earliest)
+    finally:
+        f.close()
+
+def count_files(filenames, earliest=None, workers=None):
+    """ Counts the TLS events in log files, plain or compressed, using a pool
+    of worker processes.
+    :param workers int: processes to use; defaults to one per CPU.
+    :returns LogCounts: of all the files, merged in order of their first
+        event. """
+    jobs = [(filename, earliest) for filename in filenames]
+    if workers == 1 or len(jobs) <= 1:
+        partials = [count_file(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            partials = pool.map(count_file, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+    result = LogCounts()
+    for partial in sorted((partial for partial in partials if partial.first is not None),
+                          key=lambda partial: partial.first):
+        result.merge(partial)
+    return result
@@ -0,0 +1,134 @@
+""" Fast decoding of the timestamps that start syslog lines.
+
+Two formats are understood:
+  - the traditional 'Jun 12 06:24:14', in local time and without a year
+  - RFC 5424/RFC 3339 '2018-06-12T06:24:14.123456+02:00', optionally
+    after an RFC 5424 '<PRI>1 ' header
+
+Consecutive lines nearly always share a timestamp, so the last one
+decoded is remembered and reused. Otherwise the fixed-width fields are
+read directly, with no strptime. The seconds since the epoch of the start
+of each hour are cached, so the local-time conversion needs one
+time.mktime per hour of log.
+
+A year is inferred for traditional timestamps. The first one is put in
+the year of a reference time (by default now), or the year before if its
+month is later than the reference's. After that, the year advances when
+the month jumps back, as from December to January.
+"""
+import calendar
+import time
+
+# calendar.month_abbr follows the locale; syslog doesn't.
+_MONTHS = dict((name, number) for number, name in enumerate(
+    ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])
+               if name)
+# Length of 'Jun 12 06:24:14' and '2018-06-12T06:24:14'.
+_SYSLOG_LENGTH = 15
+_ISO_LENGTH = 19
+# Longest RFC 5424 header plus RFC 3339 timestamp we look at.
+_MAX_HEADER = 64
+# A change of month by more than this many months is a change of year.
+_ROLLOVER = 6
+
+
+def _text(value):
+    """ `value` as a str, whether it's bytes or text. """
+    return value if isinstance(value, str) else value.decode('ascii', 'replace')
+
+
+class TimestampDecoder(object):
+    """ Decodes the timestamps at the start of log lines into seconds since
+    the epoch. Not safe to share between threads; keep one per log stream,
+    since it tracks the year of traditional timestamps.
+    """
+
+    def __init__(self, reference=None):
+        """ :param reference float: a time, in seconds since the epoch, that
+            isn't long after the first line of the log; for example, the
+            log file's modification time. Defaults to now. """
+        self.reference = time.time() if reference is None else reference
+        self._year = None
+        self._month = None
+        self._last_prefix = None
+        self._last_value = None
+        self._last_stamp = None
+        self._last_stamp_value = None
+        self._local_hours = {}
+        self._utc_hours = {}
+
+    def decode(self, line):
+        """ Seconds since the epoch at the start of a log line.
+        :param line: bytes or str.
+        :raises ValueError: if the line doesn't start with a timestamp. """
+        prefix = line[:_SYSLOG_LENGTH]
+        if prefix == self._last_prefix:
+            return self._last_value
+        head = _text(line[:_MAX_HEADER])
+        if head[:1] == '<':
+            # RFC 5424 header: '<PRI>VERSION '.
+            head = head[head.find(' ') + 1:]
+        if not head[:1].isdigit():
+            value = self._decode_syslog(head[:_SYSLOG_LENGTH])
+            self._last_prefix, self._last_value = prefix, value
+            return value
+        # The first 15 characters of an RFC 3339 timestamp stop short of its
+        # seconds, so the whole timestamp is the key.
+        stamp = head.split(' ', 1)[0]
+        if stamp != self._last_stamp:
+            self._last_stamp, self._last_stamp_value = stamp, self._decode_iso(stamp)
+        return self._last_stamp_value
+
+    def _decode_syslog(self, prefix):
+        try:
+            month = _MONTHS[prefix[0:3]]
+            day, hour = int(prefix[4:6]), int(prefix[7:9])
+            minute, second = int(prefix[10:12]), int(prefix[13:15])
+        except (KeyError, ValueError):
+            raise ValueError('Not a syslog timestamp: {!r}'.format(prefix))
+        year = self._year_of(month)
+        key = (year, month, day, hour)
+        start = self._local_hours.get(key)
+        if start is None:
+            start = self._local_hours[key] = time.mktime(
+                (year, month, day, hour, 0, 0, 0, 0, -1))
+        return start + minute * 60 + second
+
+    def _year_of(self, month):
+        if self._year is None:
+            reference = time.localtime(self.reference)
+            self._year = reference.tm_year - (month > reference.tm_mon)
+            self._month = month
+        elif month < self._month - _ROLLOVER:
+            self._year += 1
+            self._month = month
+        elif month > self._month + _ROLLOVER:
+            # A late line from before the last rollover.
+            return self._year - 1
+        else:
+            self._month = month
+        return self._year
+
+    def _decode_iso(self, text):
+        try:
+            year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+            hour, minute, second = int(text[11:13]), int(text[14:16]), int(text[17:19])
+            if text[4] != '-' or text[10] not in 'Tt ':
+                raise ValueError(text)
+            rest = text[_ISO_LENGTH:]
+            fraction = 0.0
+            if rest[:1] == '.':
+                digits = len(rest) - len(rest[1:].lstrip('0123456789'))
+                fraction = float(rest[:digits])
+                rest = rest[digits:]
+            offset = 0
+            if rest and rest not in 'Zz':
+                sign = -1 if rest[0] == '-' else 1
+                offset = sign * (int(rest[1:3]) * 3600 + int(rest[4:6]) * 60)
+        except (ValueError, IndexError):
+            raise ValueError('Not an RFC 5424 timestamp: {!r}'.format(text))
+        key = (year, month, day, hour)
+        start = self._utc_hours.get(key)
+        if start is None:
+            start = self._utc_hours[key] = calendar.timegm((year, month, day, hour, 0, 0))
+        return start + minute * 60 + second + fraction - offset
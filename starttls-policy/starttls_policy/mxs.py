@@ -0,0 +1,61 @@
+""" Attributing MX hostnames to the mail domains whose policies list them.
+
+An `mxs` entry is either a hostname, matched exactly, or a suffix with a
+leading dot, like '.example.net', matched by any name under it however
+deep. An `MXIndex` compiles the `mxs` of every policy into a trie keyed
+on reversed labels, as `scan.suffix` does for the public suffix list, so
+finding the domains of a hostname is one walk down the trie, whatever the
+number of policies. Hostnames already looked up are remembered, since a
+mail log names the same few MX hosts over and over.
+"""
+from starttls_policy import util
+from starttls_policy.scan import suffix
+
+DEFAULT_MAX_HOSTS = 100000
+# The domains of a hostname only change with the policies, and a new
+# index is built then, so memoized ones don't expire.
+_FOREVER = float('inf')
+# Keys in a trie node for the mail domains of the patterns that end there:
+# an exact hostname, or a suffix matching only names below the node.
+# Distinct from any label, even an empty one.
+_EXACT = object()
+_SUFFIX = object()
+
+
+class MXIndex(object):
+    """ The `mxs` patterns of a policy `Config`, compiled for looking up
+    hostnames. Safe to share between threads.
+    """
+
+    def __init__(self, mxs, max_hosts=DEFAULT_MAX_HOSTS):
+        """ :param mxs: iterable of (mail domain, list of `mxs` patterns).
+        :param max_hosts int: most hostnames to remember the domains of. """
+        self._trie = {}
+        for domain, patterns in mxs:
+            for pattern in patterns:
+                node = self._trie
+                for label in suffix.labels(pattern):
+                    node = node.setdefault(label, {})
+                node.setdefault(_SUFFIX if pattern.startswith('.') else _EXACT,
+                                set()).add(domain)
+        self._memo = util.TTLCache(max_hosts)
+
+    def _lookup(self, labels):
+        domains = set()
+        node = self._trie
+        for label in labels:
+            if _SUFFIX in node:
+                domains.update(node[_SUFFIX])
+            node = node.get(label)
+            if node is None:
+                break
+        else:
+            domains.update(node.get(_EXACT, ()))
+        return tuple(sorted(domains))
+
+    def domains(self, hostname):
+        """ Mail domains with an `mxs` pattern matching `hostname`.
+        :returns tuple: sorted mail domains; empty if there are none. """
+        hostname = hostname.lower().rstrip('.')
+        return self._memo.get_or_compute(
+            hostname, lambda: (self._lookup(suffix.labels(hostname)), _FOREVER))
@@ -0,0 +1,93 @@
+""" Checking certificate chains against `static-spki-hashes` pinsets.
+
+A pin is 'sha1/<base64>' or 'sha256/<base64>': a digest of the DER
+SubjectPublicKeyInfo of a certificate. A `PinIndex` decodes each pinset
+once into a set of (algorithm, digest) pairs, and digests each
+certificate it's shown once, remembering the digests by the certificate's
+fingerprint. Checking a chain is then a set lookup per certificate.
+
+Pinsets can be read without cryptography, but checking a chain against
+them parses its certificates with `scan.certs`, and so needs the "scan"
+extra.
+"""
+import base64
+import binascii
+import hashlib
+
+import six
+
+from starttls_policy import util
+
+try:
+    from starttls_policy.scan import certs
+except ImportError:
+    certs = None
+
+ALGORITHMS = ('sha1', 'sha256')
+DEFAULT_MAX_CERTS = 10000
+# A certificate's digests never change, so memoized ones don't expire.
+_FOREVER = float('inf')
+
+
+def parse_pin(pin):
+    """ Decodes a pin.
+    :returns tuple: (algorithm, digest bytes).
+    :raises util.ConfigError: if it isn't a well-formed pin. """
+    algorithm, _, encoded = pin.partition('/')
+    if algorithm not in ALGORITHMS:
+        raise util.ConfigError('Pin {} does not use one of {}'.format(
+            pin, ', '.join(ALGORITHMS)))
+    try:
+        digest = base64.b64decode(encoded.encode('ascii'))
+    except (TypeError, ValueError, binascii.Error):
+        raise util.ConfigError('Pin {} is not valid base64'.format(pin))
+    if len(digest) != hashlib.new(algorithm).digest_size:
+        raise util.ConfigError('Pin {} is not a {} digest'.format(pin, algorithm))
+    return algorithm, digest
+
+def spki_digests(der):
+    """ Every pin that a DER-encoded certificate matches.
+    :returns frozenset: of (algorithm, digest bytes) pairs.
+    :raises ValueError: if the certificate is malformed, or cryptography
+        isn't installed. """
+    if certs is None:
+        raise ValueError('Checking pins needs cryptography, from the "scan" extra')
+    key = certs.spki(der)
+    return frozenset((algorithm, hashlib.new(algorithm, key).digest())
+                     for algorithm in ALGORITHMS)
+
+
+class PinIndex(object):
+    """ Decoded pinsets of a policy `Config`, for checking certificate
+    chains against. Safe to share between threads.
+    """
+
+    def __init__(self, pinsets, max_certs=DEFAULT_MAX_CERTS):
+        """ :param pinsets dict: pinset name to a dict with a
+            `static-spki-hashes` list, as in `Config.pinsets`.
+        :param max_certs int: most certificates to remember digests of.
+        :raises util.ConfigError: if a pin is malformed. """
+        self._pinsets = {}
+        for name, pinset in six.iteritems(pinsets):
+            self._pinsets[name] = frozenset(
+                parse_pin(pin) for pin in pinset.get('static-spki-hashes', []))
+        self._digests = util.TTLCache(max_certs)
+
+    def __contains__(self, name):
+        return name in self._pinsets
+
+    def digests(self, der):
+        """ Memoized `spki_digests`. """
+        return self._digests.get_or_compute(
+            hashlib.sha256(der).digest(), lambda: (spki_digests(der), _FOREVER))
+
+    def check(self, name, der_chain):
+        """ Whether any certificate in a chain has a key pinned by pinset `name`.
+        :param der_chain list: DER-encoded certificates, leaf first.
+        :raises KeyError: if there is no such pinset.
+        :raises ValueError: if a certificate is malformed. """
+        pins = self._pinsets[name]
+        for der in der_chain:
+            if not pins.isdisjoint(self.digests(der)):
+                return True
+        return False
@@ -6,6 +6,8 @@ import json
 import six
 from starttls_policy import util
 from starttls_policy import constants
+from starttls_policy import mxs
+from starttls_policy import pins
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
@@ -264,6 +266,8 @@ class Config(MergableConfig):
     # pylint: disable=dangerous-default-value
         super(Config, self).__init__(schema)
         self.filename = filename
+        self._pin_index = None
+        self._mx_index = None
 
     def load(self):
         """Loads JSON configuration from file specified by `filename` property.
@@ -284,13 +288,13 @@ class Config(MergableConfig):
     def flush(self, filename=None):
         """Flushes configuration to a file as JSON-ified string.
         If a new filename is not given, uses `filename` property.
+        The file is replaced atomically, so readers never see a partial config.
         """
         if self._data is None:
             return # no data loaded yet
         if filename is None:
             filename = self.filename
-        with open(self.filename, 'w') as f:
-            f.write(self.dump())
+        util.write_atomically(filename, self.dump().encode('utf-8'))
 
     @property
     def author(self):
@@ -352,6 +356,7 @@ class Config(MergableConfig):
             else:
                 policies[domain] = Policy(obj, self.pinsets, self.policy_aliases)
         self._set_attr('policies', policies)
+        self._mx_index = None
 
     def policies_iter(self):
         """ Iterates TLS policies in the configuration file.
@@ -371,6 +376,28 @@ class Config(MergableConfig):
         """ Setter for pinsets in this configuration file.
         :returns: pinsets """
         self._set_attr('pinsets', value)
+        self._pin_index = None
+
+    @property
+    def pin_index(self):
+        """ Decoded pinsets, built on first use after they are set.
+        :returns pins.PinIndex: """
+        if self._pin_index is None:
+            self._pin_index = pins.PinIndex(self.pinsets)
+        return self._pin_index
+
+    def check_pin(self, mail_domain, der_chain):
+        """ Checks a certificate chain presented by an MX host of
+        `mail_domain` against the pinset of the domain's policy.
+        :param der_chain list: DER-encoded certificates, leaf first.
+        :returns: True if a certificate in the chain has a pinned key, False
+            if none does, or None if the domain has no policy or no pin. """
+        if mail_domain not in (self.policies or {}):
+            return None
+        pin = self.get_policy_for(mail_domain).pin
+        if pin is None:
+            return None
+        return self.pin_index.check(pin, der_chain)
 
     @property
     def policy_aliases(self):
@@ -386,6 +413,25 @@ class Config(MergableConfig):
         for domain, obj in six.iteritems(value):
             policies[domain] = PolicyNoAlias(obj, self.pinsets)
         self._set_attr('policy-aliases', policies)
+        self._mx_index = None
+
+    @property
+    def mx_index(self):
+        """ Compiled `mxs` of every policy, built on first use after the
+        policies or policy aliases are set.
+        :returns mxs.MXIndex: """
+        if self._mx_index is None:
+            self._mx_index = mxs.MXIndex(
+                (domain, policy.mxs) for domain, policy in self.policies_iter())
+        return self._mx_index
+
+    def get_domains_for_mx(self, mx_hostname):
+        """ Mail domains whose policy lists an `mxs` pattern matching
+        `mx_hostname`, such as a host named in a mail log.
+        :returns tuple: sorted mail domains; empty if there are none. """
+        if not self.policies:
+            return ()
+        return self.mx_index.domains(mx_hostname)
 
     def get_policy_for(self, mail_domain):
         """ Getter for TLS policies in this configuration file.
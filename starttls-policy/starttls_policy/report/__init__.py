@@ -0,0 +1,2 @@
+""" Tools for finding policy candidates in Google's Transparency Report
+data on encrypted email delivery. """
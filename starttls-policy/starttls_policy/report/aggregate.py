@@ -0,0 +1,159 @@
+""" Streaming aggregation of Google's STARTTLS delivery data.
+
+The data is a CSV file from
+https://transparencyreport.google.com/safer-email/overview with a row per
+(address suffix, hostname suffix, direction, region) and the fraction of
+that mail that was encrypted. A mail domain is a policy candidate if every
+outbound row for it is at or above a threshold. Only a running minimum,
+a row count and the regions seen are kept for each address suffix, so
+memory grows with the number of distinct suffixes, not the number of rows.
+"""
+import collections
+import csv
+import io
+
+DEFAULT_THRESHOLD = 0.99
+DIRECTION = 'outbound'
+# Some domains exist in many TLDs and are summarized as e.g. yahoo.{...}.
+# Until we have a list of the relevant TLDs, .com stands in for them all.
+WILDCARD_TLD = '{...}'
+WILDCARD_REPLACEMENT = 'com'
+# Google's report doesn't include gmail.com because it's local delivery,
+# but we know it supports STARTTLS.
+KNOWN_ENCRYPTED = {'gmail.com': 1.0}
+# Fields in a row of the report.
+COLUMNS = 6
+
+SuffixStats = collections.namedtuple('SuffixStats', [
+    'suffix',        # address suffix, i.e. mail domain
+    'min_fraction',  # lowest fraction of mail encrypted in any row
+    'count',         # number of rows for the suffix
+    'regions',       # sorted UN M.49 codes of the regions in those rows
+    ])
+
+
+def open_report(filename):
+    """ Opens a report CSV file for `read_rows`. """
+    return io.open(filename, encoding='utf-8', newline='')
+
+def read_rows(f):
+    """ Iterates the rows of a report CSV file, as lists of strings. """
+    return csv.reader(f, delimiter=',', quotechar='"')
+
+def normalize_suffix(address_suffix):
+    """ Address suffix with a wildcard TLD replaced by `WILDCARD_REPLACEMENT`. """
+    return address_suffix.replace(WILDCARD_TLD, WILDCARD_REPLACEMENT)
+
+
+class Aggregator(object):
+    """ Running per-suffix minima of the fraction of mail encrypted, over
+    the rows of one or more reports.
+    """
+
+    def __init__(self, direction=DIRECTION, known=None):
+        """ :param direction str: only rows in this direction are counted.
+        :param known dict: suffixes to seed with a fraction, for domains the
+            report leaves out. Defaults to `KNOWN_ENCRYPTED`. """
+        if known is None:
+            known = KNOWN_ENCRYPTED
+        self.direction = direction
+        self.rows = 0
+        self.skipped = 0
+        # Suffix to [min fraction, row count, set of region codes].
+        self._stats = {}
+        for suffix, fraction in known.items():
+            self._stats[suffix] = [fraction, 0, set()]
+
+    def __len__(self):
+        return len(self._stats)
+
+    def add(self, address_suffix, region, fraction):
+        """ Counts one row's fraction of mail encrypted for a suffix. """
+        suffix = normalize_suffix(address_suffix)
+        stats = self._stats.get(suffix)
+        if stats is None:
+            self._stats[suffix] = [fraction, 1, set([region])]
+            return
+        if fraction < stats[0]:
+            stats[0] = fraction
+        stats[1] += 1
+        stats[2].add(region)
+
+    def add_rows(self, rows):
+        """ Counts report rows, as returned by `read_rows`. Rows in the other
+        direction, and the header, are ignored; malformed rows are counted
+        in `skipped`.
+        :returns: self, for chaining. """
+        # Inlines `add`, since this loop is where all the time goes.
+        direction = self.direction
+        all_stats = self._stats
+        count = skipped = 0
+        for row in rows:
+            count += 1
+            if len(row) != COLUMNS:
+                skipped += 1
+                continue
+            address_suffix, _, row_direction, region, _, fraction = row
+            if row_direction != direction:
+                continue
+            try:
+                fraction = float(fraction)
+            except ValueError:
+                skipped += 1
+                continue
+            if WILDCARD_TLD in address_suffix:
+                address_suffix = normalize_suffix(address_suffix)
+            stats = all_stats.get(address_suffix)
+            if stats is None:
+                all_stats[address_suffix] = [fraction, 1, set([region])]
+                continue
+            if fraction < stats[0]:
+                stats[0] = fraction
+            stats[1] += 1
+            stats[2].add(region)
+        self.rows += count
+        self.skipped += skipped
+        return self
+
+    def merge(self, other):
+        """ Folds in the counts of another `Aggregator`.
+        :returns: self, for chaining. """
+        self.rows += other.rows
+        self.skipped += other.skipped
+        for other_stats in other.stats():
+            stats = self._stats.get(other_stats.suffix)
+            if stats is None:
+                self._stats[other_stats.suffix] = [other_stats.min_fraction, other_stats.count,
+                                                   set(other_stats.regions)]
+                continue
+            stats[0] = min(stats[0], other_stats.min_fraction)
+            stats[1] += other_stats.count
+            stats[2].update(other_stats.regions)
+        return self
+
+    def stats(self):
+        """ Iterates the `SuffixStats` of every suffix, in no particular order. """
+        for suffix, (fraction, count, regions) in self._stats.items():
+            yield SuffixStats(suffix, fraction, count, sorted(regions))
+
+    def results(self):
+        """ Iterates the `SuffixStats` of every suffix, sorted by suffix. """
+        for stats in sorted(self.stats(), key=lambda stats: stats.suffix):
+            yield stats
+
+    def candidates(self, threshold=DEFAULT_THRESHOLD):
+        """ Iterates the `SuffixStats` of suffixes whose minimum fraction of
+        mail encrypted is at least `threshold`, sorted by suffix. """
+        for stats in self.results():
+            if stats.min_fraction >= threshold:
+                yield stats
+
+
+def aggregate(filenames, direction=DIRECTION):
+    """ Streams report CSV files through an `Aggregator`.
+    :returns Aggregator: """
+    aggregator = Aggregator(direction)
+    for filename in filenames:
+        with open_report(filename) as f:
+            aggregator.add_rows(read_rows(f))
+    return aggregator
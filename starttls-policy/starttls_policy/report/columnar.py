@@ -0,0 +1,195 @@
+""" Columnar snapshots of Google's STARTTLS delivery data, for analysis
+across many monthly reports.
+
+Each report is parsed once into a snapshot: for its outbound rows, an
+array of suffix ids and an array of float32 fractions of mail encrypted.
+Suffix ids come from a dictionary shared by every snapshot in a store, so
+the same id means the same suffix in all of them, and per-snapshot minima
+line up as the columns of a (snapshots x suffixes) matrix. Minima, trends
+and candidates are then computed on whole arrays at once.
+"""
+import collections
+import io
+import json
+import os
+
+import numpy as np
+
+from starttls_policy import util
+from starttls_policy.report import aggregate
+
+SUFFIXES_FILE = 'suffixes.json'
+SNAPSHOT_SUFFIX = '.npz'
+
+Trend = collections.namedtuple('Trend', [
+    'suffix',         # address suffix, i.e. mail domain
+    'snapshots',      # number of snapshots the suffix appears in
+    'min_fraction',   # lowest fraction of mail encrypted across them
+    'last_fraction',  # minimum fraction in the latest snapshot it appears in
+    'slope',          # least-squares change in its minimum per snapshot
+    ])
+
+
+def group_min(suffix_ids, fractions, size):
+    """ Minimum fraction for each suffix id.
+    :param size int: number of suffix ids in the dictionary.
+    :returns: float32 array of `size` minima, NaN for ids without rows. """
+    minima = np.full(size, np.nan, dtype=np.float32)
+    if suffix_ids.size == 0:
+        return minima
+    order = np.argsort(suffix_ids, kind='stable')
+    ids = suffix_ids[order]
+    starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+    minima[ids[starts]] = np.minimum.reduceat(fractions[order], starts)
+    return minima
+
+def trends(matrix):
+    """ Per-suffix statistics over the rows of a minima matrix, as from
+    `SnapshotStore.minima`. NaN entries are left out.
+    :returns tuple: arrays of the number of snapshots each suffix is in,
+        its minimum, its latest minimum, and the slope of its minima. """
+    present = ~np.isnan(matrix)
+    count = present.sum(axis=0)
+    minimum = np.where(present, matrix, np.inf).min(axis=0)
+    minimum[count == 0] = np.nan
+    # Index of the last snapshot each suffix is in.
+    last = len(matrix) - 1 - np.argmax(present[::-1], axis=0)
+    latest = matrix[last, np.arange(matrix.shape[1])]
+    x = np.where(present, np.arange(len(matrix), dtype=np.float64)[:, None], 0)
+    y = np.where(present, matrix, 0).astype(np.float64)
+    sum_x, sum_y = x.sum(axis=0), y.sum(axis=0)
+    denominator = count * (x * x).sum(axis=0) - sum_x * sum_x
+    numerator = count * (x * y).sum(axis=0) - sum_x * sum_y
+    slope = np.zeros(len(count))
+    np.divide(numerator, denominator, out=slope, where=denominator > 0)
+    return count, minimum, latest, slope
+
+
+class SnapshotStore(object):
+    """ A directory of columnar report snapshots, each under a label that
+    sorts in time order, such as '2018-06'. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._suffixes = None
+        self._ids = None
+
+    def _load_suffixes(self):
+        if self._suffixes is not None:
+            return
+        filename = os.path.join(self.directory, SUFFIXES_FILE)
+        self._suffixes = []
+        if os.path.exists(filename):
+            with io.open(filename, encoding='utf-8') as f:
+                self._suffixes = json.load(f)
+        self._ids = dict((suffix, i) for i, suffix in enumerate(self._suffixes))
+
+    @property
+    def suffixes(self):
+        """ Every suffix in the store, indexed by id. """
+        self._load_suffixes()
+        return self._suffixes
+
+    def _path(self, label):
+        return os.path.join(self.directory, label + SNAPSHOT_SUFFIX)
+
+    def labels(self):
+        """ Labels of the snapshots in the store, sorted. """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(SNAPSHOT_SUFFIX)] for name in os.listdir(self.directory)
+                      if name.endswith(SNAPSHOT_SUFFIX))
+
+    def __contains__(self, label):
+        return os.path.exists(self._path(label))
+
+    def add(self, label, rows, direction=aggregate.DIRECTION, known=None):
+        """ Converts report rows, as returned by `aggregate.read_rows`, into
+        a snapshot, replacing any with the same label. Rows are filtered
+        and normalized as `aggregate.Aggregator` does, `known` included.
+        :returns int: number of rows in the snapshot. """
+        if known is None:
+            known = aggregate.KNOWN_ENCRYPTED
+        self._load_suffixes()
+        ids, suffixes = self._ids, self._suffixes
+
+        def suffix_id(suffix):
+            i = ids.get(suffix)
+            if i is None:
+                i = ids[suffix] = len(suffixes)
+                suffixes.append(suffix)
+            return i
+
+        suffix_ids, fractions = [], []
+        for suffix, fraction in sorted(known.items()):
+            suffix_ids.append(suffix_id(suffix))
+            fractions.append(fraction)
+        for row in rows:
+            if len(row) != aggregate.COLUMNS or row[2] != direction:
+                continue
+            try:
+                fraction = float(row[5])
+            except ValueError:
+                continue
+            suffix_ids.append(suffix_id(aggregate.normalize_suffix(row[0])))
+            fractions.append(fraction)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # The dictionary only grows, so it is written first: a snapshot
+        # never refers to ids missing from it.
+        util.write_atomically(os.path.join(self.directory, SUFFIXES_FILE),
+                              json.dumps(suffixes).encode('utf-8'))
+        buf = io.BytesIO()
+        np.savez_compressed(buf, suffix_ids=np.array(suffix_ids, dtype=np.int32),
+                            fractions=np.array(fractions, dtype=np.float32))
+        util.write_atomically(self._path(label), buf.getvalue())
+        return len(suffix_ids)
+
+    def add_file(self, label, filename, **kwargs):
+        """ Converts a report CSV file into a snapshot; see `add`. """
+        with aggregate.open_report(filename) as f:
+            return self.add(label, aggregate.read_rows(f), **kwargs)
+
+    def load(self, label):
+        """ :returns tuple: (suffix ids, fractions) arrays of a snapshot. """
+        with np.load(self._path(label)) as data:
+            return data['suffix_ids'], data['fractions']
+
+    def minima(self, labels=None):
+        """ Per-snapshot minimum fraction of every suffix.
+        :param labels list: snapshots to use; all of them by default.
+        :returns: float32 array with a row per snapshot and a column per
+            suffix id, NaN where a suffix isn't in a snapshot. """
+        labels = self.labels() if labels is None else labels
+        size = len(self.suffixes)
+        matrix = np.full((len(labels), size), np.nan, dtype=np.float32)
+        for i, label in enumerate(labels):
+            matrix[i] = group_min(*self.load(label), size=size)
+        return matrix
+
+    def trends(self, labels=None):
+        """ Iterates the `Trend` of every suffix, sorted by suffix. """
+        count, minimum, latest, slope = trends(self.minima(labels))
+        suffixes = self.suffixes
+        for i in sorted(range(len(suffixes)), key=suffixes.__getitem__):
+            if count[i]:
+                yield Trend(suffixes[i], int(count[i]), float(minimum[i]),
+                            float(latest[i]), float(slope[i]))
+
+    def candidates(self, threshold=aggregate.DEFAULT_THRESHOLD, min_snapshots=None,
+                   labels=None):
+        """ Suffixes that stayed at or above `threshold` in every snapshot
+        they appear in.
+        :param min_snapshots int: how many snapshots they must appear in;
+            all of them by default.
+        :returns list: sorted suffixes. """
+        matrix = self.minima(labels)
+        count, minimum, _, _ = trends(matrix)
+        if min_snapshots is None:
+            min_snapshots = len(matrix)
+        # Fractions are float32, so the threshold is too. NaN minima, for
+        # suffixes in no snapshot, compare False.
+        selected = np.flatnonzero((count >= max(min_snapshots, 1)) &
+                                  (minimum >= np.float32(threshold)))
+        suffixes = self.suffixes
+        return sorted(suffixes[i] for i in selected)
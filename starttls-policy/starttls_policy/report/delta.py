@@ -0,0 +1,77 @@
+""" What changed in the policy candidates since the last report.
+
+A `CandidateIndex` remembers which domains qualified as candidates in the
+previous run. Joined against the domains that have a policy in the
+current `Config` and the hand-checked golden list, it gives only what
+needs looking at: domains that newly qualify, and domains that no
+longer qualify, each split into those without a policy and those with
+one; and golden domains that neither qualify nor have a policy. The
+joins are set operations on hashed domain names, so no list is scanned
+against another.
+"""
+import collections
+import io
+import json
+import os
+
+from starttls_policy import util
+
+Delta = collections.namedtuple('Delta', [
+    'qualified',       # sorted domains that newly qualify and have no policy
+    'listed',          # sorted domains that newly qualify and already have a policy
+    'disqualified',    # sorted domains that qualified last time but no longer do,
+                       # and have no policy
+    'delisted',        # sorted domains that qualified last time but no longer do,
+                       # and still have a policy
+    'golden_missing',  # sorted golden domains that don't qualify and have no policy
+    ])
+
+
+def read_domain_list(f):
+    """ Reads a list of domains, one per line, like share/golden-domains.txt.
+    Blank lines and lines starting with '#' are skipped.
+    :returns set: """
+    domains = set()
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            domains.add(line.lower())
+    return domains
+
+
+class CandidateIndex(object):
+    """ Domains that qualified as candidates in the last run, saved to a file
+    between runs. """
+
+    def __init__(self, candidates=()):
+        self.candidates = set(candidates)
+
+    @classmethod
+    def load(cls, filename):
+        """ Reads an index saved by `save`. A missing file is an empty index,
+        so everything qualifying in the first run is new. """
+        if not os.path.exists(filename):
+            return cls()
+        with io.open(filename, encoding='utf-8') as f:
+            return cls(json.load(f)['candidates'])
+
+    def save(self, filename):
+        """ Writes the index, replacing the file atomically. """
+        data = json.dumps({'candidates': sorted(self.candidates)}, indent=2)
+        util.write_atomically(filename, data.encode('utf-8'))
+
+    def update(self, candidates, config, golden=()):
+        """ Replaces the candidates with those of a new run.
+        :param candidates: iterable of domains that qualify now.
+        :param config policy.Config: the current policy list.
+        :param golden set: domains expected to qualify.
+        :returns Delta: changes since the candidates last replaced. """
+        current = set(domain.lower() for domain in candidates)
+        listed = set(domain.lower() for domain in config.policies or {})
+        added = current - self.candidates
+        removed = self.candidates - current
+        delta = Delta(sorted(added - listed), sorted(added & listed),
+                      sorted(removed - listed), sorted(removed & listed),
+                      sorted(set(golden) - current - listed))
+        self.candidates = current
+        return delta
@@ -0,0 +1,108 @@
+""" Parallel ingest of large report CSV files.
+
+A file is split into byte ranges that each start and end on a record
+boundary, and worker processes aggregate the ranges into partial
+`aggregate.Aggregator`s that are merged at the end. A newline inside a
+quoted field isn't a record boundary. Since an escaped quote is written
+as two quotes, a newline ends a record exactly when an even number of
+quote characters come before it in the file. So finding boundaries takes
+one pass that only counts quote bytes, which is far cheaper than parsing.
+"""
+import io
+import multiprocessing
+import os
+
+from starttls_policy.report import aggregate
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+_BLOCK_SIZE = 1024 * 1024
+_QUOTE = b'"'
+_NEWLINE = b'\n'
+
+
+def record_boundaries(f, targets):
+    """ Finds, for each byte offset in `targets`, the first record boundary
+    at or after it: the offset just past a newline that isn't inside a
+    quoted field.
+    :param f: file opened in binary mode.
+    :param targets list: ascending byte offsets.
+    :returns list: boundaries, ascending; the end of the file stands in
+        for targets with no boundary after them. """
+    boundaries = []
+    targets = list(targets)
+    f.seek(0)
+    position = quotes = 0
+    while targets:
+        block = f.read(_BLOCK_SIZE)
+        if not block:
+            break
+        end = position + len(block)
+        # Offset in the block, and quotes in the file before it.
+        offset, counted = 0, quotes
+        while targets and targets[0] < end:
+            start = max(targets[0] - position, offset)
+            counted += block.count(_QUOTE, offset, start)
+            offset = start
+            newline = block.find(_NEWLINE, offset)
+            while newline >= 0:
+                counted += block.count(_QUOTE, offset, newline)
+                offset = newline + 1
+                if counted % 2 == 0:
+                    break
+                newline = block.find(_NEWLINE, offset)
+            if newline < 0:
+                break
+            boundary = position + newline + 1
+            while targets and targets[0] < boundary:
+                targets.pop(0)
+            boundaries.append(boundary)
+        quotes += block.count(_QUOTE)
+        position = end
+    boundaries.extend(position for _ in targets)
+    return boundaries
+
+def split(filename, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Splits a report CSV file into ranges of about `chunk_size` bytes
+    that start and end on record boundaries.
+    :returns list: of (start, end) byte offsets. """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        cuts = record_boundaries(f, range(chunk_size, size, chunk_size))
+    edges = sorted(set([0] + cuts + [size]))
+    return list(zip(edges[:-1], edges[1:]))
+
+def aggregate_range(job):
+    """ Aggregates one byte range of a report CSV file. A top-level function
+    so process pools can run it.
+    The range is read into memory whole.
+    :param job tuple: (filename, start, end, direction).
+    :returns aggregate.Aggregator: without any known suffixes. """
+    filename, start, end, direction = job
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = io.BytesIO(f.read(end - start))
+    # Iterating a TextIOWrapper is much faster than iterating a StringIO.
+    rows = aggregate.read_rows(io.TextIOWrapper(data, encoding='utf-8', newline=''))
+    return aggregate.Aggregator(direction, known={}).add_rows(rows)
+
+def ingest(filenames, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+           direction=aggregate.DIRECTION):
+    """ Aggregates report CSV files using a pool of worker processes.
+    :param workers int: processes to use; defaults to one per CPU.
+    :returns aggregate.Aggregator: the same as `aggregate.aggregate` would. """
+    jobs = [(filename, start, end, direction)
+            for filename in filenames
+            for start, end in split(filename, chunk_size)]
+    result = aggregate.Aggregator(direction)
+    if workers == 1 or len(jobs) <= 1:
+        for job in jobs:
+            result.merge(aggregate_range(job))
+        return result
+    pool = multiprocessing.Pool(workers)
+    try:
+        for partial in pool.imap_unordered(aggregate_range, jobs):
+            result.merge(partial)
+    finally:
+        pool.terminate()
+        pool.join()
+    return result
@@ -0,0 +1 @@
+""" Tools for scanning mail servers to build STARTTLS policies. """
@@ -0,0 +1,45 @@
+""" Expiring caches shared by the scanner's stages. """
+import time
+
+from starttls_policy import util
+from starttls_policy.scan import probe as probe_module
+
+# Scan results for an MX host are good for a day; failures are retried
+# sooner, since they are often transient.
+DEFAULT_PROBE_TTL = 24 * 60 * 60
+DEFAULT_FAILURE_TTL = 60 * 60
+DEFAULT_MAX_SIZE = 100000
+
+
+class ProbeCache(object):
+    """ Memoizes STARTTLS probes by (MX hostname, IP address), so that every
+    mail domain sharing an MX reuses a single handshake.
+    """
+
+    def __init__(self, ttl=DEFAULT_PROBE_TTL, failure_ttl=DEFAULT_FAILURE_TTL,
+                 max_size=DEFAULT_MAX_SIZE, probe=probe_module.probe, clock=time.time):
+        """ :param probe: function with the signature of `probe.probe`. """
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._probe = probe
+        self._results = util.TTLCache(max_size, clock)
+
+    @property
+    def hits(self):
+        """ Number of lookups answered from the cache. """
+        return self._results.hits
+
+    @property
+    def misses(self):
+        """ Number of lookups that had to probe. """
+        return self._results.misses
+
+    def get(self, host, address=None, **kwargs):
+        """ Returns a cached `ProbeResult` for `host` at `address`,
+        probing on a miss. Extra keyword arguments go to the probe.
+        :param host str: MX hostname.
+        :param address str: IP address, or None to let the probe resolve it. """
+        def compute():
+            result = self._probe(host, address=address, **kwargs)
+            return result, self.ttl if result.starttls else self.failure_ttl
+        return self._results.get_or_compute((host.lower(), address), compute)
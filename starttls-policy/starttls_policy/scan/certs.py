@@ -0,0 +1,74 @@
+""" Helpers for DER-encoded certificates observed by the scanner. """
+import base64
+import calendar
+import collections
+import hashlib
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.x509.oid import NameOID
+
+CertInfo = collections.namedtuple('CertInfo', [
+    'fingerprint',  # hex SHA-256 of the DER certificate
+    'names',        # sorted DNS names from the subject CN and SANs
+    'spki_sha256',  # pin of the public key, as 'sha256/<base64>'
+    'not_before',   # start of validity, seconds since the epoch
+    'not_after',    # end of validity, seconds since the epoch
+    ])
+
+
+def fingerprint(der):
+    """ Hex SHA-256 fingerprint of a DER-encoded certificate. """
+    return hashlib.sha256(der).hexdigest()
+
+def _load(der):
+    return x509.load_der_x509_certificate(der, default_backend())
+
+def extract_names(der):
+    """ Return a set of DNS subject names from a DER-encoded leaf cert. """
+    return _names(_load(der))
+
+def _names(cert):
+    # Certs have a "subject" identified by a Distingushed Name (DN).
+    # Host certs should also have a Common Name (CN) with a DNS name.
+    names = set(attr.value for attr in
+                cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME))
+    try:
+        # The SAN extension allows one cert to cover multiple domains
+        # and permits DNS wildcards.
+        alt_names = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        names.update(alt_names.value.get_values_for_type(x509.DNSName))
+    except (x509.ExtensionNotFound, ValueError):
+        pass
+    return set(name.lower() for name in names)
+
+def spki(der):
+    """ DER SubjectPublicKeyInfo of a DER certificate.
+    :raises ValueError: if the certificate is malformed. """
+    return _spki(_load(der))
+
+def _spki(cert):
+    return cert.public_key().public_bytes(serialization.Encoding.DER,
+                                          serialization.PublicFormat.SubjectPublicKeyInfo)
+
+def spki_sha256(der):
+    """ SHA-256 pin of a DER certificate's SubjectPublicKeyInfo, in the
+    'sha256/<base64>' form used by `static-spki-hashes`. """
+    return _spki_sha256(_load(der))
+
+def _spki_sha256(cert):
+    return 'sha256/' + base64.b64encode(hashlib.sha256(_spki(cert)).digest()).decode('ascii')
+
+def _timestamp(cert, attr):
+    # cryptography >= 42 deprecates the naive datetime properties.
+    value = getattr(cert, attr + '_utc', None) or getattr(cert, attr)
+    return calendar.timegm(value.utctimetuple())
+
+def analyze(der):
+    """ Parses everything the scanner wants to know about a certificate.
+    CPU-bound, and a top-level function so process pools can run it.
+    :returns CertInfo: """
+    cert = _load(der)
+    return CertInfo(fingerprint(der), sorted(_names(cert)), _spki_sha256(cert),
+                    _timestamp(cert, 'not_valid_before'), _timestamp(cert, 'not_valid_after'))
@@ -0,0 +1,92 @@
+""" Content-addressed store for the certificates observed by the scanner.
+
+Each distinct DER certificate is written once, under
+`<root>/<first two hex digits>/<sha256 hex>.der`. Observations of MX hosts
+refer to certificates by these fingerprints, and carry the negotiated
+protocol and cipher and the names on the leaf so that later analysis
+doesn't need to parse certificates again.
+"""
+import collections
+import errno
+import os
+import threading
+import time
+
+from starttls_policy import util
+from starttls_policy.scan import certs
+
+Observation = collections.namedtuple('Observation', [
+    'host',      # MX hostname
+    'address',   # IP address probed
+    'starttls',  # True if the TLS handshake completed
+    'protocol',  # negotiated protocol, e.g. 'TLSv1.2'
+    'cipher',    # negotiated cipher suite name
+    'chain',     # list of certificate fingerprints, leaf first
+    'names',     # sorted DNS names from the leaf
+    'error',     # what went wrong, or None
+    'time',      # seconds since the epoch when observed
+    ])
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+class CertStore(object):
+    """ Saves scan results on disk, keeping each certificate only once no
+    matter how many MX hosts or domains present it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        _makedirs(root)
+        # Names on leaves we've already parsed, by fingerprint.
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _cert_path(self, key):
+        return os.path.join(self.root, key[:2], key + '.der')
+
+    def put_cert(self, der):
+        """ Saves a DER certificate if it isn't stored yet.
+        :returns str: its key, the hex SHA-256 fingerprint. """
+        key = certs.fingerprint(der)
+        path = self._cert_path(key)
+        if not os.path.exists(path):
+            _makedirs(os.path.dirname(path))
+            util.write_atomically(path, der)
+        return key
+
+    def get_cert(self, key):
+        """ Returns the DER certificate stored under `key`. """
+        with open(self._cert_path(key), 'rb') as f:
+            return f.read()
+
+    def get_chain(self, observation):
+        """ Returns the DER certificates an observation refers to, leaf first. """
+        return [self.get_cert(key) for key in observation.chain]
+
+    def _leaf_names(self, key, der):
+        with self._lock:
+            names = self._names.get(key)
+        if names is None:
+            names = sorted(certs.extract_names(der))
+            with self._lock:
+                self._names[key] = names
+        return names
+
+    def observe(self, result, now=None, names=None):
+        """ Stores the certificates from a probe result.
+        :param result ProbeResult: as returned by `probe.probe`.
+        :param names list: DNS names on the leaf, if already extracted.
+        :returns Observation: """
+        chain = [self.put_cert(der) for der in result.chain]
+        if names is None:
+            names = self._leaf_names(chain[0], result.chain[0]) if chain else []
+        return Observation(result.host, result.address, result.starttls, result.protocol,
+                           result.cipher, chain, names, result.error,
+                           time.time() if now is None else now)
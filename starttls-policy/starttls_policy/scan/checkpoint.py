@@ -0,0 +1,126 @@
+""" Checkpoints that let a long scan resume after it is killed.
+
+Scan results are already durable as they come in: the scan database
+commits each domain, and the results file is flushed a line at a time.
+What a killed run loses is how far it got through its input lists. Mail
+domains are numbered in the order they're read, finish out of order, and
+the checkpoint records the position before which every domain is done.
+A resumed run skips that many domains; those finished beyond it are
+scanned again only if the scan database says they're stale.
+"""
+import collections
+import io
+import json
+import os
+import threading
+import time
+
+from starttls_policy import util
+
+DEFAULT_INTERVAL = 60
+
+
+def truncate_partial_line(filename):
+    """ Drops a last line without a newline, as left by a writer that was
+    killed mid-write, so that appending to the file is safe. """
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = end = f.tell()
+        while end > 0:
+            start = max(0, end - io.DEFAULT_BUFFER_SIZE)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+
+
+class Checkpoint(object):
+    """ Progress of a scan through a numbered stream of mail domains,
+    saved to a file every `interval` seconds. Safe to share between
+    threads.
+    """
+
+    def __init__(self, filename, inputs, results, position=0,
+                 interval=DEFAULT_INTERVAL, clock=time.time):
+        """ :param inputs list: files the mail domains are read from.
+        :param results str: the results file this run appends to.
+        :param position int: domains already done at the start of the run. """
+        self.filename = filename
+        self.inputs = inputs
+        self.results = results
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._position = position
+        # Indices of domains started but not finished, by domain, and of
+        # domains finished past `_position`.
+        self._started = collections.defaultdict(collections.deque)
+        self._done = set()
+        self._saved = clock()
+
+    @classmethod
+    def load(cls, filename, interval=DEFAULT_INTERVAL, clock=time.time):
+        """ Reads a checkpoint saved by `save`.
+        :returns Checkpoint: or None if there is none. """
+        if not os.path.exists(filename):
+            return None
+        with io.open(filename, encoding='utf-8') as f:
+            state = json.load(f)
+        return cls(filename, state['inputs'], state['results'], state['position'],
+                   interval=interval, clock=clock)
+
+    @property
+    def position(self):
+        """ Number of domains at the start of the input that are all done. """
+        with self._lock:
+            return self._position
+
+    def start(self, domain, index):
+        """ Notes that the domain at `index` in the input is being scanned. """
+        with self._lock:
+            self._started[domain].append(index)
+
+    def finish(self, domain):
+        """ Notes that the earliest started occurrence of `domain` is done,
+        and saves the checkpoint if `interval` has passed since the last save. """
+        with self._lock:
+            started = self._started[domain]
+            self._done.add(started.popleft())
+            if not started:
+                del self._started[domain]
+            while self._position in self._done:
+                self._done.remove(self._position)
+                self._position += 1
+            due = self._clock() - self._saved >= self.interval
+        if due:
+            self.save()
+
+    def save(self):
+        """ Writes the checkpoint, and syncs it to disk. """
+        with self._lock:
+            state = {
+                'inputs': self.inputs,
+                'results': self.results,
+                'position': self._position,
+                }
+            data = json.dumps(state, sort_keys=True).encode('utf-8')
+            util.write_atomically(self.filename, data, sync=True)
+            self._saved = self._clock()
+
+    def pending(self, domains):
+        """ Numbers `domains` and starts the ones past the checkpoint.
+        :param domains: iterable of every mail domain in the input.
+        :returns: generator of the domains still to be scanned. """
+        start = self.position
+        for index, domain in enumerate(domains):
+            if index < start:
+                continue
+            self.start(domain, index)
+            yield domain
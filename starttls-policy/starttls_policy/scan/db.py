@@ -0,0 +1,207 @@
+""" SQLite database of scan results, and planning of incremental rescans.
+
+Every scan of a mail domain adds one row per MX host to `observations`,
+so the full history is kept. `scans` holds just the latest scan time and
+MX set of each domain, to decide what needs rescanning.
+`certificates` holds what was parsed out of each certificate seen, and
+`versions` the TLS versions each MX host accepted or refused when tried
+one at a time.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from starttls_policy.scan import certs
+from starttls_policy.scan import certstore
+from starttls_policy.scan import versions as versions_module
+
+DEFAULT_MAX_AGE = 24 * 60 * 60
+# Stay well below SQLite's default limit of 999 bound parameters.
+_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    domain TEXT NOT NULL,
+    mx TEXT NOT NULL,
+    time REAL NOT NULL,
+    address TEXT,
+    starttls INTEGER NOT NULL,
+    protocol TEXT,
+    cipher TEXT,
+    chain TEXT NOT NULL,
+    names TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS observations_domain_time ON observations (domain, time);
+CREATE TABLE IF NOT EXISTS scans (
+    domain TEXT PRIMARY KEY,
+    time REAL NOT NULL,
+    mxs TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS certificates (
+    fingerprint TEXT PRIMARY KEY,
+    names TEXT NOT NULL,
+    spki_sha256 TEXT NOT NULL,
+    not_before INTEGER NOT NULL,
+    not_after INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    mx TEXT NOT NULL,
+    address TEXT,
+    time REAL NOT NULL,
+    version TEXT NOT NULL,
+    cipher TEXT,
+    cipher_order TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS versions_mx_time ON versions (mx, time);
+"""
+
+
+def _batches(iterable, size=_BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ScanDB(object):
+    """ Scan results for mail domains, stored in a SQLite file.
+    Safe to share between threads; access is serialized.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        with self._lock:
+            self._conn.close()
+
+    def record(self, domain, observations, now=None):
+        """ Adds a scan of `domain`.
+        :param observations list: `certstore.Observation` for each MX host. """
+        now = time.time() if now is None else now
+        domain = domain.lower()
+        mxs = ','.join(sorted(set(obs.host.lower() for obs in observations)))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(domain, obs.host.lower(), now, obs.address, obs.starttls, obs.protocol,
+                  obs.cipher, ','.join(obs.chain), json.dumps(obs.names), obs.error)
+                 for obs in observations])
+            self._conn.execute('INSERT OR REPLACE INTO scans VALUES (?, ?, ?)',
+                               (domain, now, mxs))
+
+    def record_certs(self, infos):
+        """ Saves certificate analysis, ignoring certificates already known.
+        :param infos: iterable of `certs.CertInfo`. """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO certificates VALUES (?, ?, ?, ?, ?)',
+                [(info.fingerprint, json.dumps(info.names), info.spki_sha256,
+                  info.not_before, info.not_after) for info in infos])
+
+    def cert_info(self, fingerprint):
+        """ Returns the `certs.CertInfo` saved for a certificate, or None. """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM certificates WHERE fingerprint = ?',
+                                     (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        return certs.CertInfo(row[0], json.loads(row[1]), row[2], row[3], row[4])
+
+    def record_versions(self, scans, now=None):
+        """ Adds the results of trying each TLS version against MX hosts.
+        Versions left unknown, in a scan's `errors`, aren't saved.
+        :param scans: iterable of `versions.VersionScan`. """
+        now = time.time() if now is None else now
+        rows = []
+        for scan in scans:
+            for version, cipher in scan.supported.items():
+                order = scan.cipher_order.get(version)
+                rows.append((scan.host.lower(), scan.address, now, version, cipher,
+                             None if order is None else json.dumps(order), None))
+            for version, error in scan.refused.items():
+                rows.append((scan.host.lower(), scan.address, now, version, None, None, error))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def versions(self, mx):
+        """ Returns the latest `versions.VersionScan` of an MX host, or None
+        if its versions were never scanned. """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT address, version, cipher, cipher_order, error FROM versions '
+                'WHERE mx = ? AND time = (SELECT MAX(time) FROM versions WHERE mx = ?)',
+                (mx.lower(), mx.lower())).fetchall()
+        if not rows:
+            return None
+        scan = versions_module.VersionScan(mx.lower(), rows[0][0], {}, {}, {}, {})
+        for _, version, cipher, order, error in rows:
+            if error is None:
+                scan.supported[version] = cipher
+                if order is not None:
+                    scan.cipher_order[version] = json.loads(order)
+            else:
+                scan.refused[version] = error
+        return scan
+
+    def latest(self, domain):
+        """ Returns the observations from the latest scan of `domain`, or None
+        if it has never been scanned. """
+        with self._lock:
+            row = self._conn.execute('SELECT time FROM scans WHERE domain = ?',
+                                     (domain.lower(),)).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                'SELECT mx, address, starttls, protocol, cipher, chain, names, error, time '
+                'FROM observations WHERE domain = ? AND time = ? ORDER BY rowid',
+                (domain.lower(), row[0])).fetchall()
+        return [certstore.Observation(mx, address, bool(starttls), protocol, cipher,
+                                      chain.split(',') if chain else [],
+                                      json.loads(names), error, when)
+                for mx, address, starttls, protocol, cipher, chain, names, error, when in rows]
+
+    def last_scans(self, domains):
+        """ Returns a dict mapping each of `domains` that has been scanned to
+        a (time, frozenset of MX hosts) tuple for its latest scan. """
+        result = {}
+        for batch in _batches(d.lower() for d in domains):
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT domain, time, mxs FROM scans WHERE domain IN ({})'.format(
+                        ','.join('?' * len(batch))), batch).fetchall()
+            for domain, when, mxs in rows:
+                result[domain] = (when, frozenset(mxs.split(',')) if mxs else frozenset())
+        return result
+
+
+def plan_rescans(db, resolved, max_age=DEFAULT_MAX_AGE, now=None, on_fresh=None):
+    """ Picks out the domains that need scanning: those never scanned,
+    those last scanned more than `max_age` seconds ago, and those whose
+    MX hosts changed since.
+
+    :param db ScanDB: Previous results.
+    :param resolved: iterable of (domain, list of `resolver.MXRecord`).
+    :param on_fresh: called with each domain that doesn't need scanning.
+    :returns: generator of the (domain, list of MXRecord) that need scanning. """
+    now = time.time() if now is None else now
+    for batch in _batches(resolved):
+        last = db.last_scans(domain for domain, _ in batch)
+        for domain, mx_records in batch:
+            previous = last.get(domain.lower())
+            mxs = frozenset(mx.host.lower() for mx in mx_records)
+            if previous is None or previous[0] < now - max_age or previous[1] != mxs:
+                yield domain, mx_records
+            elif on_fresh is not None:
+                on_fresh(domain)
@@ -0,0 +1,216 @@
+""" Two-stage scan pipeline.
+
+The network stage is a set of threads that probe every MX host of each
+mail domain. Probed domains go through a bounded queue to the analysis
+stage, which parses the certificates they presented in a process pool.
+When analysis falls behind, the queue fills up and the network threads
+block, so memory stays bounded however long the input is.
+"""
+import collections
+import multiprocessing
+import threading
+
+from six.moves import queue
+
+from starttls_policy.scan import certs
+
+DEFAULT_NETWORK_WORKERS = 32
+DEFAULT_QUEUE_SIZE = 256
+# Analyses of certificates kept for reuse; the least recently used go first.
+DEFAULT_MAX_ANALYZED = 100000
+# How often the consumer checks for finished analysis while waiting.
+_POLL_INTERVAL = 0.05
+
+ScanResult = collections.namedtuple('ScanResult', [
+    'domain',      # mail domain
+    'mx_records',  # list of resolver.MXRecord that were probed
+    'probes',      # list of probe.ProbeResult, one per MX record
+    'certs',       # dict of fingerprint to certs.CertInfo, for every
+                   # certificate in the probes' chains
+    'versions',    # list of versions.VersionScan, one per probe, or None
+                   # if the pipeline has no version scanner
+    'analysis_errors',  # dict of MX hostname to why a certificate in its
+                        # chain couldn't be analyzed; that certificate is
+                        # missing from `certs`
+    'error',       # why the domain couldn't be probed, or None; `probes`
+                   # is then empty
+    ])
+
+_DONE = object()
+
+
+def _analyze(der):
+    """ `certs.analyze`, returning the error instead of raising it, so one
+    bad certificate doesn't fail every domain analyzed alongside it.
+    :returns tuple: (fingerprint, `certs.CertInfo` or None, error message
+        or None). """
+    try:
+        return certs.fingerprint(der), certs.analyze(der), None
+    except Exception as e: # pylint: disable=broad-except
+        return certs.fingerprint(der), None, '{}: {}'.format(type(e).__name__, e)
+
+
+class _Pending(object):
+    """ A probed domain whose certificates are being analyzed. """
+    def __init__(self, domain, mx_records, probes, versions, error, chain_certs,
+                 async_result):
+        self.domain = domain
+        self.mx_records = mx_records
+        self.probes = probes
+        self.versions = versions
+        self.error = error
+        # Fingerprint to DER of every certificate in the probes' chains.
+        self.chain_certs = chain_certs
+        self.async_result = async_result
+
+    def ready(self):
+        """ True if waiting for the analysis won't block. """
+        return self.async_result is None or self.async_result.ready()
+
+
+class Pipeline(object):
+    """ Scans mail domains with network I/O and certificate analysis
+    running in parallel.
+    """
+
+    def __init__(self, probe, network_workers=DEFAULT_NETWORK_WORKERS,
+                 analysis_workers=None, queue_size=DEFAULT_QUEUE_SIZE, version_scanner=None,
+                 max_analyzed=DEFAULT_MAX_ANALYZED):
+        """ :param probe: function taking (host, address) and returning a
+            `probe.ProbeResult`, such as `cache.ProbeCache.get`.
+        :param version_scanner versions.VersionScanner: if given, also finds
+            the TLS versions each MX host supports, in the network stage.
+        :param analysis_workers int: processes for analysis. Defaults to the
+            number of CPUs.
+        :param queue_size int: domains that may wait between the stages.
+        :param max_analyzed int: most certificate analyses to keep for
+            later domains that present the same certificates. """
+        self._probe = probe
+        self._version_scanner = version_scanner
+        self.network_workers = network_workers
+        self.analysis_workers = analysis_workers
+        self.queue_size = queue_size
+        self.max_analyzed = max_analyzed
+        # (CertInfo or None, error or None) of certificates already seen in
+        # this pipeline's runs, least recently used first, and fingerprints
+        # currently being analyzed.
+        self._analyzed = collections.OrderedDict()
+        self._submitted = set()
+
+    def _feed(self, jobs, work, stop):
+        try:
+            for job in jobs:
+                if stop.is_set():
+                    return
+                work.put(job)
+        finally:
+            for _ in range(self.network_workers):
+                work.put(_DONE)
+
+    def _probe_domains(self, work, probed, stop):
+        try:
+            while not stop.is_set():
+                job = work.get()
+                if job is _DONE:
+                    break
+                domain, mx_records = job
+                try:
+                    probes = [self._probe(mx.host, mx.addresses[0] if mx.addresses else None)
+                              for mx in mx_records]
+                    versions = None
+                    if self._version_scanner is not None:
+                        versions = [self._version_scanner.scan(result) for result in probes]
+                except Exception as e: # pylint: disable=broad-except
+                    # Report the domain, and carry on with the rest.
+                    probed.put((domain, mx_records, [], None,
+                                '{}: {}'.format(type(e).__name__, e)))
+                    continue
+                probed.put((domain, mx_records, probes, versions, None))
+        finally:
+            probed.put(_DONE)
+
+    def _remember(self, key, analysis):
+        self._analyzed.pop(key, None)
+        self._analyzed[key] = analysis
+        while len(self._analyzed) > self.max_analyzed:
+            self._analyzed.popitem(last=False)
+
+    def _start_analysis(self, pool, domain, mx_records, probes, versions, error):
+        chain_certs = {}
+        for result in probes:
+            for der in result.chain:
+                chain_certs[certs.fingerprint(der)] = der
+        new = {}
+        for key, der in chain_certs.items():
+            if key in self._analyzed:
+                self._remember(key, self._analyzed[key])
+            elif key not in self._submitted:
+                new[key] = der
+        self._submitted.update(new)
+        async_result = pool.map_async(_analyze, list(new.values())) if new else None
+        return _Pending(domain, mx_records, probes, versions, error, chain_certs, async_result)
+
+    def _finish(self, pending):
+        if pending.async_result is not None:
+            for key, info, error in pending.async_result.get():
+                self._remember(key, (info, error))
+                self._submitted.discard(key)
+        analyzed = {}
+        for key, der in pending.chain_certs.items():
+            analysis = self._analyzed.get(key)
+            if analysis is None:
+                # Analyzed for an earlier domain, but evicted since.
+                _, info, error = _analyze(der)
+                analysis = (info, error)
+                self._remember(key, analysis)
+            analyzed[key] = analysis
+        errors = {}
+        for result in pending.probes:
+            for der in result.chain:
+                error = analyzed[certs.fingerprint(der)][1]
+                if error is not None:
+                    errors.setdefault(result.host, error)
+        return ScanResult(pending.domain, pending.mx_records, pending.probes,
+                          dict((key, info) for key, (info, _) in analyzed.items()
+                               if info is not None),
+                          pending.versions, errors, pending.error)
+
+    def run(self, jobs):
+        """ Scans mail domains.
+        :param jobs: iterable of (domain, list of `resolver.MXRecord`).
+        :returns: generator of `ScanResult`, in the order domains finish
+            probing. """
+        work = queue.Queue(self.queue_size)
+        probed = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._feed, args=(jobs, work, stop))]
+        threads.extend(threading.Thread(target=self._probe_domains, args=(work, probed, stop))
+                       for _ in range(self.network_workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        pool = multiprocessing.Pool(self.analysis_workers)
+        pending = collections.deque()
+        running = self.network_workers
+        try:
+            while running or pending:
+                while pending and pending[0].ready():
+                    yield self._finish(pending.popleft())
+                if not running or len(pending) >= self.queue_size:
+                    # Nothing more is coming, or analysis is the bottleneck;
+                    # block on the oldest domain.
+                    if pending:
+                        yield self._finish(pending.popleft())
+                    continue
+                try:
+                    item = probed.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    running -= 1
+                else:
+                    pending.append(self._start_analysis(pool, *item))
+        finally:
+            stop.set()
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,156 @@
+""" In-process SMTP STARTTLS probe.
+
+A single connection runs EHLO, STARTTLS and the TLS handshake, and records
+what was negotiated along with the peer's certificate chain.
+"""
+import collections
+import socket
+import ssl
+
+SMTP_PORT = 25
+DEFAULT_TIMEOUT = 10
+# Same line limit smtplib uses, so a misbehaving server can't make us
+# buffer without bound.
+_MAXLINE = 8192
+
+ProbeResult = collections.namedtuple('ProbeResult', [
+    'host',          # MX hostname that was probed
+    'address',       # IP address actually connected to
+    'capabilities',  # frozenset of upper-cased EHLO keywords
+    'starttls',      # True if the TLS handshake completed
+    'protocol',      # negotiated protocol, e.g. 'TLSv1.2'
+    'cipher',        # negotiated cipher suite name
+    'chain',         # list of DER-encoded certificates, leaf first
+    'error',         # description of what went wrong, or None
+    ])
+
+
+# Start of the error of a probe whose TLS handshake the server rejected.
+HANDSHAKE_FAILED = 'TLS handshake failed'
+
+
+class ProbeError(Exception):
+    """ The SMTP dialog did not go as expected. """
+
+
+def default_context():
+    """ Returns an SSL context suitable for probing.
+    Certificates are not verified during the handshake; the chain is
+    captured and checked separately. """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+def _read_reply(reader):
+    """ Reads a (possibly multi-line) SMTP reply.
+    :returns: tuple of (code, list of text lines) """
+    lines = []
+    while True:
+        line = reader.readline(_MAXLINE + 1)
+        if not line:
+            raise ProbeError('Connection closed by server')
+        if len(line) > _MAXLINE:
+            raise ProbeError('Reply line too long')
+        try:
+            code = int(line[:3])
+        except ValueError:
+            raise ProbeError('Malformed reply: {!r}'.format(line))
+        lines.append(line[4:].strip().decode('ascii', 'replace'))
+        if line[3:4] != b'-':
+            return code, lines
+
+def _command(sock, reader, command, expected):
+    sock.sendall(command.encode('ascii') + b'\r\n')
+    code, lines = _read_reply(reader)
+    if code != expected:
+        raise ProbeError('{} failed: {} {}'.format(
+            command.split()[0], code, ' '.join(lines)))
+    return lines
+
+def _der_bytes(cert):
+    if isinstance(cert, bytes):
+        return cert
+    # Python 3.10-3.12 return _ssl.Certificate objects.
+    return cert.public_bytes(ssl._ssl.ENCODING_DER) # pylint: disable=protected-access
+
+def peer_chain(tls_sock):
+    """ Returns the certificate chain sent by the peer as a list of
+    DER-encoded certificates, leaf first. Falls back to just the leaf
+    where this Python's ssl module can't expose the full chain. """
+    for obj in (tls_sock, getattr(tls_sock, '_sslobj', None)):
+        get_chain = getattr(obj, 'get_unverified_chain', None)
+        if get_chain is not None:
+            chain = get_chain()
+            if chain:
+                return [_der_bytes(cert) for cert in chain]
+    leaf = tls_sock.getpeercert(binary_form=True)
+    return [leaf] if leaf else []
+
+def _failure(host, address, capabilities, error):
+    return ProbeResult(host, address, capabilities, False, None, None, [], error)
+
+def probe(host, address=None, port=SMTP_PORT, timeout=DEFAULT_TIMEOUT,
+          helo_name=None, context=None):
+    """ Connects to an MX host and attempts to negotiate STARTTLS.
+    Never raises for network or protocol failures; these are reported in
+    the `error` field of the result instead.
+
+    :param host str: MX hostname, also sent as SNI.
+    :param address str: IP address to connect to. If not given, `host`
+        is resolved by the socket layer.
+    :param helo_name str: Name to send with EHLO. Defaults to our FQDN.
+    :param context ssl.SSLContext: Context for the handshake.
+        Defaults to `default_context()`.
+    :returns ProbeResult: """
+    if context is None:
+        context = default_context()
+    if helo_name is None:
+        helo_name = socket.getfqdn()
+    capabilities = frozenset()
+    try:
+        sock = socket.create_connection((address or host, port), timeout)
+    except (socket.error, socket.timeout) as e:
+        return _failure(host, address, capabilities, 'Connection failed: {}'.format(e))
+    address = sock.getpeername()[0]
+    try:
+        reader = sock.makefile('rb')
+        try:
+            code, lines = _read_reply(reader)
+            if code != 220:
+                raise ProbeError('Unexpected greeting: {} {}'.format(code, ' '.join(lines)))
+            lines = _command(sock, reader, 'EHLO ' + helo_name, 250)
+            capabilities = frozenset(line.split(' ')[0].upper() for line in lines[1:])
+            if 'STARTTLS' not in capabilities:
+                return _failure(host, address, capabilities, 'STARTTLS not offered')
+            _command(sock, reader, 'STARTTLS', 220)
+        finally:
+            reader.close()
+        tls_sock = context.wrap_socket(sock, server_hostname=host)
+        try:
+            result = ProbeResult(host, address, capabilities, True, tls_sock.version(),
+                                 tls_sock.cipher()[0], peer_chain(tls_sock), None)
+            try:
+                tls_sock.sendall(b'QUIT\r\n')
+            except (socket.error, ssl.SSLError):
+                pass
+            return result
+        finally:
+            tls_sock.close()
+    except ProbeError as e:
+        return _failure(host, address, capabilities, str(e))
+    except ssl.SSLEOFError as e:
+        return _failure(host, address, capabilities,
+                        'Connection closed during TLS handshake: {}'.format(e))
+    except ssl.SSLError as e:
+        return _failure(host, address, capabilities, '{}: {}'.format(HANDSHAKE_FAILED, e))
+    except (socket.error, socket.timeout) as e:
+        return _failure(host, address, capabilities, 'Connection failed: {}'.format(e))
+    finally:
+        sock.close()
+
+def handshake_refused(result):
+    """ Whether a failed probe got as far as the TLS handshake and the
+    server rejected it, rather than failing on the network or with a
+    temporary SMTP error. """
+    return not result.starttls and (result.error or '').startswith(HANDSHAKE_FAILED)
@@ -0,0 +1,125 @@
+""" Concurrent MX and address resolution with a TTL-respecting cache. """
+import collections
+import time
+from multiprocessing.pool import ThreadPool
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver # Dependency: dnspython
+
+from starttls_policy import util
+from starttls_policy.scan import cache
+
+DEFAULT_TIMEOUT = 5
+DEFAULT_WORKERS = 32
+# Used for negative answers that come without an SOA record to take the
+# negative-caching TTL from (RFC 2308).
+DEFAULT_NEGATIVE_TTL = 300
+
+MXRecord = collections.namedtuple('MXRecord', ['preference', 'host', 'addresses'])
+
+
+class ResolveError(Exception):
+    """ A lookup failed for a reason other than the name or record type
+    not existing, e.g. a timeout or SERVFAIL. These aren't cached. """
+
+
+def _negative_ttl(response, default):
+    """ Negative-caching TTL from the SOA in a response's authority section. """
+    if response is not None:
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum)
+    return default
+
+
+class Resolver(object):
+    """ Caching stub resolver. Answers, including NXDOMAIN and empty
+    answers, are kept for as long as their TTL allows.
+    """
+
+    def __init__(self, nameservers=None, port=53, timeout=DEFAULT_TIMEOUT,
+                 workers=DEFAULT_WORKERS, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_size=cache.DEFAULT_MAX_SIZE, clock=time.time):
+        """ :param nameservers list: IP addresses of the recursive resolvers to
+            use. Defaults to the system configuration.
+        :param port int: Port the nameservers listen on. """
+        self._resolver = dns.resolver.Resolver(configure=nameservers is None)
+        if nameservers is not None:
+            self._resolver.nameservers = list(nameservers)
+        self._resolver.port = port
+        self._resolver.lifetime = timeout
+        self.workers = workers
+        self.negative_ttl = negative_ttl
+        self._cache = util.TTLCache(max_size, clock)
+
+    @property
+    def hits(self):
+        """ Number of queries answered from the cache. """
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        """ Number of queries sent to the nameservers. """
+        return self._cache.misses
+
+    def _lookup(self, name, rdtype):
+        resolve = getattr(self._resolver, 'resolve', None) or self._resolver.query
+        try:
+            answer = resolve(name, rdtype, raise_on_no_answer=False)
+        except dns.resolver.NXDOMAIN as e:
+            responses = list(e.responses().values()) if hasattr(e, 'responses') else []
+            return (), _negative_ttl(responses[0] if responses else None, self.negative_ttl)
+        except dns.exception.DNSException as e:
+            raise ResolveError('{} lookup for {} failed: {}'.format(rdtype, name, e))
+        if answer.rrset is None:
+            return (), _negative_ttl(answer.response, self.negative_ttl)
+        return tuple(answer.rrset), answer.rrset.ttl
+
+    def query(self, name, rdtype):
+        """ Returns the records of type `rdtype` for `name` as a tuple of
+        dnspython rdata objects; empty if there are none.
+        :raises ResolveError: if the lookup failed. """
+        name = name.lower().rstrip('.')
+        return self._cache.get_or_compute(
+            (name, rdtype), lambda: self._lookup(name, rdtype))
+
+    def addresses(self, host):
+        """ Returns IPv4 then IPv6 addresses for `host` as a list of strings. """
+        return [rdata.address for rdtype in ('A', 'AAAA')
+                for rdata in self.query(host, rdtype)]
+
+    def mx(self, domain):
+        """ Returns the MX hosts for `domain` with their addresses, as a list
+        of `MXRecord` sorted by preference. Null MX records are left out.
+        :raises ResolveError: if any lookup failed. """
+        records = []
+        for rdata in sorted(self.query(domain, 'MX'), key=lambda r: r.preference):
+            host = rdata.exchange.to_text().rstrip('.').lower()
+            if host:
+                records.append(MXRecord(rdata.preference, host, self.addresses(host)))
+        return records
+
+    def _mx_or_error(self, domain):
+        try:
+            return domain, self.mx(domain), None
+        except ResolveError as e:
+            return domain, [], e
+
+    def resolve_many(self, domains):
+        """ Resolves MX records for many domains concurrently.
+        Yields (domain, list of `MXRecord`, error) tuples in input order,
+        where error is a `ResolveError` or None. `domains` is read lazily:
+        at most twice `workers` domains are taken ahead of the results. """
+        pool = ThreadPool(self.workers)
+        window = 2 * self.workers
+        in_flight = collections.deque()
+        try:
+            for domain in domains:
+                if len(in_flight) >= window:
+                    yield in_flight.popleft().get()
+                in_flight.append(pool.apply_async(self._mx_or_error, (domain,)))
+            while in_flight:
+                yield in_flight.popleft().get()
+        finally:
+            pool.terminate()
@@ -0,0 +1,156 @@
+""" Per-domain scan results, streamed as JSON lines, and folded into a
+policy `Config`.
+
+The scanner appends one line per mail domain as soon as the domain is
+done, so the results file can be read, or folded into a policy, while a
+long scan is still running. Later lines for a domain replace earlier ones.
+"""
+import collections
+import datetime
+import json
+import threading
+
+from starttls_policy import policy
+from starttls_policy import util
+
+# How long a generated policy file is valid for.
+DEFAULT_LIFETIME = datetime.timedelta(days=28)
+
+DomainResult = collections.namedtuple('DomainResult', [
+    'domain',           # mail domain
+    'time',             # seconds since the epoch when its MX hosts were probed
+    'mxs',              # sorted `mxs` patterns covering the hosts that offered STARTTLS
+    'min_tls_version',  # oldest protocol those hosts negotiated
+    'error',            # why the domain can't get a policy, or None
+    ])
+
+
+# Highest `min-tls-version` a scan sets. Requiring more would turn away
+# senders that can't yet speak TLSv1.3, although every MX host can.
+MAX_MIN_TLS_VERSION = 'TLSv1.2'
+
+
+def _version_floor(observation, versions):
+    """ Highest version, up to `MAX_MIN_TLS_VERSION`, that a policy can
+    require of an MX host: the best it's known to support. """
+    scan = versions(observation.host) if versions is not None else None
+    if scan is not None and scan.supported:
+        best = max(scan.supported, key=util.TLS_VERSIONS.index)
+    else:
+        best = observation.protocol
+    return min(best, MAX_MIN_TLS_VERSION, key=util.TLS_VERSIONS.index)
+
+def evaluate(domain, observations, verify, suffix_index, versions=None):
+    """ Decides whether a mail domain can get a policy, and what it is.
+    The policy's `min-tls-version` is the highest version that every MX
+    host accepts, but no higher than `MAX_MIN_TLS_VERSION`.
+    :param observations list: `certstore.Observation` of each MX host.
+    :param verify: function taking an Observation and returning True if
+        the certificate chain it saw is valid.
+    :param suffix_index suffix.SuffixIndex: used to reduce MX hostnames
+        to `mxs` patterns.
+    :param versions: function taking an MX hostname and returning its
+        `versions.VersionScan`, or None. Without a scan, the version
+        negotiated by the normal probe is used.
+    :returns DomainResult: """
+    if not observations:
+        return DomainResult(domain, None, [], None, 'no MX hosts')
+    when = max(obs.time for obs in observations)
+    tls = [obs for obs in observations if obs.starttls]
+    if not tls:
+        return DomainResult(domain, when, [], None, 'no MX host offered STARTTLS')
+    for obs in tls:
+        if obs.protocol not in util.TLS_VERSIONS:
+            return DomainResult(domain, when, [], None,
+                                '{}: negotiated {}'.format(obs.host, obs.protocol))
+        if not verify(obs):
+            return DomainResult(domain, when, [], None,
+                                '{}: invalid certificate'.format(obs.host))
+    min_version = min((_version_floor(obs, versions) for obs in tls),
+                      key=util.TLS_VERSIONS.index)
+    return DomainResult(domain, when, suffix_index.covering_patterns(obs.host for obs in tls),
+                        min_version, None)
+
+
+class ResultWriter(object):
+    """ Writes `DomainResult`s to a file, one JSON object per line.
+    Each line is flushed as it's written. Safe to share between threads.
+    """
+
+    def __init__(self, f):
+        self._file = f
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        """ Appends a result. """
+        line = json.dumps({
+            'domain': result.domain,
+            'time': result.time,
+            'mxs': result.mxs,
+            'min-tls-version': result.min_tls_version,
+            'error': result.error,
+            }, sort_keys=True)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+
+def read_results(f):
+    """ Iterates the `DomainResult`s in a file written by `ResultWriter`.
+    A last line cut short by a writer that is still running, or was
+    killed, is skipped. """
+    for line in f:
+        if not line.endswith('\n'):
+            break
+        obj = json.loads(line)
+        yield DomainResult(obj['domain'], obj['time'], obj['mxs'],
+                           obj['min-tls-version'], obj['error'])
+
+
+def fold(results, config, mode='testing'):
+    """ Adds the policies found by a scan to `config`.
+
+    Only the latest result for each domain counts. Domains without an
+    error get a policy; if they already have one, only its `mxs` and
+    `min-tls-version` are updated. Domains with an error, and domains
+    whose policy is an alias, are left alone.
+
+    :param results: iterable of `DomainResult`.
+    :param config policy.Config: updated in place.
+    :param mode str: for new policies.
+    :returns int: number of policies added or updated. """
+    latest = {}
+    for result in results:
+        latest[result.domain] = result
+    policies = dict(config.policies or {})
+    count = 0
+    for domain, result in latest.items():
+        if result.error is not None:
+            continue
+        existing = policies.get(domain)
+        if existing is None:
+            policies[domain] = policy.Policy(
+                {'mxs': result.mxs, 'min-tls-version': result.min_tls_version, 'mode': mode},
+                config.pinsets, config.policy_aliases)
+        elif existing.policy_alias is not None:
+            continue
+        else:
+            existing.mxs = result.mxs
+            existing.min_tls_version = result.min_tls_version
+        count += 1
+    config.policies = policies
+    return count
+
+
+def new_config(filename, author=None, now=None):
+    """ An empty policy `Config`, valid for `DEFAULT_LIFETIME` from `now`. """
+    now = datetime.datetime.now() if now is None else now
+    config = policy.Config(filename)
+    config.load_from_dict({
+        'timestamp': now,
+        'expires': now + DEFAULT_LIFETIME,
+        'policies': {},
+        })
+    if author is not None:
+        config.author = author
+    return config
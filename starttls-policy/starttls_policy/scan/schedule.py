@@ -0,0 +1,266 @@
+""" Fair, rate-limited scheduling of connections to MX hosts.
+
+Large mail providers throttle or tarpit clients that open many SMTP
+connections at once. The scheduler runs probes on a fixed pool of worker
+threads, and only starts a probe when its destination IP and provider
+are both below their concurrency caps and have a token left in their
+rate buckets. Destinations take turns, so a long run of domains hosted by
+one provider doesn't hold up everyone else.
+
+Destinations with queued probes wait in a heap, keyed on when their rate
+limits next allow a connection, with ties going to whoever has waited
+longest. One at its concurrency cap is set aside until a probe to that
+IP or provider finishes. Picking the next probe is then logarithmic in
+the number of destinations, rather than a pass over all of them.
+"""
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+DEFAULT_WORKERS = 64
+DEFAULT_PER_IP = 2
+DEFAULT_PER_PROVIDER = 8
+# Connections per second, per destination IP and per provider.
+DEFAULT_IP_RATE = 1.0
+DEFAULT_PROVIDER_RATE = 5.0
+
+DestinationStats = collections.namedtuple('DestinationStats', [
+    'destination', 'provider', 'count', 'total_wait', 'max_wait'])
+
+
+class SchedulerClosed(Exception):
+    """ The scheduler was closed while a probe was waiting its turn. """
+
+
+def default_provider(host):
+    """ Rough guess at who runs an MX host: its last two DNS labels. """
+    return '.'.join(host.lower().rstrip('.').split('.')[-2:])
+
+
+class TokenBucket(object):
+    """ Allows `rate` events per second on average, in bursts of up to
+    `burst`. Not thread-safe by itself. """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = now
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def delay(self, now):
+        """ Seconds until a token is available; 0 if one is now. """
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def take(self, now):
+        """ Uses up a token. """
+        self._refill(now)
+        self._tokens -= 1
+
+
+class _Task(object):
+    def __init__(self, func, args, kwargs, ip, provider, now):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.ip = ip
+        self.provider = provider
+        self.queued = now
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        """ Calls the function, keeping its result or the exception it
+        raised, and wakes up whoever is waiting on `done`. """
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as e: # pylint: disable=broad-except
+            self.error = e
+        self.done.set()
+
+
+class Scheduler(object):
+    """ Runs probes on worker threads, with per-IP and per-provider
+    concurrency caps, token-bucket rate limits and round-robin fairness
+    across destination IPs. Use `wrap` to get a rate-limited version of a
+    probe function, and `close` when done.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, per_ip=DEFAULT_PER_IP,
+                 per_provider=DEFAULT_PER_PROVIDER, ip_rate=DEFAULT_IP_RATE,
+                 provider_rate=DEFAULT_PROVIDER_RATE, provider_of=default_provider,
+                 clock=time.time):
+        """ :param ip_rate float: connections per second to one IP, or None
+            for no limit. Bursts of up to `per_ip` are allowed.
+        :param provider_rate float: connections per second to one provider,
+            or None for no limit. Bursts of up to `per_provider` are allowed.
+        :param provider_of: function from MX hostname to provider name. """
+        self.per_ip = per_ip
+        self.per_provider = per_provider
+        self.ip_rate = ip_rate
+        self.provider_rate = provider_rate
+        self._provider_of = provider_of
+        self._clock = clock
+        self._cond = threading.Condition()
+        # Queued tasks per destination IP.
+        self._queues = {}
+        # (time the IP may next connect, turn, IP) of every IP with queued
+        # tasks that isn't blocked; the turn breaks ties first come, first
+        # served.
+        self._ready = []
+        self._turns = itertools.count()
+        # ('ip', IP) or ('provider', provider) at its concurrency cap, to
+        # the `_ready` entries waiting for it.
+        self._blocked = collections.defaultdict(list)
+        self._active = collections.defaultdict(int)
+        self._buckets = {}
+        self._stats = {}
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work) for _ in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _bucket(self, key, rate, burst, now):
+        if rate is None:
+            return None
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def _push(self, ip, when):
+        heapq.heappush(self._ready, (when, next(self._turns), ip))
+
+    def _unblock(self, key):
+        for entry in self._blocked.pop(key, ()):
+            heapq.heappush(self._ready, entry)
+
+    def _pick(self, now):
+        """ Dequeues the next runnable task, taking destinations in turn.
+        :returns: (task, None), or (None, seconds until a rate limit lifts
+            or None if only concurrency caps or an empty queue stand in
+            the way). """
+        ready = self._ready
+        while ready and ready[0][0] <= now:
+            entry = heapq.heappop(ready)
+            ip = entry[2]
+            tasks = self._queues[ip]
+            provider = tasks[0].provider
+            if self._active[('ip', ip)] >= self.per_ip:
+                self._blocked[('ip', ip)].append(entry)
+                continue
+            if self._active[('provider', provider)] >= self.per_provider:
+                self._blocked[('provider', provider)].append(entry)
+                continue
+            buckets = [b for b in (
+                self._bucket(('ip', ip), self.ip_rate, self.per_ip, now),
+                self._bucket(('provider', provider), self.provider_rate,
+                             self.per_provider, now)) if b is not None]
+            delay = max([b.delay(now) for b in buckets] or [0])
+            if delay > 0:
+                self._push(ip, now + delay)
+                continue
+            for bucket in buckets:
+                bucket.take(now)
+            task = tasks.popleft()
+            if tasks:
+                # Back of the line.
+                self._push(ip, now)
+            else:
+                del self._queues[ip]
+            return task, None
+        return None, (ready[0][0] - now if ready else None)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = self._clock()
+                    task, wait = self._pick(now)
+                    if task is not None:
+                        break
+                    self._cond.wait(wait)
+                self._active[('ip', task.ip)] += 1
+                self._active[('provider', task.provider)] += 1
+                self._record_wait(task, now - task.queued)
+            task.run()
+            with self._cond:
+                self._active[('ip', task.ip)] -= 1
+                self._active[('provider', task.provider)] -= 1
+                self._unblock(('ip', task.ip))
+                self._unblock(('provider', task.provider))
+                self._cond.notify_all()
+
+    def _record_wait(self, task, waited):
+        stats = self._stats.get(task.ip)
+        if stats is None:
+            stats = DestinationStats(task.ip, task.provider, 0, 0.0, 0.0)
+        self._stats[task.ip] = DestinationStats(
+            task.ip, task.provider, stats.count + 1, stats.total_wait + waited,
+            max(stats.max_wait, waited))
+
+    def submit(self, host, address, func, *args, **kwargs):
+        """ Queues `func(*args, **kwargs)` as a connection to `host` at
+        `address`, and waits for it to run.
+        :returns: whatever `func` returns; re-raises what it raises. """
+        ip = address or host.lower()
+        with self._cond:
+            task = _Task(func, args, kwargs, ip, self._provider_of(host), self._clock())
+            tasks = self._queues.get(ip)
+            if tasks is None:
+                tasks = self._queues[ip] = collections.deque()
+                self._push(ip, task.queued)
+            tasks.append(task)
+            self._cond.notify_all()
+        task.done.wait()
+        if task.error is not None:
+            raise task.error
+        return task.result
+
+    def wrap(self, probe):
+        """ Returns a scheduled version of a probe function with the
+        signature of `probe.probe`. """
+        def scheduled_probe(host, address=None, **kwargs):
+            """ Probe that waits for its turn with the scheduler. """
+            return self.submit(host, address, probe, host, address, **kwargs)
+        return scheduled_probe
+
+    def close(self):
+        """ Stops the worker threads once they finish their current task.
+        Tasks still queued fail with `SchedulerClosed`. """
+        with self._cond:
+            self._closed = True
+            for tasks in self._queues.values():
+                for task in tasks:
+                    task.error = SchedulerClosed('Scheduler closed before probe ran')
+                    task.done.set()
+            self._queues.clear()
+            del self._ready[:]
+            self._blocked.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        """ Returns `DestinationStats` for every destination IP probed,
+        longest total queue wait first. """
+        with self._cond:
+            return sorted(self._stats.values(), key=lambda s: -s.total_wait)
+
+    def report(self, limit=20):
+        """ Human-readable summary of queue wait time per destination. """
+        lines = ['{:<40} {:<24} {:>6} {:>10} {:>10}'.format(
+            'destination', 'provider', 'probes', 'mean wait', 'max wait')]
+        for stats in self.stats()[:limit]:
+            lines.append('{:<40} {:<24} {:>6} {:>9.2f}s {:>9.2f}s'.format(
+                stats.destination, stats.provider, stats.count,
+                stats.total_wait / stats.count, stats.max_wait))
+        return '\n'.join(lines)
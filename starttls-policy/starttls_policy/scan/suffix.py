@@ -0,0 +1,163 @@
+""" Public suffix lookups and reduction of MX hostnames to `mxs` patterns.
+
+Names are handled as tuples of labels in reverse order, TLD first, so
+that suffixes of a name are prefixes of its tuple. The public suffix list
+is compiled into a trie keyed on those labels; finding the registrable
+domain of a name is then a single walk down the trie, and the compiled
+trie can be cached on disk so the list is only parsed when it changes.
+"""
+import collections
+import io
+import os
+
+from six.moves import cPickle as pickle
+
+from starttls_policy import util
+
+# Where Debian and derivatives install the list (package "publicsuffix").
+DEFAULT_LIST = '/usr/share/publicsuffix/public_suffix_list.dat'
+# Bump when the layout of the compiled trie changes.
+_CACHE_VERSION = 1
+# Key in a trie node saying that a rule ends there: True for a normal or
+# wildcard rule, False for an exception rule. Not an object() sentinel, so
+# the trie can be pickled; instead, empty labels are never looked up.
+_RULE = ''
+_WILDCARD = '*'
+
+
+def labels(name):
+    """ Splits a DNS name into a tuple of labels, TLD first.
+    A leading dot, as in `mxs` patterns, is ignored. """
+    return tuple(reversed(name.lower().strip('.').split('.')))
+
+def join(reversed_labels):
+    """ Inverse of `labels`. """
+    return '.'.join(reversed(reversed_labels))
+
+def common_suffix(label_tuples):
+    """ Longest suffix shared by all the names, in time linear in their
+    total number of labels.
+    :param label_tuples: iterable of names as returned by `labels`.
+    :returns tuple: labels of the common suffix, TLD first. """
+    common = None
+    length = 0
+    for name in label_tuples:
+        if common is None:
+            common, length = name, len(name)
+            continue
+        length = min(length, len(name))
+        for i in range(length):
+            if common[i] != name[i]:
+                length = i
+                break
+    return common[:length] if common else ()
+
+def _idna(rule):
+    try:
+        return rule.encode('idna').decode('ascii')
+    except UnicodeError:
+        return rule
+
+
+class SuffixIndex(object):
+    """ The public suffix list, compiled into a reversed-label trie. """
+
+    def __init__(self, trie):
+        self._trie = trie
+
+    @classmethod
+    def from_lines(cls, lines):
+        """ Compiles the rules of a public suffix list.
+        :param lines: iterable of lines in the format of
+            https://publicsuffix.org/list/public_suffix_list.dat """
+        trie = {}
+        for line in lines:
+            # Rules end at the first whitespace.
+            fields = line.split()
+            if not fields or fields[0].startswith('//'):
+                continue
+            rule = fields[0]
+            exception = rule.startswith('!')
+            rule_labels = labels(_idna(rule.lstrip('!')))
+            if '' in rule_labels:
+                continue
+            node = trie
+            for label in rule_labels:
+                node = node.setdefault(label, {})
+            node[_RULE] = not exception
+        return cls(trie)
+
+    @classmethod
+    def load(cls, filename=DEFAULT_LIST, cache_file=None):
+        """ Reads a public suffix list. If `cache_file` is given, the
+        compiled trie is kept there and reused until `filename` changes. """
+        stat = os.stat(filename)
+        stamp = (_CACHE_VERSION, stat.st_mtime, stat.st_size)
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached_stamp, trie = pickle.load(f)
+                if cached_stamp == stamp:
+                    return cls(trie)
+            except (EOFError, ValueError, pickle.UnpicklingError):
+                pass
+        with io.open(filename, encoding='utf-8') as f:
+            index = cls.from_lines(f)
+        if cache_file is not None:
+            util.write_atomically(cache_file, pickle.dumps((stamp, index._trie), 2))
+        return index
+
+    def suffix_length(self, name_labels):
+        """ Number of labels in the public suffix of a name.
+        :param name_labels tuple: as returned by `labels`. An empty label,
+            as in 'a..com', matches no rule but a wildcard. """
+        length = 1 # Implicit rule "*": any TLD is a public suffix.
+        node = self._trie
+        for depth, label in enumerate(name_labels, 1):
+            child = node.get(label) if label else None
+            if child is not None and child.get(_RULE) is False:
+                return depth - 1
+            wildcard = node.get(_WILDCARD)
+            if (child is not None and child.get(_RULE)) or wildcard is not None:
+                length = depth
+            node = child if child is not None else wildcard
+            if node is None:
+                break
+        return min(length, len(name_labels))
+
+    def registrable(self, name_labels):
+        """ Labels of the registrable domain of a name: its public suffix
+        plus one more label. Returns None if the name is a public suffix. """
+        length = self.suffix_length(name_labels) + 1
+        if len(name_labels) < length:
+            return None
+        return name_labels[:length]
+
+    def registrable_domain(self, name):
+        """ Registrable domain of `name`, e.g. 'google.com' for
+        'alt1.aspmx.l.google.com'. A name that is itself a public suffix is
+        returned as is. """
+        name_labels = labels(name)
+        return join(self.registrable(name_labels) or name_labels)
+
+    def covering_patterns(self, hosts):
+        """ Fewest `mxs` patterns that match all of `hosts` without
+        matching hosts under other registrable domains. Hosts under one
+        registrable domain are covered by ".<their longest common
+        suffix>"; a lone host is listed as is.
+        :returns list: sorted patterns. """
+        groups = collections.defaultdict(set)
+        for host in hosts:
+            name_labels = labels(host)
+            groups[self.registrable(name_labels) or name_labels].add(name_labels)
+        patterns = set()
+        for names in groups.values():
+            if len(names) == 1:
+                patterns.add(join(next(iter(names))))
+                continue
+            common = common_suffix(names)
+            if common in names:
+                # ".example.com" doesn't match example.com itself.
+                patterns.add(join(common))
+            patterns.add('.' + join(common))
+        return sorted(patterns)
@@ -0,0 +1,77 @@
+""" In-process certificate chain verification against a trust store. """
+import collections
+import hashlib
+import ssl
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.x509.oid import ExtendedKeyUsageOID
+from OpenSSL import crypto # Dependency: pyOpenSSL
+
+from starttls_policy import util
+from starttls_policy.scan import cache
+
+# Verification results only change when certificates expire, so a run
+# can keep reusing them.
+DEFAULT_RESULT_TTL = 24 * 60 * 60
+
+Verification = collections.namedtuple('Verification', ['valid', 'error'])
+
+
+def _check_server_purpose(leaf):
+    """ Equivalent of `openssl verify -purpose sslserver` for the leaf:
+    if it restricts its extended key usage, serverAuth must be allowed. """
+    cert = x509.load_der_x509_certificate(leaf, default_backend())
+    try:
+        usages = cert.extensions.get_extension_for_class(x509.ExtendedKeyUsage).value
+    except x509.ExtensionNotFound:
+        return None
+    if (ExtendedKeyUsageOID.SERVER_AUTH in usages or
+            ExtendedKeyUsageOID.ANY_EXTENDED_KEY_USAGE in usages):
+        return None
+    return 'unsupported certificate purpose'
+
+
+class TrustStore(object):
+    """ Set of trust roots, loaded once, that chains observed by the
+    scanner are verified against. Results are memoized by the
+    fingerprints of the certificates in the chain.
+    """
+
+    def __init__(self, cafile=None, capath=None, at_time=None,
+                 max_size=cache.DEFAULT_MAX_SIZE):
+        """ If neither `cafile` nor `capath` is given, uses the default
+        locations of the OpenSSL that Python's ssl module is linked against.
+        :param cafile str: File of concatenated PEM trust roots.
+        :param capath str: Directory of PEM trust roots with hashed symlinks,
+            as made by `c_rehash`.
+        :param at_time datetime.datetime: Verify as of this time instead of now. """
+        if cafile is None and capath is None:
+            paths = ssl.get_default_verify_paths()
+            cafile, capath = paths.cafile, paths.capath
+        self._store = crypto.X509Store()
+        self._store.load_locations(cafile, capath)
+        if at_time is not None:
+            self._store.set_time(at_time)
+        self._results = util.TTLCache(max_size)
+
+    def _verify(self, chain):
+        if not chain:
+            return Verification(False, 'no certificate presented')
+        certs = [crypto.load_certificate(crypto.FILETYPE_ASN1, der) for der in chain]
+        context = crypto.X509StoreContext(self._store, certs[0], chain=certs[1:])
+        try:
+            context.verify_certificate()
+        except crypto.X509StoreContextError as e:
+            return Verification(False, str(e))
+        error = _check_server_purpose(chain[0])
+        return Verification(error is None, error)
+
+    def verify(self, chain):
+        """ Verifies a chain as presented by a server. Every certificate after
+        the leaf is used as an untrusted intermediate, in any order.
+        :param chain list: DER-encoded certificates, leaf first.
+        :returns Verification: """
+        key = tuple(hashlib.sha256(der).digest() for der in chain)
+        return self._results.get_or_compute(
+            key, lambda: (self._verify(chain), DEFAULT_RESULT_TTL))
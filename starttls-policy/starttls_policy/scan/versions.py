@@ -0,0 +1,163 @@
+""" Probing which TLS versions an MX host supports.
+
+A normal probe only shows the version the server picked when offered
+everything we support. Here each version is tried on its own connection,
+all at once, and the server's choice of cipher is recorded for each.
+"""
+import collections
+import ssl
+import warnings
+from multiprocessing.pool import ThreadPool
+
+from starttls_policy import util
+from starttls_policy.scan import cache
+from starttls_policy.scan import probe as probe_module
+
+DEFAULT_WORKERS = 32
+DEFAULT_TTL = 24 * 60 * 60
+# OpenSSL 3 only negotiates TLSv1 and TLSv1.1 at security level 0.
+_ALL_CIPHERS = 'ALL:@SECLEVEL=0'
+_TLS_VERSIONS = {
+    'TLSv1': 'TLSv1',
+    'TLSv1.1': 'TLSv1_1',
+    'TLSv1.2': 'TLSv1_2',
+    'TLSv1.3': 'TLSv1_3',
+    }
+
+VersionScan = collections.namedtuple('VersionScan', [
+    'host',          # MX hostname
+    'address',       # IP address probed
+    'supported',     # dict of version to the cipher the server chose
+    'refused',       # dict of version to why the server rejected it, or
+                     # why it wasn't tried
+    'cipher_order',  # dict of version to cipher names in the server's order
+                     # of preference, for versions where it was asked for
+    'errors',        # dict of version to a network or temporary failure
+                     # that left it unknown, e.g. a timeout or a 4xx reply
+    ])
+
+
+def supported_range(scan):
+    """ Returns the (lowest, highest) version in a `VersionScan`, or
+    (None, None) if none was supported. """
+    versions = sorted(scan.supported, key=util.TLS_VERSIONS.index)
+    if not versions:
+        return None, None
+    return versions[0], versions[-1]
+
+def version_context(version, ciphers=_ALL_CIPHERS):
+    """ SSL context for probing that offers only `version`.
+    :raises ValueError: if the local ssl module can't offer it. """
+    tls_version = getattr(getattr(ssl, 'TLSVersion', None), _TLS_VERSIONS[version], None)
+    if tls_version is None:
+        raise ValueError('{} not available in this ssl module'.format(version))
+    context = probe_module.default_context()
+    with warnings.catch_warnings():
+        # Setting TLSv1 and TLSv1.1 is deprecated, but probing for them is the point.
+        warnings.simplefilter('ignore', DeprecationWarning)
+        context.minimum_version = tls_version
+        context.maximum_version = tls_version
+    try:
+        context.set_ciphers(ciphers)
+    except ssl.SSLError as e:
+        raise ValueError(str(e))
+    return context
+
+def _ciphers_for(version):
+    """ Names of the cipher suites we can offer with `version`, other than
+    TLSv1.3 suites, which the ssl module can't restrict. """
+    return [cipher['name'] for cipher in version_context(version).get_ciphers()
+            if cipher['protocol'] != 'TLSv1.3']
+
+
+class VersionScanner(object):
+    """ Finds the TLS versions that MX hosts support. Results are cached
+    per host and address. Call `close` when done.
+    """
+
+    def __init__(self, probe=probe_module.probe, versions=util.TLS_VERSIONS,
+                 workers=DEFAULT_WORKERS, cipher_order=False, ttl=DEFAULT_TTL,
+                 max_size=cache.DEFAULT_MAX_SIZE):
+        """ :param probe: function with the signature of `probe.probe`,
+            e.g. a `schedule.Scheduler.wrap`ped one.
+        :param cipher_order bool: Also find the server's order of cipher
+            preference for versions before TLSv1.3. Takes a connection
+            per cipher the server accepts. """
+        self._probe = probe
+        self.versions = versions
+        self.cipher_order = cipher_order
+        self.ttl = ttl
+        self._pool = ThreadPool(workers)
+        self._results = util.TTLCache(max_size)
+
+    def close(self):
+        """ Stops the worker threads. """
+        self._pool.close()
+        self._pool.join()
+
+    def scan(self, result):
+        """ Tries each TLS version against the host of a probe result.
+        :param result probe.ProbeResult: a normal probe of the host. Its
+            address is reused, and the version it negotiated isn't tried
+            again. Hosts that didn't offer STARTTLS aren't tried at all.
+        :returns VersionScan: """
+        if 'STARTTLS' not in result.capabilities:
+            return VersionScan(result.host, result.address, {}, {}, {}, {})
+        key = (result.host.lower(), result.address)
+        def compute():
+            scan = self._scan(result)
+            # A scan with versions left unknown is tried again next time.
+            return scan, 0 if scan.errors else self.ttl
+        return self._results.get_or_compute(key, compute)
+
+    def _scan(self, result):
+        supported, refused, orders, errors = {}, {}, {}, {}
+        known = result.protocol if result.starttls else None
+        if known in self.versions:
+            supported[known] = result.cipher
+        jobs = [(result.host, result.address, version, supported.get(version))
+                for version in self.versions
+                if version not in supported or (self.cipher_order and version != 'TLSv1.3')]
+        for version, cipher, refusal, error, order in self._pool.map(self._try, jobs):
+            if refusal is not None:
+                refused[version] = refusal
+            elif error is not None:
+                errors[version] = error
+            else:
+                supported[version] = cipher
+                if order is not None:
+                    orders[version] = order
+        return VersionScan(result.host, result.address, supported, refused, orders, errors)
+
+    def _try(self, job):
+        host, address, version, cipher = job
+        try:
+            context = version_context(version)
+        except ValueError as e:
+            return version, None, 'Not tested: {}'.format(e), None, None
+        if cipher is None:
+            result = self._probe(host, address, context=context)
+            if probe_module.handshake_refused(result):
+                return version, None, result.error, None, None
+            if not result.starttls:
+                return version, None, None, result.error, None
+            cipher = result.cipher
+        order = None
+        if self.cipher_order and version != 'TLSv1.3':
+            order = self._cipher_order(host, address, version, cipher)
+        return version, cipher, None, None, order
+
+    def _cipher_order(self, host, address, version, first):
+        """ Offers the ciphers the server hasn't picked yet until it refuses
+        them all. """
+        order = [first]
+        offered = _ciphers_for(version)
+        while True:
+            remaining = [name for name in offered if name not in order]
+            if not remaining:
+                return order
+            context = version_context(version, ':'.join(remaining) + ':@SECLEVEL=0')
+            result = self._probe(host, address, context=context)
+            if not result.starttls or result.cipher in order:
+                return order
+            order.append(result.cipher)
@@ -0,0 +1,63 @@
+""" Tests for report/aggregate.py """
+import io
+import unittest
+
+from starttls_policy.report import aggregate
+
+REPORT = u'''Address Suffix,Hostname Suffix,Direction,UN M.49 Region Code,Region Name,\
+Fraction Encrypted
+example.com,mx.example.com,outbound,001,World,0.995
+example.com,mx.example.com,outbound,150,Europe,1
+example.com,mx.example.com,inbound,001,World,0.2
+lossy.example,mx.lossy.example,outbound,001,World,0.5
+lossy.example,mx.lossy.example,outbound,019,Americas,1
+yahoo.{...},yahoodns.net,outbound,001,World,1
+"quoted, suffix.example",mx.example,outbound,001,World,1
+broken.example,outbound,001
+nan.example,mx.nan.example,outbound,001,World,unknown
+'''
+
+def _aggregate(text, **kwargs):
+    return aggregate.Aggregator(**kwargs).add_rows(aggregate.read_rows(io.StringIO(text)))
+
+class TestAggregator(unittest.TestCase):
+    """ Unittests for the streaming report aggregator. """
+
+    def test_results(self):
+        results = list(_aggregate(REPORT).results())
+        self.assertEqual([stats.suffix for stats in results],
+                         ['example.com', 'gmail.com', 'lossy.example',
+                          'quoted, suffix.example', 'yahoo.com'])
+        self.assertEqual(results[0], aggregate.SuffixStats('example.com', 0.995, 2, ['001', '150']))
+        self.assertEqual(results[1], aggregate.SuffixStats('gmail.com', 1.0, 0, []))
+
+    def test_candidates(self):
+        aggregator = _aggregate(REPORT)
+        self.assertEqual([stats.suffix for stats in aggregator.candidates()],
+                         ['example.com', 'gmail.com', 'quoted, suffix.example', 'yahoo.com'])
+        self.assertEqual([stats.suffix for stats in aggregator.candidates(threshold=0.999)],
+                         ['gmail.com', 'quoted, suffix.example', 'yahoo.com'])
+        self.assertEqual(aggregator.rows, 10)
+        self.assertEqual(aggregator.skipped, 2)
+
+    def test_inbound(self):
+        aggregator = _aggregate(REPORT, direction='inbound', known={})
+        self.assertEqual(list(aggregator.results()),
+                         [aggregate.SuffixStats('example.com', 0.2, 1, ['001'])])
+
+    def test_merge(self):
+        lines = REPORT.splitlines(True)
+        merged = _aggregate(''.join(lines[:4])).merge(_aggregate(''.join(lines[4:]), known={}))
+        whole = _aggregate(REPORT)
+        self.assertEqual(list(merged.results()), list(whole.results()))
+        self.assertEqual((merged.rows, merged.skipped), (whole.rows, whole.skipped))
+        self.assertEqual(len(merged), 5)
+        self.assertEqual(sorted(merged.stats()), list(whole.results()))
+
+    def test_known(self):
+        self.assertEqual([stats.suffix for stats in aggregate.Aggregator().stats()],
+                         ['gmail.com'])
+        self.assertEqual(len(aggregate.Aggregator(known={})), 0)
+
+if __name__ == '__main__':
+    unittest.main()
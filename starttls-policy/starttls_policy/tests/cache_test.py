@@ -0,0 +1,67 @@
+""" Tests for scan/cache.py """
+import threading
+import unittest
+
+from starttls_policy.scan import cache
+from starttls_policy.scan import probe
+
+class FakeClock(object):
+    """ Manually advanced clock. """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def _result(host, address, starttls=True):
+    return probe.ProbeResult(host, address or '192.0.2.1', frozenset(), starttls,
+                             'TLSv1.2', 'AES', [b'leaf'], None)
+
+class TestProbeCache(unittest.TestCase):
+    """ Unittests for ProbeCache. """
+
+    def setUp(self):
+        self.calls = []
+        self.clock = FakeClock()
+
+    def fake_probe(self, host, address=None, starttls=True):
+        """ Records the call and returns a canned result. """
+        self.calls.append((host, address))
+        return _result(host, address, starttls)
+
+    def test_shares_probe_between_domains(self):
+        probes = cache.ProbeCache(probe=self.fake_probe, clock=self.clock)
+        for _ in range(5):
+            self.assertTrue(probes.get('MX.example.com').starttls)
+        probes.get('mx.example.com', '192.0.2.2')
+        self.assertEqual(self.calls, [('MX.example.com', None),
+                                      ('mx.example.com', '192.0.2.2')])
+        self.assertEqual((probes.hits, probes.misses), (4, 2))
+
+    def test_failures_expire_sooner(self):
+        probes = cache.ProbeCache(ttl=100, failure_ttl=10, probe=self.fake_probe,
+                                  clock=self.clock)
+        probes.get('good.example.com')
+        probes.get('bad.example.com', starttls=False)
+        self.clock.now += 50
+        probes.get('good.example.com')
+        probes.get('bad.example.com', starttls=False)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_concurrent_lookups_probe_once(self):
+        release = threading.Event()
+        def slow_probe(host, address=None):
+            release.wait()
+            return self.fake_probe(host, address)
+        probes = cache.ProbeCache(probe=slow_probe)
+        threads = [threading.Thread(target=probes.get, args=('mx.example.com',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.calls), 1)
+
+if __name__ == '__main__':
+    unittest.main()
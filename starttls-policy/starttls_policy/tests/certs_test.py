@@ -0,0 +1,26 @@
+""" Tests for scan/certs.py """
+import hashlib
+import unittest
+
+from starttls_policy.scan import certs
+from starttls_policy.tests import fakesmtp
+
+class TestCerts(unittest.TestCase):
+    """ Unittests for certificate helpers. """
+
+    def test_extract_names(self):
+        cert = fakesmtp.make_cert(u'MX.example.com',
+                                  sans=[u'mx.example.com', u'*.mail.example.com'])[0]
+        self.assertEqual(certs.extract_names(fakesmtp.der(cert)),
+                         set(['mx.example.com', '*.mail.example.com']))
+
+    def test_extract_names_without_san(self):
+        cert = fakesmtp.make_cert(u'mx.example.org')[0]
+        self.assertEqual(certs.extract_names(fakesmtp.der(cert)), set(['mx.example.org']))
+
+    def test_fingerprint(self):
+        der = fakesmtp.der(fakesmtp.make_cert(u'mx.example.org')[0])
+        self.assertEqual(certs.fingerprint(der), hashlib.sha256(der).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
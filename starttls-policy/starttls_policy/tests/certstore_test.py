@@ -0,0 +1,52 @@
+""" Tests for scan/certstore.py """
+import os
+import shutil
+import tempfile
+import unittest
+
+from starttls_policy.scan import certs
+from starttls_policy.scan import certstore
+from starttls_policy.scan import probe
+from starttls_policy.tests import fakesmtp
+
+class TestCertStore(unittest.TestCase):
+    """ Unittests for CertStore. """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = certstore.CertStore(self.root)
+        ca = fakesmtp.make_cert(u'Test CA', is_ca=True)
+        leaf = fakesmtp.make_cert(u'mx.example.com', sans=[u'mx.example.com'], issuer=ca)[0]
+        self.chain = [fakesmtp.der(leaf), fakesmtp.der(ca[0])]
+        self.result = probe.ProbeResult('mx.example.com', '192.0.2.1', frozenset(['STARTTLS']),
+                                        True, 'TLSv1.2', 'ECDHE-ECDSA-AES128-GCM-SHA256',
+                                        self.chain, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _stored_certs(self):
+        return [name for _, _, files in os.walk(self.root) for name in files]
+
+    def test_observe(self):
+        obs = self.store.observe(self.result, now=1234)
+        self.assertEqual(obs.names, ['mx.example.com'])
+        self.assertEqual(obs.protocol, 'TLSv1.2')
+        self.assertEqual(obs.time, 1234)
+        self.assertEqual(obs.chain, [certs.fingerprint(der) for der in self.chain])
+        self.assertEqual(self.store.get_chain(obs), self.chain)
+
+    def test_certs_stored_once(self):
+        for _ in range(3):
+            self.store.observe(self.result)
+        self.assertEqual(len(self._stored_certs()), 2)
+
+    def test_failed_probe(self):
+        failed = probe.ProbeResult('mx.example.net', None, frozenset(), False,
+                                   None, None, [], 'STARTTLS not offered')
+        obs = self.store.observe(failed)
+        self.assertEqual((obs.chain, obs.names), ([], []))
+        self.assertFalse(obs.starttls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+""" Tests for scan/checkpoint.py """
+import os
+import shutil
+import tempfile
+import unittest
+
+from starttls_policy.scan import checkpoint
+
+class FakeClock(object):
+    """ Clock that only moves when told to. """
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+class TestCheckpoint(unittest.TestCase):
+    """ Unittests for Checkpoint. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.filename = os.path.join(self.tmp, 'checkpoint.json')
+
+    def test_position_waits_for_earlier_domains(self):
+        point = checkpoint.Checkpoint(self.filename, ['in.txt'], 'out.jsonl')
+        domains = ['a.com', 'b.com', 'a.com', 'c.com']
+        self.assertEqual(list(point.pending(domains)), domains)
+        point.finish('b.com')
+        point.finish('c.com')
+        self.assertEqual(point.position, 0)
+        point.finish('a.com')
+        self.assertEqual(point.position, 2)
+        point.finish('a.com')
+        self.assertEqual(point.position, 4)
+
+    def test_save_and_resume(self):
+        clock = FakeClock()
+        point = checkpoint.Checkpoint(self.filename, ['in.txt'], 'out.jsonl',
+                                      interval=10, clock=clock)
+        pending = point.pending(['a.com', 'b.com', 'c.com'])
+        next(pending)
+        point.finish('a.com')
+        self.assertFalse(os.path.exists(self.filename))
+        next(pending)
+        clock.now = 10
+        point.finish('b.com')
+        self.assertTrue(os.path.exists(self.filename))
+        resumed = checkpoint.Checkpoint.load(self.filename)
+        self.assertEqual((resumed.inputs, resumed.results, resumed.position),
+                         (['in.txt'], 'out.jsonl', 2))
+        self.assertEqual(list(resumed.pending(['a.com', 'b.com', 'c.com'])), ['c.com'])
+        self.assertEqual(checkpoint.Checkpoint.load(self.filename + '.missing'), None)
+
+    def test_truncate_partial_line(self):
+        filename = os.path.join(self.tmp, 'results.jsonl')
+        checkpoint.truncate_partial_line(filename)
+        self.assertFalse(os.path.exists(filename))
+        lines = b''.join(b'{"line": %d}\n' % i for i in range(2000))
+        for tail, expected in ((b'', lines), (b'{"cut', lines), (b'x' * 20000, lines)):
+            with open(filename, 'wb') as f:
+                f.write(lines + tail)
+            checkpoint.truncate_partial_line(filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+        with open(filename, 'wb') as f:
+            f.write(b'no newline')
+        checkpoint.truncate_partial_line(filename)
+        self.assertEqual(os.path.getsize(filename), 0)
+
+if __name__ == '__main__':
+    unittest.main()
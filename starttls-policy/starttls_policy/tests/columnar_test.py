@@ -0,0 +1,85 @@
+""" Tests for report/columnar.py """
+import io
+import math
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from starttls_policy.report import aggregate
+from starttls_policy.report import columnar
+
+HEADER = u'Address Suffix,Hostname Suffix,Direction,UN M.49 Region Code,Region Name,' \
+         u'Fraction Encrypted\n'
+
+def _rows(*rows):
+    text = HEADER + u''.join(u'{},mx,{},001,World,{}\n'.format(*row) for row in rows)
+    return aggregate.read_rows(io.StringIO(text))
+
+class TestColumnar(unittest.TestCase):
+    """ Unittests for columnar report snapshots. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = columnar.SnapshotStore(self.tmp)
+        self.store.add('2018-01', _rows(('steady.example', 'outbound', 1),
+                                        ('steady.example', 'outbound', 0.995),
+                                        ('falling.example', 'outbound', 1),
+                                        ('yahoo.{...}', 'outbound', 1),
+                                        ('inbound.example', 'inbound', 1)))
+        self.store.add('2018-02', _rows(('falling.example', 'outbound', 0.98),
+                                        ('steady.example', 'outbound', 0.999),
+                                        ('bad.example', 'outbound', 'n/a')))
+        self.store.add('2018-03', _rows(('falling.example', 'outbound', 0.9),
+                                        ('steady.example', 'outbound', 0.995),
+                                        ('new.example', 'outbound', 1)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_group_min(self):
+        minima = columnar.group_min(np.array([2, 0, 2, 2], dtype=np.int32),
+                                    np.array([0.5, 1, 0.25, 0.75], dtype=np.float32), 4)
+        self.assertEqual(minima[0], 1)
+        self.assertTrue(math.isnan(minima[1]))
+        self.assertEqual(minima[2], 0.25)
+        self.assertTrue(math.isnan(minima[3]))
+        self.assertTrue(np.isnan(columnar.group_min(np.array([], dtype=np.int32),
+                                                    np.array([], dtype=np.float32), 2)).all())
+
+    def test_shared_dictionary(self):
+        store = columnar.SnapshotStore(self.tmp)
+        self.assertEqual(store.labels(), ['2018-01', '2018-02', '2018-03'])
+        self.assertIn('2018-02', store)
+        self.assertEqual(store.suffixes, ['gmail.com', 'steady.example', 'falling.example',
+                                          'yahoo.com', 'new.example'])
+        ids, fractions = store.load('2018-02')
+        self.assertEqual(ids.dtype, np.int32)
+        self.assertEqual(fractions.dtype, np.float32)
+        self.assertEqual([store.suffixes[i] for i in ids],
+                         ['gmail.com', 'falling.example', 'steady.example'])
+
+    def test_trends(self):
+        trends = dict((trend.suffix, trend) for trend in self.store.trends())
+        self.assertEqual(sorted(trends), ['falling.example', 'gmail.com', 'new.example',
+                                          'steady.example', 'yahoo.com'])
+        falling = trends['falling.example']
+        self.assertEqual(falling.snapshots, 3)
+        self.assertAlmostEqual(falling.min_fraction, 0.9, places=6)
+        self.assertAlmostEqual(falling.last_fraction, 0.9, places=6)
+        self.assertAlmostEqual(falling.slope, -0.05, places=6)
+        self.assertEqual(trends['yahoo.com'].snapshots, 1)
+        self.assertEqual(trends['yahoo.com'].slope, 0)
+        self.assertAlmostEqual(trends['steady.example'].slope, 0, places=6)
+
+    def test_candidates(self):
+        self.assertEqual(self.store.candidates(), ['gmail.com', 'steady.example'])
+        self.assertEqual(self.store.candidates(min_snapshots=1),
+                         ['gmail.com', 'new.example', 'steady.example', 'yahoo.com'])
+        self.assertEqual(self.store.candidates(labels=['2018-01']),
+                         ['falling.example', 'gmail.com', 'steady.example', 'yahoo.com'])
+        self.assertEqual(self.store.candidates(threshold=0.996), ['gmail.com'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+""" Tests for maillog/correlate.py """
+import unittest
+
+from starttls_policy.maillog import correlate
+from starttls_policy.maillog import timestamps
+
+LOG = b'''Oct 10 19:12:10 sender postfix/qmgr[1700]: 62D3F481249: from=<root@sender.example>, \
+size=576, nrcpt=2 (queue active)
+Oct 10 19:12:11 sender postfix/smtp[1711]: Verified TLS connection established to \
+mx.example.com[192.0.2.1]:25: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Oct 10 19:12:12 sender postfix/smtp[1712]: connect to mx.b.example[192.0.2.2]:25: Connection refused
+Oct 10 19:12:13 sender postfix/smtp[1711]: 62D3F481249: to=<a@Example.com>, \
+relay=mx.example.com[192.0.2.1]:25, delay=0.07, dsn=2.0.0, status=sent (250 2.0.0 OK)
+Oct 10 19:12:13 sender postfix/smtp[1712]: 62D3F481249: to=<b@b.example>, \
+relay=mx.b.example[192.0.2.2]:25, delay=0.07, dsn=4.7.4, status=deferred (TLS is required, but \
+was not offered by host mx.b.example[192.0.2.2])
+Oct 10 19:12:14 sender postfix/smtpd[1800]: connect from client.example[192.0.2.9]
+Oct 10 20:12:14 sender postfix/smtp[1712]: Untrusted TLS connection established to \
+mx.b.example[192.0.2.2]:25: TLSv1.2
+Oct 10 20:12:15 sender postfix/smtp[1712]: 62D3F481249: to=<b@b.example>, \
+relay=mx.b.example[192.0.2.2]:25, delay=3600, dsn=2.0.0, status=sent (250 OK)
+Oct 10 20:12:15 sender postfix/qmgr[1700]: 62D3F481249: removed
+'''
+
+class TestCorrelator(unittest.TestCase):
+    """ Unittests for joining log lines into delivery outcomes. """
+
+    def _outcomes(self, correlator, data=LOG):
+        decoder = timestamps.TimestampDecoder()
+        return correlator.add_chunk(data, decoder) + correlator.flush()
+
+    def test_message(self):
+        outcomes = self._outcomes(correlate.Correlator())
+        self.assertEqual(len(outcomes), 1)
+        outcome = outcomes[0]
+        self.assertEqual(outcome.queue_id, '62D3F481249')
+        self.assertTrue(outcome.complete)
+        self.assertEqual(outcome.last - outcome.first, 3602)
+        self.assertEqual(
+            [(d.domain, d.mx_hostname, d.validation, d.status, d.tls_problem)
+             for d in outcome.deliveries],
+            [('example.com', 'mx.example.com', 'Verified', 'sent', False),
+             ('b.example', 'mx.b.example', None, 'deferred', True),
+             ('b.example', 'mx.b.example', 'Untrusted', 'sent', False)])
+
+    def test_domains(self):
+        domains = correlate.DomainOutcomes().add_all(self._outcomes(correlate.Correlator()))
+        self.assertEqual(domains.messages, 1)
+        self.assertEqual(domains.counts['example.com'], {('sent', 'Verified'): 1})
+        self.assertEqual(domains.counts['b.example'], {('deferred', None): 1,
+                                                       ('sent', 'Untrusted'): 1})
+        self.assertEqual(domains.tls_problems, {'b.example': 1})
+
+    def test_incomplete(self):
+        # Without the removal, the message is reported when the log ends.
+        lines = LOG.splitlines(True)[:-1]
+        outcomes = self._outcomes(correlate.Correlator(), b''.join(lines))
+        self.assertEqual([(o.queue_id, o.complete, len(o.deliveries)) for o in outcomes],
+                         [('62D3F481249', False, 3)])
+
+    def test_evicted_by_age(self):
+        correlator = correlate.Correlator(max_age=600)
+        outcomes = self._outcomes(correlator)
+        # An hour passes between attempts, so the first two are dropped.
+        self.assertEqual([(o.complete, len(o.deliveries)) for o in outcomes],
+                         [(False, 2), (True, 1)])
+        self.assertEqual(correlator.evicted, 1)
+
+    def test_evicted_by_size(self):
+        correlator = correlate.Correlator(max_messages=2)
+        status = (b'sender postfix/smtp[1]: Q{}: to=<a@example.com>, relay=none,'
+                  b' delay=1, dsn=4.4.1, status=deferred (connect timed out)')
+        finished = []
+        for i in range(100):
+            finished.extend(correlator.add(status.replace(b'{}', str(i).encode()), i))
+            self.assertLessEqual(len(correlator), 2)
+        self.assertEqual([o.queue_id for o in finished], ['Q{}'.format(i) for i in range(98)])
+        self.assertEqual(correlator.evicted, 98)
+
+    def test_connection_of_other_host(self):
+        # A status for another relay isn't given the pid's TLS connection.
+        lines = [b'Oct 10 19:12:11 sender postfix/smtp[5]: Trusted TLS connection'
+                 b' established to mx.example.com[192.0.2.1]:25: TLSv1.2',
+                 b'Oct 10 19:12:12 sender postfix/smtp[5]: Q1: to=<a@c.example>,'
+                 b' relay=mx.c.example[192.0.2.3]:25, delay=1, status=sent (250 OK)',
+                 b'Oct 10 19:12:13 sender postfix/qmgr[6]: Q1: removed']
+        outcomes = self._outcomes(correlate.Correlator(), b'\n'.join(lines) + b'\n')
+        self.assertEqual(outcomes[0].deliveries[0].validation, None)
+
+if __name__ == '__main__':
+    unittest.main()
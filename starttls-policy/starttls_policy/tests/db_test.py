@@ -0,0 +1,91 @@
+""" Tests for scan/db.py """
+import unittest
+
+from starttls_policy.scan import certs
+from starttls_policy.scan import certstore
+from starttls_policy.scan import db
+from starttls_policy.scan import resolver
+from starttls_policy.scan import versions
+
+def _obs(host, starttls=True):
+    return certstore.Observation(host, '192.0.2.1', starttls, 'TLSv1.2' if starttls else None,
+                                 'AES128-SHA' if starttls else None,
+                                 ['aa', 'bb'] if starttls else [],
+                                 [host] if starttls else [], None, 0)
+
+def _mx(*hosts):
+    return [resolver.MXRecord(10, host, ['192.0.2.1']) for host in hosts]
+
+class TestScanDB(unittest.TestCase):
+    """ Unittests for ScanDB. """
+
+    def setUp(self):
+        self.db = db.ScanDB(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_latest_scan(self):
+        self.assertIsNone(self.db.latest('example.com'))
+        self.db.record('example.com', [_obs('mx1.example.com')], now=100)
+        self.db.record('Example.com', [_obs('mx1.example.com'), _obs('mx2.example.com', False)],
+                       now=200)
+        latest = self.db.latest('example.com')
+        self.assertEqual([obs.host for obs in latest], ['mx1.example.com', 'mx2.example.com'])
+        self.assertEqual(latest[0].chain, ['aa', 'bb'])
+        self.assertEqual(latest[0].names, ['mx1.example.com'])
+        self.assertEqual(latest[0].time, 200)
+        self.assertFalse(latest[1].starttls)
+        self.assertEqual(latest[1].chain, [])
+
+    def test_domain_without_mx(self):
+        self.db.record('nomx.example', [], now=100)
+        self.assertEqual(self.db.latest('nomx.example'), [])
+        self.assertEqual(self.db.last_scans(['nomx.example']),
+                         {'nomx.example': (100, frozenset())})
+
+    def test_certificates(self):
+        info = certs.CertInfo('aa', ['mx.example.com'], 'sha256/AAAA', 1, 2)
+        self.db.record_certs([info])
+        self.db.record_certs([info._replace(names=[])])
+        self.assertEqual(self.db.cert_info('aa'), info)
+        self.assertIsNone(self.db.cert_info('bb'))
+
+    def test_versions(self):
+        self.assertIsNone(self.db.versions('mx.example.com'))
+        old = versions.VersionScan('mx.example.com', '192.0.2.1', {'TLSv1': 'AES128-SHA'}, {}, {},
+                                   {})
+        scan = versions.VersionScan('MX.example.com', '192.0.2.1',
+                                    {'TLSv1.2': 'AES128-SHA', 'TLSv1.3': 'TLS_AES_128_GCM_SHA256'},
+                                    {'TLSv1': 'refused'},
+                                    {'TLSv1.2': ['AES128-SHA', 'AES256-SHA']},
+                                    {'TLSv1.1': 'Connection failed: timed out'})
+        self.db.record_versions([old], now=100)
+        self.db.record_versions([scan], now=200)
+        self.assertEqual(self.db.versions('mx.example.com'),
+                         scan._replace(host='mx.example.com', errors={}))
+
+    def test_plan_rescans(self):
+        self.db.record('fresh.example', [_obs('mx.fresh.example')], now=1000)
+        self.db.record('stale.example', [_obs('mx.stale.example')], now=100)
+        self.db.record('moved.example', [_obs('mx.old.example')], now=1000)
+        resolved = [('fresh.example', _mx('mx.fresh.example')),
+                    ('stale.example', _mx('mx.stale.example')),
+                    ('moved.example', _mx('mx.new.example')),
+                    ('new.example', _mx('mx.new.example'))]
+        fresh = []
+        planned = db.plan_rescans(self.db, resolved, max_age=500, now=1100,
+                                  on_fresh=fresh.append)
+        self.assertEqual([domain for domain, _ in planned],
+                         ['stale.example', 'moved.example', 'new.example'])
+        self.assertEqual(fresh, ['fresh.example'])
+
+    def test_last_scans_batches(self):
+        for i in range(1200):
+            self.db.record('d{}.example'.format(i), [], now=i)
+        last = self.db.last_scans('d{}.example'.format(i) for i in range(0, 1300, 2))
+        self.assertEqual(len(last), 600)
+        self.assertEqual(last['d1198.example'][0], 1198)
+
+if __name__ == '__main__':
+    unittest.main()
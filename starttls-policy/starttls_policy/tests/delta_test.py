@@ -0,0 +1,59 @@
+""" Tests for report/delta.py """
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from starttls_policy import policy
+from starttls_policy.report import delta
+
+def _config(*domains):
+    conf = policy.Config()
+    conf.load_from_dict({
+        'timestamp': datetime.datetime(2018, 6, 1),
+        'expires': datetime.datetime(2018, 7, 1),
+        'policies': dict((domain, {'mxs': ['.' + domain]}) for domain in domains),
+        })
+    return conf
+
+class TestCandidateIndex(unittest.TestCase):
+    """ Unittests for candidate deltas. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'candidates.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_read_domain_list(self):
+        f = io.StringIO(u'# vetted\nGmail.com\n\n yahoo.com \n')
+        self.assertEqual(delta.read_domain_list(f), set(['gmail.com', 'yahoo.com']))
+
+    def test_first_run(self):
+        index = delta.CandidateIndex.load(self.filename)
+        result = index.update(['a.example', 'b.example', 'gmail.com'], _config('gmail.com'),
+                              golden=set(['gmail.com', 'golden.example']))
+        self.assertEqual(result, delta.Delta(['a.example', 'b.example'], ['gmail.com'], [], [],
+                                             ['golden.example']))
+
+    def test_later_run(self):
+        delta.CandidateIndex(['a.example', 'b.example', 'gone.example',
+                              'lapsed.example']).save(self.filename)
+        index = delta.CandidateIndex.load(self.filename)
+        self.assertEqual(index.candidates, set(['a.example', 'b.example', 'gone.example',
+                                                'lapsed.example']))
+        result = index.update(['A.example', 'b.example', 'c.example', 'd.example'],
+                              _config('d.example', 'gone.example'),
+                              golden=set(['gone.example', 'b.example']))
+        self.assertEqual(result, delta.Delta(['c.example'], ['d.example'], ['lapsed.example'],
+                                             ['gone.example'], []))
+        index.save(self.filename)
+        again = delta.CandidateIndex.load(self.filename).update(
+            ['a.example', 'b.example', 'c.example', 'd.example'], _config())
+        self.assertEqual(again, delta.Delta([], [], [], [], []))
+
+if __name__ == '__main__':
+    unittest.main()
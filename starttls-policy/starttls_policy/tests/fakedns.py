@@ -0,0 +1,67 @@
+""" Local stub DNS responder for tests. """
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+from six.moves import socketserver
+
+SOA_TEXT = 'ns.test. hostmaster.test. 1 3600 600 86400 {}'
+
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        """ Answers a query from the server's records. """
+        data, sock = self.request
+        server = self.server
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text().rstrip('.').lower()
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        with server.lock:
+            server.queries.append((name, rdtype))
+        records = server.records.get(name)
+        if records is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif rdtype in records:
+            response.answer.append(dns.rrset.from_text_list(
+                question.name, server.ttl, dns.rdataclass.IN, rdtype, records[rdtype]))
+        if not response.answer:
+            response.authority.append(dns.rrset.from_text(
+                'test.', server.ttl, dns.rdataclass.IN, 'SOA',
+                SOA_TEXT.format(server.negative_ttl)))
+        sock.sendto(response.to_wire(), self.client_address)
+
+
+class FakeDNSServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    """ UDP DNS server on loopback answering from a static table.
+    Names missing from the table get NXDOMAIN, and names without the
+    queried type get an empty answer; both carry an SOA for negative
+    caching. Every query received is appended to `queries`.
+    """
+    daemon_threads = True
+
+    def __init__(self, records, ttl=300, negative_ttl=60):
+        """ :param records dict: Maps lower-case names to dicts of
+            {rdtype: [rdata text, ...]}, e.g.
+            {'example.com': {'MX': ['10 mx.example.com.']}} """
+        socketserver.UDPServer.__init__(self, ('127.0.0.1', 0), _DNSHandler)
+        self.port = self.server_address[1]
+        self.records = records
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.queries = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
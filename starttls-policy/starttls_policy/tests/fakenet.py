@@ -0,0 +1,104 @@
+""" A fake mail network on loopback, for exercising the scanner offline.
+
+`FakeMailNetwork` runs a number of fake SMTP servers, each on its own
+loopback address and all on the same port, with certificates issued by a
+private CA. A stub DNS server gives each synthetic mail domain an MX
+record pointing at one of them.
+"""
+import os
+import shutil
+import tempfile
+
+from starttls_policy.tests import fakedns
+from starttls_policy.tests import fakesmtp
+
+DOMAIN_SUFFIX = 'bench.test'
+
+
+def loopback_address(index):
+    """ The `index`th address in 127.0.0.0/8 after 127.0.0.1, skipping
+    addresses ending in .0 and .255. """
+    high, low = divmod(index + 1, 254)
+    return '127.{}.{}.{}'.format(high // 256, high % 256, low + 1)
+
+
+class FakeMailNetwork(object):
+    """ Fake SMTP servers and DNS for synthetic mail domains. Use as a
+    context manager. While running:
+
+    `domains` lists the mail domains, `mx_hosts` the MX hostnames,
+    `nameserver` and `dns_port` locate the DNS server, `smtp_port` is the
+    port every SMTP server listens on, and `ca_file` is a PEM file
+    holding the CA that issued the servers' certificates.
+    """
+
+    def __init__(self, servers=10, domains=100, providers=5, server_options=None):
+        """ :param servers int: number of SMTP servers, one per MX host.
+        :param domains int: number of mail domains. Domain i uses MX host
+            i modulo `servers`.
+        :param providers int: MX hosts are spread over this many parent
+            domains, as if run by different providers.
+        :param server_options: function from server index to a dict of
+            keyword arguments for `fakesmtp.FakeSMTPServer`, e.g. to set
+            `versions`, `latency` or `failure`. """
+        self.mx_hosts = ['mx{}.provider{}.{}'.format(i, i % providers, DOMAIN_SUFFIX)
+                         for i in range(servers)]
+        self.domains = ['d{}.{}'.format(i, DOMAIN_SUFFIX) for i in range(domains)]
+        self._server_options = server_options or (lambda index: {})
+        self._tmpdir = None
+        self._servers = []
+        self._dns = None
+        self.smtp_port = None
+        self.nameserver = '127.0.0.1'
+        self.dns_port = None
+        self.ca_file = None
+
+    def _records(self):
+        records = {}
+        for index, host in enumerate(self.mx_hosts):
+            records[host] = {'A': [loopback_address(index)]}
+        for index, domain in enumerate(self.domains):
+            mx_host = self.mx_hosts[index % len(self.mx_hosts)]
+            records[domain] = {'MX': ['10 {}.'.format(mx_host)]}
+        return records
+
+    def __enter__(self):
+        self._tmpdir = tempfile.mkdtemp()
+        try:
+            ca = fakesmtp.make_cert(u'Fake Mail Network CA', is_ca=True)
+            self.ca_file = os.path.join(self._tmpdir, 'ca.pem')
+            with open(self.ca_file, 'wb') as f:
+                f.write(fakesmtp.pem(ca[0]))
+            port = 0
+            for index, host in enumerate(self.mx_hosts):
+                leaf, key = fakesmtp.make_cert(host, sans=[host], issuer=ca)
+                options = dict(chain=[leaf, ca[0]], key=key)
+                options.update(self._server_options(index))
+                server = fakesmtp.FakeSMTPServer(address=loopback_address(index),
+                                                 port=port, **options)
+                port = server.port
+                self._servers.append(server)
+                server.__enter__()
+            self.smtp_port = port
+            self._dns = fakedns.FakeDNSServer(self._records())
+            self._dns.__enter__()
+            self.dns_port = self._dns.port
+        except Exception:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *args):
+        for server in self._servers:
+            server.__exit__()
+        self._servers = []
+        if self._dns is not None:
+            self._dns.__exit__()
+            self._dns = None
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def write_domains(self, filename):
+        """ Writes the mail domains to a file, one per line. """
+        with open(filename, 'w') as f:
+            for domain in self.domains:
+                f.write(domain + '\n')
@@ -0,0 +1,63 @@
+""" Tests for the fake mail network, and an offline run of CheckSTARTTLS.py. """
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from starttls_policy.scan import probe
+from starttls_policy.scan import resolver
+from starttls_policy.tests import fakenet
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CHECK_STARTTLS = os.path.join(os.path.dirname(PACKAGE_ROOT), 'tools', 'CheckSTARTTLS.py')
+
+def _options(index):
+    return [{}, {'starttls': False}, {'failure': 'tempfail'},
+            {'versions': ('TLSv1.2', 'TLSv1.2'), 'latency': 0.05}][index]
+
+class TestFakeMailNetwork(unittest.TestCase):
+    """ Probes and resolution against a FakeMailNetwork. """
+
+    def test_network(self):
+        with fakenet.FakeMailNetwork(servers=4, domains=8, server_options=_options) as net:
+            dns = resolver.Resolver(nameservers=[net.nameserver], port=net.dns_port)
+            records = dict((domain, mx) for domain, mx, _ in dns.resolve_many(net.domains))
+            self.assertEqual(records['d5.bench.test'][0].host, 'mx1.provider1.bench.test')
+            results = [probe.probe(mx.host, mx.addresses[0], port=net.smtp_port, timeout=5)
+                       for mx in (records[d][0] for d in net.domains[:4])]
+        self.assertEqual([r.starttls for r in results], [True, False, False, True])
+        self.assertEqual(results[0].address, '127.0.0.2')
+        self.assertEqual(results[1].error, 'STARTTLS not offered')
+        self.assertTrue(results[2].error.startswith('Unexpected greeting: 421'))
+        self.assertEqual(results[3].protocol, 'TLSv1.2')
+
+    @unittest.skipUnless(os.path.exists(CHECK_STARTTLS), 'needs the tools directory')
+    def test_check_starttls_offline(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        psl = os.path.join(tmp, 'psl.dat')
+        with open(psl, 'w') as f:
+            f.write('test\n')
+        with fakenet.FakeMailNetwork(servers=4, domains=8, server_options=_options) as net:
+            net.write_domains(os.path.join(tmp, 'domains.txt'))
+            env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+            subprocess.check_output([
+                sys.executable, CHECK_STARTTLS, 'domains.txt', '--ca-file', net.ca_file,
+                '--nameserver', net.nameserver, '--dns-port', str(net.dns_port),
+                '--smtp-port', str(net.smtp_port), '--public-suffix-list', psl,
+                '--versions'], cwd=tmp, env=env, stderr=subprocess.STDOUT)
+        with open(os.path.join(tmp, 'policy.json')) as f:
+            policies = json.load(f)['policies']
+        self.assertEqual(sorted(policies), ['d0.bench.test', 'd3.bench.test',
+                                            'd4.bench.test', 'd7.bench.test'])
+        self.assertEqual(policies['d3.bench.test'], {
+            'mxs': ['mx3.provider3.bench.test'], 'min-tls-version': 'TLSv1.2',
+            'mode': 'testing'})
+        # d0's host supports TLSv1.3, but the floor stops at TLSv1.2.
+        self.assertEqual(policies['d0.bench.test']['min-tls-version'], 'TLSv1.2')
+
+if __name__ == '__main__':
+    unittest.main()
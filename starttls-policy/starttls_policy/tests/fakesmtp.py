@@ -0,0 +1,185 @@
+""" Local fake SMTP server and certificate helpers for tests. """
+import datetime
+import os
+import random
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import time
+import warnings
+
+from six.moves import socketserver
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import ExtendedKeyUsageOID
+from cryptography.x509.oid import NameOID
+
+
+def make_cert(common_name, sans=None, issuer=None, is_ca=False, days=30, server_auth=True):
+    """ Generates a certificate and key.
+    :param issuer: (cert, key) tuple to sign with. Self-signed if None.
+    :param server_auth: If False, the leaf is restricted to client auth.
+    :returns: (cert, key) tuple of cryptography objects. """
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    issuer_cert, issuer_key = issuer if issuer else (None, key)
+    now = datetime.datetime.utcnow()
+    builder = (x509.CertificateBuilder()
+               .subject_name(name)
+               .issuer_name(issuer_cert.subject if issuer_cert else name)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - datetime.timedelta(days=1))
+               .not_valid_after(now + datetime.timedelta(days=days))
+               .add_extension(x509.BasicConstraints(ca=is_ca, path_length=None),
+                              critical=True))
+    if is_ca:
+        builder = builder.add_extension(
+            x509.KeyUsage(False, False, False, False, False, True, True, False, False),
+            critical=True)
+    else:
+        builder = builder.add_extension(
+            x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH if server_auth
+                                   else ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False)
+    if sans:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName(san) for san in sans]),
+            critical=False)
+    cert = builder.sign(issuer_key, hashes.SHA256(), default_backend())
+    return cert, key
+
+def der(cert):
+    """ DER encoding of a cryptography certificate. """
+    return cert.public_bytes(serialization.Encoding.DER)
+
+def pem(cert):
+    """ PEM encoding of a cryptography certificate. """
+    return cert.public_bytes(serialization.Encoding.PEM)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def __init__(self, request, client_address, server):
+        # The base class sets these up and then handles the connection;
+        # after STARTTLS they're replaced by the TLS socket and its files.
+        self.request = request
+        self.rfile = self.wfile = None
+        socketserver.StreamRequestHandler.__init__(self, request, client_address, server)
+
+    def handle(self):
+        """ Runs the SMTP dialog, tolerating clients that hang up. """
+        try:
+            self._converse()
+        except (socket.error, ssl.SSLError):
+            pass # clients commonly hang up without waiting for replies
+
+    def _converse(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        failure = server.failure if random.random() < server.failure_rate else None
+        if failure == 'drop':
+            return
+        if failure == 'tempfail':
+            self.wfile.write(b'421 fake.example.com Service not available\r\n')
+            return
+        self.wfile.write(b'220 fake.example.com ESMTP\r\n')
+        tls = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.strip().split(b' ')[0].upper()
+            if verb in (b'EHLO', b'HELO'):
+                if server.starttls and not tls:
+                    self.wfile.write(b'250-fake.example.com\r\n250-PIPELINING\r\n250 STARTTLS\r\n')
+                else:
+                    self.wfile.write(b'250-fake.example.com\r\n250 PIPELINING\r\n')
+            elif verb == b'STARTTLS' and server.starttls and not tls:
+                self.wfile.write(b'220 Ready to start TLS\r\n')
+                self.wfile.flush()
+                if failure == 'tls':
+                    self.wfile.write(b'not a TLS record\r\n')
+                    return
+                self.request = server.context.wrap_socket(self.request, server_side=True)
+                self.rfile = self.request.makefile('rb')
+                self.wfile = self.request.makefile('wb', 0)
+                tls = True
+            elif verb == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            else:
+                self.wfile.write(b'502 Command not implemented\r\n')
+
+
+class FakeSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ SMTP server on loopback that speaks just enough of the protocol
+    to negotiate STARTTLS. Use as a context manager; `port` is set once
+    it is listening. """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, chain=None, key=None, starttls=True, versions=None, ciphers=None,
+                 address='127.0.0.1', port=0, latency=0, failure=None, failure_rate=1.0):
+        """ :param chain: list of cryptography certificates, leaf first.
+        :param key: private key for the leaf.
+        :param versions: (lowest, highest) TLS version to accept, e.g.
+            ('TLSv1', 'TLSv1.1').
+        :param ciphers: OpenSSL cipher list for TLSv1.2 and earlier, in the
+            server's order of preference.
+        :param address: loopback address to listen on. Linux accepts any
+            address in 127.0.0.0/8, so many servers can share a port.
+        :param latency: seconds to wait before greeting each client.
+        :param failure: what goes wrong for a `failure_rate` fraction of
+            connections: 'drop' closes the connection without a greeting,
+            'tempfail' greets with 421, and 'tls' answers STARTTLS with
+            garbage instead of a handshake. """
+        socketserver.TCPServer.__init__(self, (address, port), _SMTPHandler)
+        self.port = self.server_address[1]
+        self.starttls = starttls
+        self.latency = latency
+        self.failure = failure
+        self.failure_rate = failure_rate
+        self.context = None
+        self._tmpdir = tempfile.mkdtemp()
+        if starttls:
+            if chain is None:
+                leaf, key = make_cert(u'localhost', sans=[u'localhost'])
+                chain = [leaf]
+            certfile = os.path.join(self._tmpdir, 'chain.pem')
+            keyfile = os.path.join(self._tmpdir, 'key.pem')
+            with open(certfile, 'wb') as f:
+                f.write(b''.join(pem(cert) for cert in chain))
+            with open(keyfile, 'wb') as f:
+                f.write(key.private_bytes(serialization.Encoding.PEM,
+                                          serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(certfile, keyfile)
+            if versions is not None:
+                lowest, highest = (getattr(ssl.TLSVersion, v.replace('.', '_'))
+                                   for v in versions)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', DeprecationWarning)
+                    self.context.minimum_version = lowest
+                    self.context.maximum_version = highest
+            # Let old protocol versions through OpenSSL 3's security level.
+            self.context.set_ciphers((ciphers or 'ALL') + ':@SECLEVEL=0')
+            self.context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
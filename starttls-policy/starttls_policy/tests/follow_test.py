@@ -0,0 +1,132 @@
+""" Tests for maillog/follow.py """
+import os
+import shutil
+import tempfile
+import unittest
+
+from starttls_policy.maillog import follow
+
+class _Done(Exception):
+    pass
+
+class TestLogFollower(unittest.TestCase):
+    """ Unittests for checkpointed log following. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmp, 'mail.log')
+        self.checkpoint = os.path.join(self.tmp, 'position.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, data, mode='ab', filename=None):
+        with open(filename or self.log, mode) as f:
+            f.write(data)
+
+    def _run(self, chunk_size=1024):
+        """ Reads what's new, as a fresh run would, and saves the position. """
+        follower = follow.LogFollower(self.log, self.checkpoint, chunk_size=chunk_size)
+        data = b''.join(follower.chunks())
+        follower.save()
+        follower.close()
+        return data
+
+    def test_reads_only_new_lines(self):
+        self._write(b'one\ntwo\n')
+        self.assertEqual(self._run(), b'one\ntwo\n')
+        self.assertEqual(self._run(), b'')
+        self._write(b'three\n')
+        self.assertEqual(self._run(), b'three\n')
+
+    def test_partial_line_left_for_later(self):
+        self._write(b'one\ntw')
+        self.assertEqual(self._run(), b'one\n')
+        self._write(b'o\n')
+        self.assertEqual(self._run(), b'two\n')
+
+    def test_small_chunks(self):
+        self._write(b'a long line\nb\nanother long line\n')
+        follower = follow.LogFollower(self.log, chunk_size=4)
+        chunks = list(follower.chunks())
+        self.assertEqual(b''.join(chunks), b'a long line\nb\nanother long line\n')
+        self.assertTrue(all(chunk.endswith(b'\n') for chunk in chunks))
+        self.assertEqual(follower.position.offset, 32)
+        follower.close()
+
+    def test_position_saved(self):
+        self._write(b'one\ntwo\n')
+        self._run()
+        position = follow.load_position(self.checkpoint)
+        stat = os.stat(self.log)
+        self.assertEqual((position.device, position.inode), (stat.st_dev, stat.st_ino))
+        self.assertEqual(position.offset, 8)
+        self.assertEqual(position.line_length, 4)
+
+    def test_no_checkpoint(self):
+        self.assertIsNone(follow.load_position(self.checkpoint))
+        self._write(b'one\n')
+        follower = follow.LogFollower(self.log)
+        self.assertEqual(b''.join(follower.chunks()), b'one\n')
+        follower.save()
+        follower.close()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_truncated(self):
+        self._write(b'one\ntwo\n')
+        self._run()
+        self._write(b'new\n', mode='wb')
+        self.assertEqual(self._run(), b'new\n')
+
+    def test_rewritten(self):
+        # Same file and length, different last line: start over.
+        self._write(b'one\ntwo\n')
+        self._run()
+        self._write(b'one\nTWO\nthree\n', mode='r+b')
+        self.assertEqual(self._run(), b'one\nTWO\nthree\n')
+
+    def test_rotated(self):
+        self._write(b'one\ntwo\n')
+        self._run()
+        self._write(b'three\n')
+        os.rename(self.log, self.log + '.1')
+        self._write(b'four\n')
+        self.assertEqual(self._run(), b'three\nfour\n')
+        self._write(b'five\n')
+        self.assertEqual(self._run(), b'five\n')
+
+    def test_rotated_away(self):
+        # The rotated file is gone too: read the new log from the start.
+        self._write(b'one\n')
+        self._run()
+        os.remove(self.log)
+        self._write(b'two\n')
+        self.assertEqual(self._run(), b'two\n')
+
+    def test_follow(self):
+        self._write(b'one\n')
+        follower = follow.LogFollower(self.log, self.checkpoint)
+        steps = [
+            lambda: self._write(b'two\n'),
+            lambda: os.rename(self.log, self.log + '.1'),
+            lambda: self._write(b'three\n'),
+            lambda: self._write(b'x\n', mode='wb'),
+        ]
+
+        def sleep(interval):
+            self.assertEqual(interval, 0.5)
+            if not steps:
+                raise _Done()
+            steps.pop(0)()
+
+        chunks = []
+        try:
+            for chunk in follower.follow(0.5, sleep=sleep):
+                chunks.append(chunk)
+        except _Done:
+            pass
+        follower.close()
+        self.assertEqual(chunks, [b'one\n', b'two\n', b'three\n', b'x\n'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+""" Tests for report/ingest.py """
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from starttls_policy.report import aggregate
+from starttls_policy.report import ingest
+
+REPORT = u'''Address Suffix,Hostname Suffix,Direction,UN M.49 Region Code,Region Name,\
+Fraction Encrypted
+example.com,mx.example.com,outbound,001,World,0.995
+"quoted
+example.com",mx.example.com,outbound,150,"Europe, ""and""
+more",1
+example.com,mx.example.com,outbound,150,Europe,0.999
+lossy.example,mx.lossy.example,outbound,001,World,0.5
+"multi
+line
+suffix","mx",outbound,019,"""Americas""",1
+yahoo.{...},yahoodns.net,outbound,001,World,1
+broken.example,outbound,001
+'''
+
+class TestIngest(unittest.TestCase):
+    """ Unittests for parallel report ingest. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'report.csv')
+        with io.open(self.filename, 'w', encoding='utf-8', newline='') as f:
+            f.write(REPORT)
+        self.expected = aggregate.aggregate([self.filename])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _check(self, result):
+        self.assertEqual(list(result.results()), list(self.expected.results()))
+        self.assertEqual((result.rows, result.skipped), (self.expected.rows, self.expected.skipped))
+
+    def test_boundaries_skip_quoted_newlines(self):
+        data = REPORT.encode('utf-8')
+        record_ends = set(i + 1 for i in range(len(data)) if data[i:i + 1] == b'\n'
+                          and data[:i].count(b'"') % 2 == 0)
+        with open(self.filename, 'rb') as f:
+            boundaries = ingest.record_boundaries(f, range(0, len(data), 5))
+        self.assertEqual(set(boundaries), record_ends)
+
+    def test_boundaries_across_blocks(self):
+        with mock.patch('starttls_policy.report.ingest._BLOCK_SIZE', 3):
+            ranges = ingest.split(self.filename, chunk_size=11)
+        self.assertEqual(ranges, ingest.split(self.filename, chunk_size=11))
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(REPORT.encode('utf-8')))
+
+    def test_split_ranges_cover_the_file(self):
+        ranges = ingest.split(self.filename, chunk_size=7)
+        self.assertGreater(len(ranges), 5)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+        partials = [ingest.aggregate_range((self.filename, start, end, 'outbound'))
+                    for start, end in ranges]
+        self.assertEqual(sum(partial.rows for partial in partials), self.expected.rows)
+
+    def test_ingest_in_process(self):
+        self._check(ingest.ingest([self.filename], workers=1, chunk_size=7))
+
+    def test_ingest_with_pool(self):
+        self._check(ingest.ingest([self.filename], workers=2, chunk_size=30))
+        # Two copies of the file double the counts but not the minima.
+        twice = ingest.ingest([self.filename] * 2, workers=2, chunk_size=30)
+        self.assertEqual(twice.rows, 2 * self.expected.rows)
+        self.assertEqual([stats.min_fraction for stats in twice.results()],
+                         [stats.min_fraction for stats in self.expected.results()])
+
+if __name__ == '__main__':
+    unittest.main()
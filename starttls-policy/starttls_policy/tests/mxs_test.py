@@ -0,0 +1,50 @@
+""" Tests for mxs.py """
+import unittest
+
+import mock
+
+from starttls_policy import mxs
+from starttls_policy.scan import suffix
+
+class TestMXIndex(unittest.TestCase):
+    """ Unittests for attributing MX hostnames to mail domains. """
+
+    def setUp(self):
+        self.index = mxs.MXIndex([
+            ('yahoo.com', ['.yahoodns.net']),
+            ('example.com', ['mail.example.com', '.example.net']),
+            ('example.org', ['.example.net']),
+            ('eff.org', ['.eff.org']),
+            ])
+
+    def test_exact(self):
+        self.assertEqual(self.index.domains('mail.example.com'), ('example.com',))
+        self.assertEqual(self.index.domains('other.example.com'), ())
+        self.assertEqual(self.index.domains('sub.mail.example.com'), ())
+
+    def test_suffix(self):
+        self.assertEqual(self.index.domains('mta7.am0.yahoodns.net'), ('yahoo.com',))
+        self.assertEqual(self.index.domains('mx.eff.org'), ('eff.org',))
+        # A suffix only matches names below it.
+        self.assertEqual(self.index.domains('eff.org'), ())
+        self.assertEqual(self.index.domains('yahoodns.net.evil.example'), ())
+
+    def test_shared(self):
+        self.assertEqual(self.index.domains('mx.example.net'), ('example.com', 'example.org'))
+
+    def test_empty_label(self):
+        self.assertEqual(self.index.domains('mx..eff.org'), ('eff.org',))
+        self.assertEqual(self.index.domains('x..mail.example.com'), ())
+
+    def test_normalized(self):
+        self.assertEqual(self.index.domains('MX.Eff.Org.'), ('eff.org',))
+
+    def test_memoized(self):
+        with mock.patch.object(suffix, 'labels', wraps=suffix.labels) as labels:
+            self.assertEqual(self.index.domains('mx.eff.org'), ('eff.org',))
+            self.assertEqual(self.index.domains('MX.eff.org.'), ('eff.org',))
+            self.assertEqual(self.index.domains('other.eff.org'), ('eff.org',))
+        self.assertEqual(labels.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+""" Tests for maillog/parse.py """
+import io
+import unittest
+
+from starttls_policy.maillog import parse
+
+LOG = b'''Jun  6 00:21:31 precise32 postfix/smtpd[3648]: connect from localhost[127.0.0.1]
+Jun  6 00:21:34 precise32 postfix/smtpd[3648]: lost connection after STARTTLS from \
+localhost[127.0.0.1]
+Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established to \
+MX.Example.com[192.168.33.7]:25: TLSv1.1 with cipher AECDH-AES256-SHA (256/256 bits)
+Jun 12 06:24:15 sender postfix/smtpd[9046]: Anonymous TLS connection established from \
+client.example[192.0.2.9]: TLSv1.2 with cipher ECDHE-RSA-AES256-GCM-SHA384 (256/256 bits)
+Jun 12 06:24:16 sender postfix/smtp[9047]: warning: TLS library problem: error:140740BF
+Oct 10 19:12:13 sender postfix/smtp[1711]: 62D3F481249: to=<vagrant@valid-example-recipient.com>, \
+relay=valid-example-recipient.com[192.168.33.7]:25, delay=0.07, delays=0.03/0.01/0.03/0, \
+dsn=4.7.4, status=deferred (TLS is required, but was not offered by host \
+valid-example-recipient.com[192.168.33.7])
+Oct 10 19:12:14 sender postfix/smtp[1712]: 62D3F481250: to=<a@b.example>, \
+relay=mx.b.example[192.0.2.1]:25, delay=0.07, dsn=4.4.1, status=deferred (connection timed out)
+Oct 10 19:12:15 sender postfix/smtp[1713]: Verified TLS connection established to \
+mx2.example.com[192.0.2.2]:25: TLSv1.3'''
+
+def _summary(matches):
+    return [(match.kind, match.mx_hostname, match.validation) for match in matches]
+
+class TestParse(unittest.TestCase):
+    """ Unittests for the Postfix log parser. """
+
+    expected = [(parse.CONNECTED, 'mx.example.com', 'Untrusted'),
+                (parse.DEFERRED, 'valid-example-recipient.com', None),
+                (parse.CONNECTED, 'mx2.example.com', 'Verified')]
+
+    def test_match_line(self):
+        lines = LOG.split(b'\n')
+        self.assertIsNone(parse.match_line(lines[0]))
+        match = parse.match_line(lines[2])
+        self.assertEqual(match.line, lines[2])
+        self.assertEqual(match.mx_hostname, 'mx.example.com')
+        self.assertIsNone(parse.match_line(lines[3]))
+
+    def test_match_chunk(self):
+        self.assertEqual(_summary(parse.match_chunk(LOG)), self.expected)
+        end = LOG.index(b'Oct 10')
+        self.assertEqual(_summary(parse.match_chunk(LOG, end=end)), self.expected[:1])
+        self.assertEqual(_summary(parse.match_chunk(LOG, start=end)), self.expected[1:])
+
+    def test_read_chunks(self):
+        for size in (1, 7, 100, 10000):
+            chunks = list(parse.read_chunks(io.BytesIO(LOG), chunk_size=size))
+            self.assertEqual(b''.join(chunks), LOG)
+            self.assertTrue(all(chunk.endswith(b'\n') for chunk in chunks[:-1]))
+
+    def test_matches(self):
+        for size in (5, 100, 10000):
+            self.assertEqual(_summary(parse.matches(io.BytesIO(LOG), chunk_size=size)),
+                             self.expected)
+
+    def test_match_chunks(self):
+        lines = LOG.splitlines(True)
+        chunks = [b''.join(lines[:3]), b''.join(lines[3:6]), b''.join(lines[6:])]
+        self.assertEqual(_summary(parse.match_chunks(chunks)), self.expected)
+
+if __name__ == '__main__':
+    unittest.main()
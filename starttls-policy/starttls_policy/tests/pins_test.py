@@ -0,0 +1,90 @@
+""" Tests for pins.py """
+import base64
+import hashlib
+import unittest
+
+import mock
+
+from starttls_policy import pins
+from starttls_policy import policy
+from starttls_policy import util
+from starttls_policy.scan import certs
+from starttls_policy.tests import fakesmtp
+
+def _pin(algorithm, der):
+    digest = hashlib.new(algorithm, certs.spki(der)).digest()
+    return '{}/{}'.format(algorithm, base64.b64encode(digest).decode('ascii'))
+
+class TestPins(unittest.TestCase):
+    """ Unittests for pin parsing and SPKI digests. """
+
+    def setUp(self):
+        ca = fakesmtp.make_cert(u'Test CA', is_ca=True)
+        self.ca = fakesmtp.der(ca[0])
+        self.leaf = fakesmtp.der(fakesmtp.make_cert(u'mx.example.com', issuer=ca)[0])
+
+    def test_spki_digests(self):
+        for der in (self.ca, self.leaf):
+            self.assertIn(pins.parse_pin(certs.spki_sha256(der)), pins.spki_digests(der))
+            self.assertIn(pins.parse_pin(_pin('sha1', der)), pins.spki_digests(der))
+
+    def test_parse_pin(self):
+        self.assertEqual(pins.parse_pin('sha1/5R0zeLx7EWRxqw6HRlgCRxNLHDo='),
+                         ('sha1', base64.b64decode('5R0zeLx7EWRxqw6HRlgCRxNLHDo=')))
+        for pin in ('md5/5R0zeLx7EWRxqw6HRlgCRxNLHDo=', 'sha256/5R0zeLx7EWRxqw6HRlgCRxNLHDo=',
+                    'sha1/not base64!', 'sha1'):
+            with self.assertRaises(util.ConfigError):
+                pins.parse_pin(pin)
+
+    def test_malformed_certificate(self):
+        with self.assertRaises(ValueError):
+            pins.spki_digests(self.leaf[:100])
+        with self.assertRaises(ValueError):
+            pins.spki_digests(b'')
+
+    def test_without_cryptography(self):
+        with mock.patch.object(pins, 'certs', None):
+            index = pins.PinIndex({'leaf': {'static-spki-hashes': [_pin('sha1', self.leaf)]}})
+            self.assertIn('leaf', index)
+            with self.assertRaises(ValueError):
+                index.check('leaf', [self.leaf])
+
+    def test_check(self):
+        index = pins.PinIndex({
+            'leaf': {'static-spki-hashes': [_pin('sha1', self.leaf)]},
+            'ca': {'static-spki-hashes': [_pin('sha256', self.ca)]},
+            'empty': {},
+            })
+        self.assertIn('ca', index)
+        self.assertTrue(index.check('leaf', [self.leaf, self.ca]))
+        self.assertTrue(index.check('ca', [self.leaf, self.ca]))
+        self.assertFalse(index.check('ca', [self.leaf]))
+        self.assertFalse(index.check('empty', [self.leaf, self.ca]))
+        with self.assertRaises(KeyError):
+            index.check('missing', [self.leaf])
+
+    def test_digests_memoized(self):
+        index = pins.PinIndex({})
+        expected = pins.spki_digests(self.leaf)
+        with mock.patch.object(pins, 'spki_digests', wraps=pins.spki_digests) as digests:
+            for _ in range(3):
+                self.assertEqual(index.digests(self.leaf), expected)
+        digests.assert_called_once_with(self.leaf)
+
+    def test_config_check_pin(self):
+        conf = policy.Config()
+        conf.pinsets = {'eff': {'static-spki-hashes': [_pin('sha256', self.ca)]}}
+        conf.policy_aliases = {'pinned': {'pin': 'eff'}}
+        conf.policies = {'eff.org': {'pin': 'eff'},
+                         'alias.example': {'policy-alias': 'pinned'},
+                         'unpinned.example': {}}
+        self.assertTrue(conf.check_pin('eff.org', [self.leaf, self.ca]))
+        self.assertFalse(conf.check_pin('eff.org', [self.leaf]))
+        self.assertTrue(conf.check_pin('alias.example', [self.leaf, self.ca]))
+        self.assertIsNone(conf.check_pin('unpinned.example', [self.leaf]))
+        self.assertIsNone(conf.check_pin('unknown.example', [self.leaf]))
+        conf.pinsets = {'eff': {'static-spki-hashes': [_pin('sha256', self.leaf)]}}
+        self.assertTrue(conf.check_pin('eff.org', [self.leaf]))
+
+if __name__ == '__main__':
+    unittest.main()
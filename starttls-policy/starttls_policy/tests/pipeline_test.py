@@ -0,0 +1,124 @@
+""" Tests for scan/pipeline.py """
+import threading
+import unittest
+
+from starttls_policy.scan import certs
+from starttls_policy.scan import pipeline
+from starttls_policy.scan import probe
+from starttls_policy.scan import resolver
+from starttls_policy.scan import versions
+from starttls_policy.tests import fakesmtp
+
+class TestPipeline(unittest.TestCase):
+    """ Unittests for the scan pipeline, with a fake network stage. """
+
+    @classmethod
+    def setUpClass(cls):
+        ca = fakesmtp.make_cert(u'Test CA', is_ca=True)
+        cls.ca = fakesmtp.der(ca[0])
+        cls.leaves = dict(
+            (host, fakesmtp.der(fakesmtp.make_cert(host, sans=[host], issuer=ca)[0]))
+            for host in (u'mx.shared.example', u'mx.a.example', u'mx.b.example'))
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.probed = []
+
+    def fake_probe(self, host, address):
+        """ Probe that succeeds with a canned chain, noting the host. """
+        with self.lock:
+            self.probed.append(host)
+        chain = [self.leaves.get(host, b'not a certificate'), self.ca]
+        return probe.ProbeResult(host, address, frozenset(), True, 'TLSv1.2', 'AES',
+                                 chain, None)
+
+    def test_results_include_analysis(self):
+        jobs = [('a.example', [resolver.MXRecord(10, u'mx.a.example', ['192.0.2.1']),
+                               resolver.MXRecord(20, u'mx.shared.example', [])]),
+                ('b.example', [resolver.MXRecord(10, u'mx.b.example', ['192.0.2.2'])])]
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=2, analysis_workers=1)
+        results = dict((r.domain, r) for r in scan.run(iter(jobs)))
+        self.assertEqual(sorted(results), ['a.example', 'b.example'])
+        a_result = results['a.example']
+        self.assertEqual([p.host for p in a_result.probes], ['mx.a.example', 'mx.shared.example'])
+        self.assertEqual(len(a_result.certs), 3)
+        leaf = a_result.certs[certs.fingerprint(self.leaves[u'mx.a.example'])]
+        self.assertEqual(leaf.names, ['mx.a.example'])
+        self.assertTrue(leaf.spki_sha256.startswith('sha256/'))
+        self.assertTrue(leaf.not_before < leaf.not_after)
+        self.assertEqual(results['b.example'].certs[certs.fingerprint(self.ca)].names,
+                         ['test ca'])
+        self.assertEqual(a_result.analysis_errors, {})
+
+    def test_analysis_error(self):
+        jobs = [('bad.example', [resolver.MXRecord(10, u'mx.bad.example', []),
+                                 resolver.MXRecord(20, u'mx.shared.example', [])]),
+                ('a.example', [resolver.MXRecord(10, u'mx.a.example', [])])]
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1)
+        results = dict((r.domain, r) for r in scan.run(jobs))
+        bad = results['bad.example']
+        self.assertEqual(list(bad.analysis_errors), ['mx.bad.example'])
+        self.assertEqual(len(bad.certs), 2)
+        self.assertEqual(len(results['a.example'].certs), 2)
+
+    def test_max_analyzed(self):
+        jobs = [(host + '.domain', [resolver.MXRecord(10, host, [])])
+                for host in (u'mx.a.example', u'mx.b.example', u'mx.a.example')]
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1,
+                                 max_analyzed=1)
+        for result in scan.run(jobs):
+            self.assertEqual(len(result.certs), 2)
+            self.assertEqual(len(scan._analyzed), 1) # pylint: disable=protected-access
+
+    def test_version_scans(self):
+        class FakeScanner(object):
+            """ Version scanner that supports whatever was negotiated. """
+            def scan(self, result):
+                """ Finds only the version and cipher the probe saw. """
+                return versions.VersionScan(result.host, result.address,
+                                            {result.protocol: result.cipher}, {}, {}, {})
+        jobs = [('a.example', [resolver.MXRecord(10, u'mx.a.example', ['192.0.2.1'])])]
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1,
+                                 version_scanner=FakeScanner())
+        result, = list(scan.run(jobs))
+        self.assertEqual([v.supported for v in result.versions], [{'TLSv1.2': 'AES'}])
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1)
+        result, = list(scan.run(jobs))
+        self.assertIsNone(result.versions)
+
+    def test_probe_error(self):
+        def flaky_probe(host, address):
+            if host == u'mx.bad.example':
+                raise RuntimeError('probe crashed')
+            return self.fake_probe(host, address)
+        jobs = [('bad.example', [resolver.MXRecord(10, u'mx.bad.example', [])]),
+                ('a.example', [resolver.MXRecord(10, u'mx.a.example', [])]),
+                ('b.example', [resolver.MXRecord(10, u'mx.b.example', [])])]
+        scan = pipeline.Pipeline(flaky_probe, network_workers=1, analysis_workers=1)
+        results = dict((r.domain, r) for r in scan.run(jobs))
+        self.assertEqual(sorted(results), ['a.example', 'b.example', 'bad.example'])
+        self.assertEqual(results['bad.example'].error, 'RuntimeError: probe crashed')
+        self.assertEqual(results['bad.example'].probes, [])
+        self.assertIsNone(results['a.example'].error)
+        self.assertEqual(len(results['b.example'].probes), 1)
+
+    def test_domain_without_mx(self):
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1)
+        result, = list(scan.run([('nomx.example', [])]))
+        self.assertEqual((result.probes, result.certs), ([], {}))
+
+    def test_backpressure(self):
+        jobs = [('d{}.example'.format(i), [resolver.MXRecord(10, u'mx.shared.example', [])])
+                for i in range(100)]
+        scan = pipeline.Pipeline(self.fake_probe, network_workers=1, analysis_workers=1,
+                                 queue_size=2)
+        results = scan.run(iter(jobs))
+        next(results)
+        threading.Event().wait(0.2)
+        # Work queue, domain in hand, probed queue and pending analysis
+        # are each bounded.
+        self.assertTrue(len(self.probed) <= 8)
+        self.assertEqual(len(list(results)), 99)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,9 @@
 import unittest
 import json
 import datetime
+import os
+import shutil
+import tempfile
 
 from starttls_policy import policy
 from starttls_policy import util
@@ -77,6 +80,19 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(self.conf.author, "Electronic Frontier Foundation")
         self.assertEqual(json.loads(self.conf.dump()), obj)
 
+    def test_flush(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.conf.filename = os.path.join(tmp, 'policy.json')
+        other = os.path.join(tmp, 'other.json')
+        self.conf.flush(other)
+        self.assertFalse(os.path.exists(self.conf.filename))
+        self.conf.flush()
+        self.assertEqual(sorted(os.listdir(tmp)), ['other.json', 'policy.json'])
+        loaded = policy.Config(other)
+        loaded.load()
+        self.assertEqual(loaded.get_policy_for('eff.org').mxs, ['eff.org', '.eff.org'])
+
     def test_timestamp_and_exipres_required(self):
         with self.assertRaises(util.ConfigError):
             policy.Config().load_from_dict({'expires': datetime.datetime.now()})
@@ -121,6 +137,28 @@ class TestConfig(unittest.TestCase):
         conf.policies = {'valid': {'pin': 'valid'}}
         self.assertEqual(conf.get_policy_for('valid').pin, 'valid')
 
+    def test_malformed_pins(self):
+        conf = policy.Config()
+        conf.pinsets = {'bad': {'static-spki-hashes': ['sha1/tooshort']}}
+        conf.policies = {'bad.example': {'pin': 'bad'}, 'unpinned.example': {}}
+        self.assertIsNone(conf.check_pin('unpinned.example', []))
+        with self.assertRaises(util.ConfigError):
+            conf.check_pin('bad.example', [])
+
+    def test_domains_for_mx(self):
+        conf = policy.Config()
+        self.assertEqual(conf.get_domains_for_mx('mx.example.com'), ())
+        conf.policy_aliases = {'google': {'mxs': ['.l.google.com']}}
+        conf.policies = {'gmail.com': {'policy-alias': 'google'},
+                         'example.com': {'mxs': ['mx.example.com']}}
+        self.assertEqual(conf.get_domains_for_mx('alt1.gmail-smtp-in.l.google.com'),
+                         ('gmail.com',))
+        self.assertEqual(conf.get_domains_for_mx('mx.example.com'), ('example.com',))
+        # A new index is built when the policies change.
+        conf.policies = {'example.com': {'mxs': ['.example.com']}}
+        self.assertEqual(conf.get_domains_for_mx('mx.example.com'), ('example.com',))
+        self.assertEqual(conf.get_domains_for_mx('alt1.gmail-smtp-in.l.google.com'), ())
+
     def test_iter_policies_aliased(self):
         conf = policy.Config()
         conf.policy_aliases = {'valid': {'tls-report': 'https://tls.report'}}
@@ -0,0 +1,44 @@
+""" Tests for scan/probe.py """
+import socket
+import unittest
+
+from starttls_policy.scan import probe
+from starttls_policy.tests import fakesmtp
+
+class TestProbe(unittest.TestCase):
+    """ Probes against local fake SMTP servers. """
+
+    def test_captures_protocol_cipher_and_chain(self):
+        ca = fakesmtp.make_cert(u'Test CA', is_ca=True)
+        leaf, key = fakesmtp.make_cert(u'mx.example.com', sans=[u'mx.example.com'], issuer=ca)
+        with fakesmtp.FakeSMTPServer(chain=[leaf, ca[0]], key=key) as server:
+            result = probe.probe('localhost', address='127.0.0.1', port=server.port, timeout=5)
+        self.assertIsNone(result.error)
+        self.assertTrue(result.starttls)
+        self.assertEqual(result.address, '127.0.0.1')
+        self.assertTrue(result.protocol.startswith('TLSv1'))
+        self.assertTrue(result.cipher)
+        self.assertIn('STARTTLS', result.capabilities)
+        self.assertEqual(result.chain[0], fakesmtp.der(leaf))
+        if len(result.chain) > 1: # full chain needs Python >= 3.10
+            self.assertEqual(result.chain[1], fakesmtp.der(ca[0]))
+
+    def test_no_starttls(self):
+        with fakesmtp.FakeSMTPServer(starttls=False) as server:
+            result = probe.probe('localhost', address='127.0.0.1', port=server.port, timeout=5)
+        self.assertFalse(result.starttls)
+        self.assertEqual(result.error, 'STARTTLS not offered')
+        self.assertIn('PIPELINING', result.capabilities)
+        self.assertEqual(result.chain, [])
+
+    def test_connection_refused(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        result = probe.probe('localhost', address='127.0.0.1', port=port, timeout=5)
+        self.assertFalse(result.starttls)
+        self.assertTrue(result.error.startswith('Connection failed'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+""" Tests for scan/resolver.py """
+import unittest
+
+from starttls_policy.scan import resolver
+from starttls_policy.tests import fakedns
+
+RECORDS = {
+    'example.com': {'MX': ['20 mx2.example.com.', '10 mx1.example.com.']},
+    'example.net': {'MX': ['10 mx1.example.com.']},
+    'nullmx.example': {'MX': ['0 .']},
+    'nomx.example': {'A': ['192.0.2.9']},
+    'mx1.example.com': {'A': ['192.0.2.1'], 'AAAA': ['2001:db8::1']},
+    'mx2.example.com': {'A': ['192.0.2.2']},
+}
+
+class FakeClock(object):
+    """ Manually advanced clock. """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestResolver(unittest.TestCase):
+    """ Resolution against a local stub DNS server. """
+
+    def setUp(self):
+        self.server = fakedns.FakeDNSServer(RECORDS, ttl=300, negative_ttl=60)
+        self.server.__enter__()
+        self.clock = FakeClock()
+        self.resolver = resolver.Resolver(nameservers=['127.0.0.1'], port=self.server.port,
+                                          timeout=2, workers=4, clock=self.clock)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_mx_sorted_with_addresses(self):
+        self.assertEqual(self.resolver.mx('example.com'), [
+            resolver.MXRecord(10, 'mx1.example.com', ['192.0.2.1', '2001:db8::1']),
+            resolver.MXRecord(20, 'mx2.example.com', ['192.0.2.2'])])
+
+    def test_negative_answers(self):
+        self.assertEqual(self.resolver.mx('nullmx.example'), [])
+        self.assertEqual(self.resolver.mx('nomx.example'), [])
+        self.assertEqual(self.resolver.mx('missing.example'), [])
+
+    def test_cache_respects_ttls(self):
+        self.resolver.mx('example.com')
+        self.resolver.mx('missing.example')
+        queries = len(self.server.queries)
+        self.resolver.mx('example.com')
+        self.resolver.mx('missing.example')
+        self.assertEqual(len(self.server.queries), queries)
+        # Negative answer expires after the SOA minimum, positive ones don't.
+        self.clock.now += 61
+        self.resolver.mx('example.com')
+        self.resolver.mx('missing.example')
+        self.assertEqual(sorted(self.server.queries[queries:]),
+                         [('missing.example', 'MX'), ('mx2.example.com', 'AAAA')])
+        self.clock.now += 300
+        self.resolver.mx('example.com')
+        self.assertIn(('example.com', 'MX'), self.server.queries[queries + 2:])
+
+    def test_resolve_many_shares_mx_lookups(self):
+        domains = ['example.com', 'example.net', 'missing.example']
+        results = list(self.resolver.resolve_many(domains))
+        self.assertEqual([domain for domain, _, _ in results], domains)
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(results[1][1][0].addresses, ['192.0.2.1', '2001:db8::1'])
+        self.assertEqual(self.server.queries.count(('mx1.example.com', 'A')), 1)
+
+    def test_resolve_many_reads_input_lazily(self):
+        taken = []
+
+        def domains():
+            for i in range(100):
+                taken.append(i)
+                yield 'missing{}.example'.format(i)
+
+        results = self.resolver.resolve_many(domains())
+        next(results)
+        # Only a window of twice the workers is taken ahead of the results.
+        self.assertLessEqual(len(taken), 2 * self.resolver.workers + 1)
+        self.assertEqual(len(list(results)), 99)
+        self.assertEqual(len(taken), 100)
+
+    def test_failure_is_reported(self):
+        unreachable = resolver.Resolver(nameservers=['127.0.0.1'], port=1, timeout=0.2)
+        (_, records, error), = list(unreachable.resolve_many(['example.com']))
+        self.assertEqual(records, [])
+        self.assertTrue(isinstance(error, resolver.ResolveError))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+""" Tests for scan/results.py """
+import datetime
+import io
+import json
+import unittest
+
+from starttls_policy import policy
+from starttls_policy.scan import certstore
+from starttls_policy.scan import results
+from starttls_policy.scan import suffix
+from starttls_policy.scan import versions
+
+INDEX = suffix.SuffixIndex.from_lines(['com', 'org'])
+
+def _obs(host, starttls=True, protocol='TLSv1.2', time=100):
+    return certstore.Observation(host, '192.0.2.1', starttls, protocol if starttls else None,
+                                 'AES', ['ab'] if starttls else [], [host], None, time)
+
+class TestEvaluate(unittest.TestCase):
+    """ Unittests for evaluate. """
+
+    def test_valid(self):
+        observations = [_obs('mx1.example.com', protocol='TLSv1.2', time=100),
+                        _obs('mx2.example.com', protocol='TLSv1.1', time=101),
+                        _obs('mx3.example.com', starttls=False)]
+        result = results.evaluate('example.com', observations, lambda obs: True, INDEX)
+        self.assertEqual(result, results.DomainResult(
+            'example.com', 101, ['.example.com'], 'TLSv1.1', None))
+
+    def test_version_scans(self):
+        observations = [_obs('mx1.example.com', protocol='TLSv1.2'),
+                        _obs('mx2.example.com', protocol='TLSv1.2')]
+        scans = {'mx1.example.com': versions.VersionScan(
+            'mx1.example.com', None, {'TLSv1.3': 'x', 'TLSv1.2': 'y', 'TLSv1': 'z'}, {}, {}, {})}
+        result = results.evaluate('example.com', observations, lambda obs: True, INDEX,
+                                  versions=scans.get)
+        self.assertEqual(result.min_tls_version, 'TLSv1.2')
+        # Never more than TLSv1.2, even if every host supports TLSv1.3.
+        scans['mx2.example.com'] = scans['mx1.example.com']._replace(host='mx2.example.com')
+        result = results.evaluate('example.com', observations, lambda obs: True, INDEX,
+                                  versions=scans.get)
+        self.assertEqual(result.min_tls_version, 'TLSv1.2')
+        scans['mx2.example.com'] = versions.VersionScan(
+            'mx2.example.com', None, {'TLSv1.1': 'x', 'TLSv1': 'y'}, {}, {}, {})
+        result = results.evaluate('example.com', observations, lambda obs: True, INDEX,
+                                  versions=scans.get)
+        self.assertEqual(result.min_tls_version, 'TLSv1.1')
+
+    def test_errors(self):
+        result = results.evaluate('example.com', [_obs('mx.example.com', starttls=False)],
+                                  lambda obs: True, INDEX)
+        self.assertEqual(result.error, 'no MX host offered STARTTLS')
+        result = results.evaluate('example.com', [_obs('mx.example.com')],
+                                  lambda obs: False, INDEX)
+        self.assertEqual(result.error, 'mx.example.com: invalid certificate')
+        result = results.evaluate('example.com', [_obs('mx.example.com', protocol='SSLv3')],
+                                  lambda obs: True, INDEX)
+        self.assertEqual(result.error, 'mx.example.com: negotiated SSLv3')
+        self.assertEqual(results.evaluate('example.com', [], None, INDEX).error, 'no MX hosts')
+
+class TestResultsFile(unittest.TestCase):
+    """ Unittests for ResultWriter and read_results. """
+
+    def test_round_trip(self):
+        f = io.StringIO()
+        writer = results.ResultWriter(f)
+        written = [results.DomainResult(u'example.com', 100, [u'.example.com'], u'TLSv1.2', None),
+                   results.DomainResult(u'example.org', 101, [], None, u'no MX host')]
+        for result in written:
+            writer.write(result)
+        # Simulate a writer killed in the middle of a line.
+        f.write(u'{"domain": "trunc')
+        f.seek(0)
+        self.assertEqual(list(results.read_results(f)), written)
+
+class TestFold(unittest.TestCase):
+    """ Unittests for fold and new_config. """
+
+    def test_fold(self):
+        now = datetime.datetime(2018, 6, 18)
+        config = results.new_config('policy.json', author='me', now=now)
+        self.assertEqual(config.expires, now + results.DEFAULT_LIFETIME)
+        config.policy_aliases = {'google': {'mxs': ['.l.google.com']}}
+        config.policies = {
+            'existing.com': {'mxs': ['old.existing.com'], 'mode': 'enforce'},
+            'gmail.com': {'policy-alias': 'google'},
+            }
+        count = results.fold([
+            results.DomainResult('new.com', 1, ['mx.new.com'], 'TLSv1.2', None),
+            results.DomainResult('existing.com', 1, ['.existing.com'], 'TLSv1.1', None),
+            results.DomainResult('gmail.com', 1, ['.gmail.com'], 'TLSv1.2', None),
+            results.DomainResult('broken.com', 1, ['.broken.com'], 'TLSv1.2', None),
+            results.DomainResult('broken.com', 2, [], None, 'invalid certificate'),
+            ], config)
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(config.policies), ['existing.com', 'gmail.com', 'new.com'])
+        self.assertEqual(config.get_policy_for('new.com').mode, 'testing')
+        existing = config.get_policy_for('existing.com')
+        self.assertEqual((existing.mxs, existing.min_tls_version, existing.mode),
+                         (['.existing.com'], 'TLSv1.1', 'enforce'))
+        self.assertEqual(config.get_policy_for('gmail.com').mxs, ['.l.google.com'])
+        # The result survives a round trip through the policy file format.
+        reloaded = policy.Config()
+        reloaded.load_from_dict(json.loads(config.dump()))
+        self.assertEqual(reloaded.get_policy_for('new.com').mxs, ['mx.new.com'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+""" Tests for scan/schedule.py """
+import threading
+import time
+import unittest
+
+from starttls_policy.scan import schedule
+
+class Recorder(object):
+    """ Task function that records how many calls overlap. """
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.order = []
+
+    def __call__(self, name):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.order.append(name)
+        time.sleep(self.duration)
+        with self.lock:
+            self.active -= 1
+        return name
+
+def _run_all(scheduler, calls):
+    """ Submits (host, address, func, arg) calls from separate threads. """
+    results = []
+    threads = [threading.Thread(target=lambda c=call: results.append(scheduler.submit(*c)))
+               for call in calls]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.002) # keep submission order predictable
+    for thread in threads:
+        thread.join()
+    return results
+
+class TestScheduler(unittest.TestCase):
+    """ Unittests for Scheduler. """
+
+    def test_per_ip_cap(self):
+        scheduler = schedule.Scheduler(workers=8, per_ip=2, ip_rate=None, provider_rate=None)
+        recorder = Recorder()
+        results = _run_all(scheduler, [('mx.example.com', '192.0.2.1', recorder, i)
+                                       for i in range(6)])
+        scheduler.close()
+        self.assertEqual(sorted(results), list(range(6)))
+        self.assertEqual(recorder.max_active, 2)
+
+    def test_per_provider_cap(self):
+        scheduler = schedule.Scheduler(workers=8, per_ip=8, per_provider=3,
+                                       ip_rate=None, provider_rate=None)
+        recorder = Recorder()
+        _run_all(scheduler, [('mx{}.example.com'.format(i), '192.0.2.{}'.format(i), recorder, i)
+                             for i in range(6)])
+        scheduler.close()
+        self.assertEqual(recorder.max_active, 3)
+
+    def test_destinations_take_turns(self):
+        scheduler = schedule.Scheduler(workers=1, per_ip=1, ip_rate=None, provider_rate=None)
+        recorder = Recorder(duration=0.02)
+        calls = [('mx.busy.example', '192.0.2.1', recorder, 'busy')] * 5
+        calls.append(('mx.quiet.example', '192.0.2.2', recorder, 'quiet'))
+        _run_all(scheduler, calls)
+        scheduler.close()
+        self.assertTrue(recorder.order.index('quiet') <= 2)
+
+    def test_rate_limit(self):
+        scheduler = schedule.Scheduler(workers=4, per_ip=1, ip_rate=20, provider_rate=None)
+        start = time.time()
+        _run_all(scheduler, [('mx.example.com', '192.0.2.1', Recorder(0), i) for i in range(5)])
+        scheduler.close()
+        # One burst token, then 50ms per connection.
+        self.assertTrue(time.time() - start >= 0.19)
+
+    def test_rate_limited_destination_steps_aside(self):
+        scheduler = schedule.Scheduler(workers=2, per_ip=1, ip_rate=5, provider_rate=None)
+        recorder = Recorder(duration=0)
+        calls = [('mx.slow.example', '192.0.2.1', recorder, 'slow')] * 3
+        calls.append(('mx.fast.example', '192.0.2.2', recorder, 'fast'))
+        _run_all(scheduler, calls)
+        scheduler.close()
+        self.assertEqual(recorder.order, ['slow', 'fast', 'slow', 'slow'])
+
+    def test_wrap_and_stats(self):
+        scheduler = schedule.Scheduler(workers=2, ip_rate=None, provider_rate=None)
+        probe = scheduler.wrap(lambda host, address=None: (host, address))
+        self.assertEqual(probe('mx.example.com', address='192.0.2.1'),
+                         ('mx.example.com', '192.0.2.1'))
+        self.assertEqual(probe('MX.example.org'), ('MX.example.org', None))
+        scheduler.close()
+        stats = dict((s.destination, s) for s in scheduler.stats())
+        self.assertEqual(stats['192.0.2.1'].count, 1)
+        self.assertEqual(stats['mx.example.org'].provider, 'example.org')
+        self.assertIn('192.0.2.1', scheduler.report())
+
+    def test_errors_propagate(self):
+        scheduler = schedule.Scheduler(workers=1)
+        def fail():
+            raise ValueError('nope')
+        with self.assertRaises(ValueError):
+            scheduler.submit('mx.example.com', None, fail)
+        scheduler.close()
+
+class TestTokenBucket(unittest.TestCase):
+    """ Unittests for TokenBucket. """
+
+    def test_refill(self):
+        bucket = schedule.TokenBucket(rate=2, burst=2, now=0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertAlmostEqual(bucket.delay(0), 0.5)
+        self.assertEqual(bucket.delay(0.5), 0)
+        self.assertEqual(bucket.delay(100), 0)
+        bucket.take(100)
+        bucket.take(100)
+        self.assertTrue(bucket.delay(100) > 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+""" Tests for scan/suffix.py """
+import os
+import shutil
+import tempfile
+import unittest
+
+from starttls_policy.scan import suffix
+
+PSL = u"""// Sample of the public suffix list.
+com
+uk
+co.uk
+*.ck
+!www.ck
+jp
+*.kawasaki.jp
+!city.kawasaki.jp
+// ===BEGIN PRIVATE DOMAINS===
+blogspot.com
+中国
+"""
+
+class TestLabels(unittest.TestCase):
+    """ Unittests for label tuple helpers. """
+
+    def test_labels(self):
+        self.assertEqual(suffix.labels('MX.Example.com.'), ('com', 'example', 'mx'))
+        self.assertEqual(suffix.labels('.example.com'), ('com', 'example'))
+        self.assertEqual(suffix.join(('com', 'example', 'mx')), 'mx.example.com')
+
+    def test_common_suffix(self):
+        names = [suffix.labels(h) for h in
+                 ('alt1.aspmx.l.google.com', 'aspmx.l.google.com', 'alt2.aspmx.l.google.com')]
+        self.assertEqual(suffix.join(suffix.common_suffix(names)), 'aspmx.l.google.com')
+        self.assertEqual(suffix.common_suffix([('com', 'a'), ('org', 'a')]), ())
+        self.assertEqual(suffix.common_suffix([]), ())
+        self.assertEqual(suffix.common_suffix([('com', 'a', 'b')]), ('com', 'a', 'b'))
+
+class TestSuffixIndex(unittest.TestCase):
+    """ Unittests for SuffixIndex. """
+
+    def setUp(self):
+        self.index = suffix.SuffixIndex.from_lines(PSL.splitlines())
+
+    def test_registrable_domain(self):
+        cases = {
+            'alt1.aspmx.l.google.com': 'google.com',
+            'mx.example.co.uk': 'example.co.uk',
+            'co.uk': 'co.uk',
+            'mx.example.org': 'example.org',
+            'a.b.ck': 'a.b.ck',
+            'mx.www.ck': 'www.ck',
+            'mx.city.kawasaki.jp': 'city.kawasaki.jp',
+            'mx.foo.blogspot.com': 'foo.blogspot.com',
+            'mx.example.xn--fiqs8s': 'example.xn--fiqs8s',
+            }
+        for name, expected in cases.items():
+            self.assertEqual(self.index.registrable_domain(name), expected)
+
+    def test_empty_labels(self):
+        self.assertEqual(self.index.suffix_length(suffix.labels('a..com')), 1)
+        self.assertEqual(self.index.suffix_length(suffix.labels('a..ck')), 2)
+        index = suffix.SuffixIndex.from_lines(['com', 'a..com'])
+        self.assertEqual(index.suffix_length(suffix.labels('b.a..com')), 1)
+
+    def test_covering_patterns(self):
+        hosts = ['alt1.aspmx.l.google.com', 'aspmx.l.google.com', 'ALT2.aspmx.l.google.com',
+                 'mx1.fastmail.com', 'mx2.fastmail.com', 'fastmail.com',
+                 'mx.example.org', 'mx.example.org']
+        self.assertEqual(self.index.covering_patterns(hosts), [
+            '.aspmx.l.google.com', '.fastmail.com', 'aspmx.l.google.com', 'fastmail.com',
+            'mx.example.org'])
+
+    def test_disk_cache(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        source = os.path.join(tmp, 'list.dat')
+        cache_file = os.path.join(tmp, 'list.pickle')
+        with open(source, 'wb') as f:
+            f.write(PSL.encode('utf-8'))
+        index = suffix.SuffixIndex.load(source, cache_file)
+        self.assertTrue(os.path.exists(cache_file))
+        self.assertEqual(index.registrable_domain('a.b.co.uk'), 'b.co.uk')
+        # The cached trie is used while the list is unchanged...
+        with open(cache_file, 'rb') as f:
+            cached = f.read()
+        suffix.SuffixIndex.load(source, cache_file)
+        with open(cache_file, 'rb') as f:
+            self.assertEqual(f.read(), cached)
+        # ...and rebuilt when it changes.
+        with open(source, 'ab') as f:
+            f.write(b'example.org\n')
+        index = suffix.SuffixIndex.load(source, cache_file)
+        self.assertEqual(index.registrable_domain('mx.foo.example.org'), 'foo.example.org')
+
+if __name__ == '__main__':
+    unittest.main()
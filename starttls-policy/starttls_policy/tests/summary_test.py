@@ -0,0 +1,98 @@
+""" Tests for maillog/summary.py """
+import gzip
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from starttls_policy.maillog import summary
+
+OLD = b'''Jun 12 06:24:14 sender postfix/smtp[9045]: Untrusted TLS connection established to \
+mx.example.com[192.0.2.1]:25: TLSv1.2
+Jun 12 06:24:15 sender postfix/smtpd[9046]: connect from client.example[192.0.2.9]
+Jun 12 06:24:16 sender postfix/smtp[1711]: 62D3F481249: to=<a@b.example>, \
+relay=mx.b.example[192.0.2.2]:25, dsn=4.7.4, status=deferred (TLS is required, but was not \
+offered by host mx.b.example[192.0.2.2])
+'''
+NEW = b'''Jun 13 08:00:00 sender postfix/smtp[9047]: Verified TLS connection established to \
+mx.example.com[192.0.2.1]:25: TLSv1.3
+Jun 13 08:00:01 sender postfix/smtp[9048]: Untrusted TLS connection established to \
+mx.other.example[192.0.2.3]:25: TLSv1.2
+'''
+
+def _domains(mx_hostname):
+    return {'mx.example.com': ['example.com']}.get(mx_hostname)
+
+class TestSummary(unittest.TestCase):
+    """ Unittests for counting TLS events in log files. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.old = os.path.join(self.tmp, 'maillog.1.gz')
+        with gzip.open(self.old, 'wb') as f:
+            f.write(OLD)
+        self.new = os.path.join(self.tmp, 'maillog')
+        with open(self.new, 'wb') as f:
+            f.write(NEW)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_open_log(self):
+        for filename, data in ((self.old, OLD), (self.new, NEW)):
+            f = summary.open_log(filename)
+            self.assertEqual(f.read(), data)
+            f.close()
+
+    def test_zstd_missing(self):
+        filename = os.path.join(self.tmp, 'maillog.2.zst')
+        with open(filename, 'wb') as f:
+            f.write(b'\x28\xb5\x2f\xfd' + b'\0' * 8)
+        with mock.patch.object(summary, 'zstandard', None):
+            with self.assertRaises(ValueError):
+                summary.open_log(filename)
+
+    def test_count_file(self):
+        counts = summary.count_file((self.old, None))
+        self.assertEqual(counts.connected, {('mx.example.com', 'Untrusted'): 1})
+        self.assertEqual(counts.deferred, {'mx.b.example': 1})
+        self.assertFalse(counts.seen_trusted)
+        self.assertEqual(counts.last - counts.first, 2)
+        self.assertEqual(pickle.loads(pickle.dumps(counts)).deferred, counts.deferred)
+
+    def test_earliest(self):
+        first = summary.count_file((self.old, None)).first
+        counts = summary.count_file((self.old, first + 1))
+        self.assertEqual(counts.connected, {})
+        self.assertEqual(counts.deferred, {'mx.b.example': 1})
+
+    def _check(self, counts):
+        self.assertEqual(counts.connected, {('mx.example.com', 'Untrusted'): 1,
+                                            ('mx.example.com', 'Verified'): 1,
+                                            ('mx.other.example', 'Untrusted'): 1})
+        self.assertEqual(counts.deferred, {'mx.b.example': 1})
+        self.assertTrue(counts.seen_trusted)
+        self.assertEqual(counts.first, summary.count_file((self.old, None)).first)
+        self.assertEqual(counts.last, summary.count_file((self.new, None)).last)
+        self.assertEqual(counts.domain_counts(_domains),
+                         {'example.com': {'Untrusted': 1, 'Verified': 1, 'all': 2}})
+
+    def test_count_files(self):
+        # Listed newest first, as a glob of rotated logs might be.
+        self._check(summary.count_files([self.new, self.old], workers=1))
+
+    def test_count_files_parallel(self):
+        self._check(summary.count_files([self.new, self.old], workers=2))
+
+    def test_count_no_events(self):
+        empty = os.path.join(self.tmp, 'maillog.2')
+        open(empty, 'wb').close()
+        counts = summary.count_files([empty], workers=1)
+        self.assertIsNone(counts.first)
+        self.assertEqual(counts.domain_counts(_domains), {})
+
+if __name__ == '__main__':
+    unittest.main()
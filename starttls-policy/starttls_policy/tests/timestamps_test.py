@@ -0,0 +1,61 @@
+""" Tests for maillog/timestamps.py """
+import calendar
+import time
+import unittest
+
+from starttls_policy.maillog import timestamps
+
+def _local(*fields):
+    return time.mktime(fields + (0, 0, -1))
+
+class TestTimestampDecoder(unittest.TestCase):
+    """ Unittests for syslog timestamp decoding. """
+
+    def test_syslog(self):
+        decoder = timestamps.TimestampDecoder(reference=_local(2018, 6, 30, 0, 0, 0))
+        line = b'Jun 12 06:24:14 sender postfix/smtp[9045]: ...'
+        for _ in range(2):
+            self.assertEqual(decoder.decode(line), _local(2018, 6, 12, 6, 24, 14))
+        self.assertEqual(decoder.decode('Jun  6 00:21:31 precise32 postfix/smtpd[3648]'),
+                         _local(2018, 6, 6, 0, 21, 31))
+        self.assertEqual(decoder.decode(b'Jun 12 06:24:15'), _local(2018, 6, 12, 6, 24, 15))
+
+    def test_matches_strptime(self):
+        decoder = timestamps.TimestampDecoder(reference=_local(2018, 12, 31, 0, 0, 0))
+        for stamp in ('Jan  1 00:00:00', 'Mar 11 02:30:00', 'Jul  4 23:59:59',
+                      'Nov  4 01:30:00', 'Dec 31 23:59:59'):
+            parsed = time.strptime('2018 ' + stamp, '%Y %b %d %H:%M:%S')
+            self.assertEqual(decoder.decode(stamp), time.mktime(parsed), stamp)
+
+    def test_year_inferred_from_reference(self):
+        # Read early in January, December lines are from last year.
+        decoder = timestamps.TimestampDecoder(reference=_local(2019, 1, 2, 0, 0, 0))
+        self.assertEqual(decoder.decode(b'Dec 31 23:59:59'), _local(2018, 12, 31, 23, 59, 59))
+
+    def test_year_rollover(self):
+        decoder = timestamps.TimestampDecoder(reference=_local(2019, 1, 2, 0, 0, 0))
+        self.assertEqual(decoder.decode(b'Dec 31 23:59:59'), _local(2018, 12, 31, 23, 59, 59))
+        self.assertEqual(decoder.decode(b'Jan  1 00:00:01'), _local(2019, 1, 1, 0, 0, 1))
+        # A line logged late, from before the rollover.
+        self.assertEqual(decoder.decode(b'Dec 31 23:59:58'), _local(2018, 12, 31, 23, 59, 58))
+        self.assertEqual(decoder.decode(b'Jan  1 00:00:02'), _local(2019, 1, 1, 0, 0, 2))
+
+    def test_rfc5424(self):
+        decoder = timestamps.TimestampDecoder()
+        base = calendar.timegm((2018, 6, 12, 4, 24, 14))
+        self.assertEqual(decoder.decode(b'2018-06-12T06:24:14+02:00 sender postfix/smtp[1]:'),
+                         base)
+        self.assertAlmostEqual(decoder.decode('2018-06-12T06:24:14.25+02:00 sender'), base + 0.25)
+        self.assertEqual(decoder.decode(b'<34>1 2018-06-12T04:24:15Z sender postfix - - -'),
+                         base + 1)
+        self.assertEqual(decoder.decode(b'2018-06-12T01:24:14-03:00'), base)
+        self.assertEqual(decoder.decode(b'2018-06-12T04:24:16'), base + 2)
+
+    def test_invalid(self):
+        decoder = timestamps.TimestampDecoder()
+        for line in (b'', b'Foo 12 06:24:14 sender', b'2018-06-12X06:24:14Z', b'Jun 12 06:2'):
+            with self.assertRaises(ValueError):
+                decoder.decode(line)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,13 @@
 """ Tests for util.py """
+import os
+import shutil
+import stat
+import tempfile
 import unittest
 from functools import partial
 
+import mock
+
 from starttls_policy import util
 
 class TestEnforceUtil(unittest.TestCase):
@@ -36,5 +42,67 @@ class TestEnforceUtil(unittest.TestCase):
         with self.assertRaises(util.ConfigError):
             func({"b": "a", "c": 2})
 
+class TestWriteAtomically(unittest.TestCase):
+    """ Unittests for atomic file replacement. """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'policy.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _mode(self):
+        return stat.S_IMODE(os.stat(self.filename).st_mode)
+
+    def test_write(self):
+        util.write_atomically(self.filename, b'one')
+        util.write_atomically(self.filename, b'two', sync=True)
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), b'two')
+        self.assertEqual(os.listdir(self.tmp), ['policy.json'])
+
+    def test_new_file_mode(self):
+        umask = os.umask(0o022)
+        try:
+            util.write_atomically(self.filename, b'data')
+        finally:
+            os.umask(umask)
+        self.assertEqual(self._mode(), 0o644)
+
+    def test_leaves_umask_alone(self):
+        # Changing it, even briefly, races with files created by other threads.
+        with mock.patch.object(os, 'umask') as umask:
+            util.write_atomically(self.filename, b'data')
+        self.assertFalse(umask.called)
+
+    def test_keeps_mode(self):
+        util.write_atomically(self.filename, b'old')
+        os.chmod(self.filename, 0o640)
+        util.write_atomically(self.filename, b'new')
+        self.assertEqual(self._mode(), 0o640)
+
+class TestTTLCache(unittest.TestCase):
+    """ Unittests for TTLCache. """
+
+    def test_expiry(self):
+        now = [1000.0]
+        ttl_cache = util.TTLCache(10, clock=lambda: now[0])
+        ttl_cache.set('a', 1, ttl=10)
+        self.assertEqual(ttl_cache.get('a'), 1)
+        now[0] += 10
+        self.assertEqual(ttl_cache.get('a', 'gone'), 'gone')
+        self.assertFalse('a' in ttl_cache)
+
+    def test_evicts_least_recently_used(self):
+        ttl_cache = util.TTLCache(max_size=2)
+        ttl_cache.set('a', 1, ttl=10)
+        ttl_cache.set('b', 2, ttl=10)
+        ttl_cache.get('a')
+        ttl_cache.set('c', 3, ttl=10)
+        self.assertTrue('a' in ttl_cache)
+        self.assertFalse('b' in ttl_cache)
+        self.assertEqual(len(ttl_cache), 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+""" Tests for scan/verify.py """
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from starttls_policy.scan import verify
+from starttls_policy.tests import fakesmtp
+
+class TestTrustStore(unittest.TestCase):
+    """ Verification against a locally generated CA. """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.root = fakesmtp.make_cert(u'Test Root', is_ca=True, days=365)
+        cls.intermediate = fakesmtp.make_cert(u'Test Intermediate', is_ca=True,
+                                              issuer=cls.root, days=365)
+        cls.leaf = fakesmtp.make_cert(u'mx.example.com', sans=[u'mx.example.com'],
+                                      issuer=cls.intermediate)[0]
+        cls.cafile = os.path.join(cls.tmpdir, 'roots.pem')
+        with open(cls.cafile, 'wb') as f:
+            f.write(fakesmtp.pem(cls.root[0]))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.store = verify.TrustStore(cafile=self.cafile)
+        self.chain = [fakesmtp.der(self.leaf), fakesmtp.der(self.intermediate[0])]
+
+    def test_valid_chain(self):
+        self.assertEqual(self.store.verify(self.chain), verify.Verification(True, None))
+
+    def test_missing_intermediate(self):
+        result = self.store.verify(self.chain[:1])
+        self.assertFalse(result.valid)
+        self.assertTrue(result.error)
+
+    def test_untrusted_root(self):
+        other_root = fakesmtp.make_cert(u'Other Root', is_ca=True)
+        leaf = fakesmtp.make_cert(u'mx.example.com', issuer=other_root)[0]
+        self.assertFalse(self.store.verify([fakesmtp.der(leaf)]).valid)
+
+    def test_self_signed_leaf(self):
+        leaf = fakesmtp.make_cert(u'mx.example.com')[0]
+        self.assertFalse(self.store.verify([fakesmtp.der(leaf)]).valid)
+
+    def test_not_for_server_auth(self):
+        leaf = fakesmtp.make_cert(u'mx.example.com', issuer=self.intermediate,
+                                  server_auth=False)[0]
+        result = self.store.verify([fakesmtp.der(leaf), self.chain[1]])
+        self.assertEqual(result, verify.Verification(False, 'unsupported certificate purpose'))
+
+    def test_expired_at_time(self):
+        later = datetime.datetime.now() + datetime.timedelta(days=60)
+        store = verify.TrustStore(cafile=self.cafile, at_time=later)
+        self.assertFalse(store.verify(self.chain).valid)
+
+    def test_empty_chain(self):
+        self.assertFalse(self.store.verify([]).valid)
+
+    def test_results_memoized_by_chain(self):
+        with mock.patch('starttls_policy.scan.verify.crypto.X509StoreContext',
+                        wraps=verify.crypto.X509StoreContext) as context:
+            for _ in range(3):
+                self.assertTrue(self.store.verify(list(self.chain)).valid)
+            self.assertFalse(self.store.verify(self.chain[:1]).valid)
+        self.assertEqual(context.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
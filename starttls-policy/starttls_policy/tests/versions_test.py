@@ -0,0 +1,88 @@
+""" Tests for scan/versions.py """
+import functools
+import unittest
+
+from starttls_policy.scan import probe
+from starttls_policy.scan import versions
+from starttls_policy.tests import fakesmtp
+
+class TestVersionScanner(unittest.TestCase):
+    """ Version scans against local fake SMTP servers that accept only
+    some TLS versions. """
+
+    def _scan(self, server, **kwargs):
+        probe_local = functools.partial(probe.probe, port=server.port, timeout=5)
+        scanner = versions.VersionScanner(probe=probe_local, workers=4, **kwargs)
+        self.addCleanup(scanner.close)
+        return scanner.scan(probe_local('localhost', '127.0.0.1'))
+
+    def test_modern_server(self):
+        with fakesmtp.FakeSMTPServer(versions=('TLSv1.2', 'TLSv1.3')) as server:
+            scan = self._scan(server)
+        self.assertEqual(sorted(scan.supported), ['TLSv1.2', 'TLSv1.3'])
+        self.assertEqual(sorted(scan.refused), ['TLSv1', 'TLSv1.1'])
+        self.assertEqual(versions.supported_range(scan), ('TLSv1.2', 'TLSv1.3'))
+        self.assertTrue(scan.supported['TLSv1.3'].startswith('TLS_'))
+
+    def test_legacy_server(self):
+        # Our default probe won't negotiate with this one, but still sees
+        # it offering STARTTLS.
+        with fakesmtp.FakeSMTPServer(versions=('TLSv1', 'TLSv1.1')) as server:
+            scan = self._scan(server)
+        self.assertEqual(versions.supported_range(scan), ('TLSv1', 'TLSv1.1'))
+        self.assertTrue(scan.refused['TLSv1.3'].startswith('TLS handshake failed'))
+
+    def test_cipher_order(self):
+        preference = ['ECDHE-ECDSA-AES256-GCM-SHA384', 'ECDHE-ECDSA-AES128-SHA',
+                      'ECDHE-ECDSA-AES128-GCM-SHA256']
+        with fakesmtp.FakeSMTPServer(versions=('TLSv1.2', 'TLSv1.2'),
+                                     ciphers=':'.join(preference)) as server:
+            scan = self._scan(server, cipher_order=True)
+        self.assertEqual(scan.cipher_order, {'TLSv1.2': preference})
+        self.assertEqual(scan.supported, {'TLSv1.2': preference[0]})
+
+    def test_reuses_probe_and_cache(self):
+        calls = []
+        def fake_probe(host, address, context=None):
+            calls.append(context.maximum_version)
+            return probe.ProbeResult(host, address, frozenset(['STARTTLS']), False, None,
+                                     None, [], 'TLS handshake failed')
+        scanner = versions.VersionScanner(probe=fake_probe, workers=2)
+        self.addCleanup(scanner.close)
+        first = probe.ProbeResult('mx.example.com', '192.0.2.1', frozenset(['STARTTLS']),
+                                  True, 'TLSv1.3', 'TLS_AES_128_GCM_SHA256', [], None)
+        scan = scanner.scan(first)
+        self.assertEqual(scan.supported, {'TLSv1.3': 'TLS_AES_128_GCM_SHA256'})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(scanner.scan(first), scan)
+        self.assertEqual(len(calls), 3)
+        no_tls = probe.ProbeResult('mx.example.net', '192.0.2.2', frozenset(), False,
+                                   None, None, [], 'STARTTLS not offered')
+        self.assertEqual(scanner.scan(no_tls).supported, {})
+        self.assertEqual(len(calls), 3)
+
+    def test_errors_are_not_refusals(self):
+        calls = []
+        def fake_probe(host, address, context=None):
+            calls.append(context.maximum_version)
+            if len(calls) == 1:
+                error = 'Connection failed: timed out'
+            else:
+                error = 'Unexpected greeting: 421 try again later'
+            return probe.ProbeResult(host, address, frozenset(['STARTTLS']), False, None,
+                                     None, [], error)
+        scanner = versions.VersionScanner(probe=fake_probe, versions=('TLSv1.1', 'TLSv1.2'),
+                                          workers=1)
+        self.addCleanup(scanner.close)
+        first = probe.ProbeResult('mx.example.com', '192.0.2.1', frozenset(['STARTTLS']),
+                                  True, 'TLSv1.2', 'AES128-SHA', [], None)
+        scan = scanner.scan(first)
+        self.assertEqual((scan.supported, scan.refused), ({'TLSv1.2': 'AES128-SHA'}, {}))
+        self.assertEqual(scan.errors, {'TLSv1.1': 'Connection failed: timed out'})
+        # Not cached, so the next scan tries again.
+        self.assertEqual(scanner.scan(first).errors,
+                         {'TLSv1.1': 'Unexpected greeting: 421 try again later'})
+        self.assertEqual(len(calls), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 """ Utils for transforming and linting the config. """
 
+import binascii
+import collections
 import datetime
+import errno
 from functools import partial
+import os
+import stat
+import threading
+import time
 import six
 from dateutil import parser # Dependency: python-dateutil
 
@@ -83,6 +90,115 @@ def get_properties(schema):
         return enforce, default, required
     return schema, None, None
 
+def _create_temp(dirname):
+    """ Creates an empty file with a random name in `dirname`, with the
+    usual mode under the umask, applied by the kernel.
+    :returns tuple: (file descriptor, path). """
+    while True:
+        tmp = os.path.join(dirname, '.tmp' + binascii.hexlify(os.urandom(8)).decode('ascii'))
+        try:
+            return os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), tmp
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+def write_atomically(filename, data, sync=False):
+    """ Writes `data` (bytes) to `filename` so that readers only ever see
+    the old or the new contents. With `sync`, the new contents are on disk
+    before they replace the old, so they survive a crash of the machine.
+    The file keeps its mode, or gets the usual mode under the umask if it's
+    new, rather than the private mode of a temporary file. """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except OSError:
+        mode = None
+    fd, tmp = _create_temp(dirname)
+    try:
+        if mode is not None:
+            os.chmod(tmp, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+class TTLCache(object):
+    """ Thread-safe mapping whose entries expire after a per-entry TTL.
+    Holds at most `max_size` entries, evicting the least recently used.
+    """
+
+    def __init__(self, max_size, clock=time.time):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _get_locked(self, key, default):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= self._clock():
+            del self._entries[key]
+            return default
+        # Re-insert to mark as most recently used.
+        del self._entries[key]
+        self._entries[key] = entry
+        return value
+
+    def get(self, key, default=None):
+        """ Returns the live value for `key`, or `default`. """
+        with self._lock:
+            return self._get_locked(key, default)
+
+    def set(self, key, value, ttl):
+        """ Stores `value` under `key` for `ttl` seconds. """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """ Returns the live value for `key`. On a miss, calls `compute()`,
+        which must return a (value, ttl) tuple, and caches the value.
+        Concurrent misses on the same key wait for the one computation
+        in flight rather than starting their own. """
+        while True:
+            with self._lock:
+                value = self._get_locked(key, self)
+                if value is not self:
+                    self.hits += 1
+                    return value
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+        try:
+            value, ttl = compute()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._entries)
+
 # JSON schema definitions.
 # All in one place!
 #
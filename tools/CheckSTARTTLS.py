@@ -1,191 +1,231 @@
 #!/usr/bin/env python
-import sys
+from __future__ import print_function
+import argparse
+import datetime
+import functools
 import os
-import errno
-import smtplib
-import socket
-import subprocess
-import re
-import json
-import collections
-
-import dns.resolver
-from M2Crypto import X509
-from publicsuffix import PublicSuffixList
-
-public_suffix_list = PublicSuffixList()
+import sys
+import time
+
+from starttls_policy import policy
+from starttls_policy.scan import cache
+from starttls_policy.scan import certs
+from starttls_policy.scan import checkpoint
+from starttls_policy.scan import certstore
+from starttls_policy.scan import db
+from starttls_policy.scan import pipeline
+from starttls_policy.scan import probe
+from starttls_policy.scan import resolver
+from starttls_policy.scan import results
+from starttls_policy.scan import schedule
+from starttls_policy.scan import suffix
+from starttls_policy.scan import verify
+from starttls_policy.scan import versions
+
+# Compiled public suffix list, loaded in main and cached in SUFFIX_CACHE.
+suffix_index = None
+SUFFIX_CACHE = 'public-suffix-list.pickle'
+# Many domains share MX hosts, so each host is only probed once per run.
+# Replaced in main by a cache whose probes go through the scheduler.
+probe_cache = cache.ProbeCache()
+dns_resolver = resolver.Resolver()
+# Loaded once in main, from the locations given on the command line.
+trust_store = None
 CERTS_OBSERVED = 'certs-observed'
-
-def mkdirp(path):
-    try:
-        os.makedirs(path)
-    except OSError as exc:
-        if exc.errno == errno.EEXIST and os.path.isdir(path):
-            pass
-        else: raise
-
-def extract_names(pem):
-    """Return a set of DNS subject names from PEM-encoded leaf cert."""
-    leaf = X509.load_cert_string(pem, X509.FORMAT_PEM)
-
-    subj = leaf.get_subject()
-    # Certs have a "subject" identified by a Distingushed Name (DN).
-    # Host certs should also have a Common Name (CN) with a DNS name.
-    common_names = subj.get_entries_by_nid(subj.nid['CN'])
-    common_names = [name.get_data().as_text() for name in common_names]
-    try:
-        # The SAN extension allows one cert to cover multiple domains
-        # and permits DNS wildcards.
-        # http://www.digicert.com/subject-alternative-name.htm
-        # The field is a comma delimited list, e.g.:
-        # >>> twitter_cert.get_ext('subjectAltName').get_value()
-        # 'DNS:www.twitter.com, DNS:twitter.com'
-        alt_names = leaf.get_ext('subjectAltName').get_value()
-        alt_names = alt_names.split(', ')
-        alt_names = [name.partition(':') for name in alt_names]
-        alt_names = [name for prot, _, name in alt_names if prot == 'DNS']
-    except:
-        alt_names = []
-    return set(common_names + alt_names)
-
-def tls_connect(mx_host, mail_domain):
-  """Attempt a STARTTLS connection with openssl and save the output."""
-  if supports_starttls(mx_host):
-    # smtplib doesn't let us access certificate information,
-    # so shell out to openssl.
-    try:
-      output = subprocess.check_output(
-          """openssl s_client \
-             -starttls smtp -connect %s:25 -showcerts </dev/null \
-             2>/dev/null
-             """ % mx_host, shell = True)
-    except subprocess.CalledProcessError:
-      print "Failed s_client"
-      return
-
-    # Save a copy of the certificate for later analysis
-    with open(os.path.join(CERTS_OBSERVED, mail_domain, mx_host), "w") as f:
-      f.write(output)
-
-def valid_cert(filename):
-  """Return true if the certificate is valid.
-
-     Note: CApath must have hashed symlinks to the trust roots.
-     TODO: Include the -attime flag based on file modification time."""
-
-  if open(filename).read().find("-----BEGIN CERTIFICATE-----") == -1:
-    return False
-  try:
-    # The file contains both the leaf cert and any intermediates, so we pass it
-    # as both the cert to validate and as the "untrusted" chain.
-    output = subprocess.check_output("""openssl verify -CApath /home/jsha/mozilla/ -purpose sslserver \
-              -untrusted "%s" \
-              "%s"
-             """ % (filename, filename), shell = True)
-    return True
-  except subprocess.CalledProcessError:
+cert_store = certstore.CertStore(CERTS_OBSERVED)
+SCAN_DB = 'scans.sqlite'
+scan_db = db.ScanDB(SCAN_DB)
+# Opened in main; gets a line per mail domain as soon as it's done.
+result_writer = None
+# Set up in main; records how far through the inputs the scan has got.
+scan_checkpoint = None
+
+def valid_cert(observation):
+  """Return true if the certificate chain presented to us is valid.
+
+     The certs after the leaf are used as the "untrusted" chain.
+     TODO: Verify as of the observation time."""
+  if not observation.chain:
     return False
-
-def check_certs(mail_domain):
-  """
-  Return "" if any certs for any mx domains pointed to by mail_domain
-  were invalid, and a public suffix for one if they were all valid
-  """
-  dir = os.path.join(CERTS_OBSERVED, mail_domain)
-  if not os.path.exists(dir):
-    collect(mail_domain)
-  names = set()
-  for mx_hostname in os.listdir(dir):
-    filename = os.path.join(dir, mx_hostname)
-    if not valid_cert(filename):
-      return ""
-    else:
-      new_names = extract_names_from_openssl_output(filename)
-      new_names = set(public_suffix_list.get_public_suffix(n) for n in new_names)
-      names.update(new_names)
-  if len(names) >= 1:
-    # Hack: Just pick an arbitrary suffix for now. Do something cleverer later.
-    return names.pop()
+  return trust_store.verify(cert_store.get_chain(observation)).valid
+
+def report(domain):
+  """Append the verdict for a mail domain, from its latest scan, to the results."""
+  result_writer.write(results.evaluate(domain, scan_db.latest(domain) or [], valid_cert,
+                                       suffix_index, versions=scan_db.versions))
+  scan_checkpoint.finish(domain)
+
+def read_domains(inputs):
+  for filename in inputs:
+    with open(filename) as f:
+      for line in f:
+        if line.strip():
+          yield line.strip()
+
+def write_policy(results_file, output, author=None):
+  """Fold the streamed results into the policy file at `output`."""
+  now = datetime.datetime.now()
+  if os.path.exists(output):
+    config = policy.Config(output)
+    config.load()
+    config.timestamp = now
+    config.expires = now + results.DEFAULT_LIFETIME
   else:
-    return ""
-
-def common_suffix(hosts):
-  num_components = min(len(h.split(".")) for h in hosts)
-  longest_suffix = ""
-  for i in range(1, num_components + 1):
-    suffixes = set(".".join(h.split(".")[-i:]) for h in hosts)
-    if len(suffixes) == 1:
-      longest_suffix = suffixes.pop()
-    else:
-      return longest_suffix
-  return longest_suffix
+    config = results.new_config(output, author=author, now=now)
+  with open(results_file) as f:
+    count = results.fold(results.read_results(f), config)
+  config.flush()
+  return count
 
-def extract_names_from_openssl_output(certificates_file):
-  openssl_output = open(certificates_file, "r").read()
-  cert = re.findall("-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----", openssl_output, flags = re.DOTALL)
-  return extract_names(cert[0])
-
-def supports_starttls(mx_host):
-  try:
-    smtpserver = smtplib.SMTP(mx_host, 25, timeout = 2)
-    smtpserver.ehlo()
-    smtpserver.starttls()
-    return True
-    print "Success: %s" % mx_host
-  except socket.error as e:
-    print "Connection to %s failed: %s" % (mx_host, e.strerror)
-    return False
-  except smtplib.SMTPException, e:
-    # In order to talk to some hosts, you need to run this from a host that has a
-    # reverse DNS entry. AWS instances all have reverse DNS, as an example.
-    if e[0] == 554:
-      print e[1]
-    else:
-      print "No STARTTLS support on %s" % mx_host, e[0]
-    return False
-
-def min_tls_version(mail_domain):
-  protocols = []
-  for mx_hostname in os.listdir(os.path.join(CERTS_OBSERVED, mail_domain)):
-    filename = os.path.join(CERTS_OBSERVED, mail_domain, mx_hostname)
-    contents = open(filename).read()
-    protocol = re.findall("Protocol  : (.*)", contents)[0]
-    protocols.append(protocol)
-  return min(protocols)
-
-def collect(mail_domain):
+def record(result):
   """
-  Attempt to connect to each MX hostname for mail_doman and negotiate STARTTLS.
-  Store the output in a directory with the same name as mail_domain to make
-  subsequent analysis faster.
+  Store what we saw while scanning a mail domain in the scan database and
+  certificate store to make subsequent analysis faster.
   """
-  print "Checking domain %s" % mail_domain
-  mkdirp(os.path.join(CERTS_OBSERVED, mail_domain))
-  answers = dns.resolver.query(mail_domain, 'MX')
-  for rdata in answers:
-      mx_host = str(rdata.exchange).rstrip(".")
-      tls_connect(mx_host, mail_domain)
+  print("Checked domain %s" % result.domain)
+  scan_db.record_certs(result.certs.values())
+  observations = []
+  for probed in result.probes:
+    if not probed.starttls:
+      print("%s: %s" % (probed.host, probed.error))
+    if probed.host in result.analysis_errors:
+      print("%s: bad certificate: %s" % (probed.host, result.analysis_errors[probed.host]))
+    leaf = result.certs.get(certs.fingerprint(probed.chain[0])) if probed.chain else None
+    names = leaf.names if leaf is not None else []
+    observations.append(cert_store.observe(probed, names=names))
+  scan_db.record(result.domain, observations)
+  if result.versions:
+    scan_db.record_versions(result.versions)
 
 if __name__ == '__main__':
   """Consume a target list of domains and output a configuration file for those domains."""
-  if len(sys.argv) < 2:
-    print("Usage: CheckSTARTTLS.py list-of-domains.txt > output.json")
-
-  config = collections.defaultdict(dict)
-
-  for input in sys.argv[1:]:
-    for domain in open(input).readlines():
-      domain = domain.strip()
-      suffix = check_certs(domain)
-      if suffix != "":
-        min_version = min_tls_version(domain)
-        suffix_match = "." + suffix
-        config["acceptable-mxs"][domain] = {
-          "accept-mx-domains": [suffix_match]
-        }
-        config["tls-policies"][suffix_match] = {
-          "require-tls": True,
-          "min-tls-version": min_version
-        }
-
-  print json.dumps(config, indent=2, sort_keys=True)
+  arg_parser = argparse.ArgumentParser(
+    description="Consume lists of domains and output a configuration file for them.",
+    usage="CheckSTARTTLS.py [options] list-of-domains.txt")
+  arg_parser.add_argument("inputs", nargs="*", help="files with one domain per line")
+  arg_parser.add_argument("-o", "--output", default="policy.json",
+    help="policy file to write; policies already in it are updated")
+  arg_parser.add_argument("--results", default="scan-results.jsonl",
+    help="file that gets a JSON line per mail domain while the scan runs")
+  arg_parser.add_argument("--fold-only", action="store_true",
+    help="don't scan; just fold the results file into the policy file")
+  arg_parser.add_argument("--author", help="author of a new policy file")
+  arg_parser.add_argument("--checkpoint", default="scan-checkpoint.json",
+    help="file recording how far the scan has got, for --resume")
+  arg_parser.add_argument("--checkpoint-interval", type=float,
+    default=checkpoint.DEFAULT_INTERVAL, help="seconds between checkpoints")
+  arg_parser.add_argument("--resume", action="store_true",
+    help="continue the scan recorded in the checkpoint file")
+  arg_parser.add_argument("--ca-file", help="PEM file of trust roots")
+  arg_parser.add_argument("--ca-path",
+    help="directory of trust roots with hashed symlinks (see c_rehash)")
+  arg_parser.add_argument("--max-age-hours", type=float, default=db.DEFAULT_MAX_AGE / 3600,
+    help="rescan domains whose results are older than this, or whose MX hosts changed")
+  arg_parser.add_argument("--workers", type=int, default=schedule.DEFAULT_WORKERS,
+    help="maximum number of probes running at once")
+  arg_parser.add_argument("--per-ip", type=int, default=schedule.DEFAULT_PER_IP,
+    help="maximum concurrent connections to one MX address")
+  arg_parser.add_argument("--per-provider", type=int, default=schedule.DEFAULT_PER_PROVIDER,
+    help="maximum concurrent connections to one mail provider")
+  arg_parser.add_argument("--ip-rate", type=float, default=schedule.DEFAULT_IP_RATE,
+    help="connections per second to one MX address")
+  arg_parser.add_argument("--provider-rate", type=float, default=schedule.DEFAULT_PROVIDER_RATE,
+    help="connections per second to one mail provider")
+  arg_parser.add_argument("--versions", action="store_true",
+    help="try each TLS version against every MX host to find the range it supports")
+  arg_parser.add_argument("--cipher-order", action="store_true",
+    help="with --versions, also find each MX host's order of cipher preference")
+  arg_parser.add_argument("--nameserver", action="append",
+    help="DNS server to query instead of the system's; may be repeated")
+  arg_parser.add_argument("--dns-port", type=int, default=53, help="port of --nameserver")
+  arg_parser.add_argument("--smtp-port", type=int, default=probe.SMTP_PORT,
+    help="port to probe MX hosts on")
+  arg_parser.add_argument("--public-suffix-list", default=suffix.DEFAULT_LIST,
+    help="public suffix list file, from https://publicsuffix.org/list/")
+  args = arg_parser.parse_args()
+  if args.fold_only:
+    count = write_policy(args.results, args.output, args.author)
+    print("Wrote %d policies to %s" % (count, args.output), file=sys.stderr)
+    sys.exit(0)
+  if args.resume:
+    scan_checkpoint = checkpoint.Checkpoint.load(args.checkpoint, args.checkpoint_interval)
+    if scan_checkpoint is None:
+      arg_parser.error("no checkpoint at %s" % args.checkpoint)
+    if args.inputs and args.inputs != scan_checkpoint.inputs:
+      arg_parser.error("inputs differ from the checkpoint's: %s" %
+                       " ".join(scan_checkpoint.inputs))
+    args.inputs = scan_checkpoint.inputs
+    args.results = scan_checkpoint.results
+    # Results already written stay; a line cut short when the last run
+    # was killed is dropped so the new ones can be appended.
+    checkpoint.truncate_partial_line(args.results)
+    results_file = open(args.results, "a")
+    print("Resuming after %d domains" % scan_checkpoint.position, file=sys.stderr)
+  elif args.inputs:
+    scan_checkpoint = checkpoint.Checkpoint(args.checkpoint, args.inputs, args.results,
+                                            interval=args.checkpoint_interval)
+    results_file = open(args.results, "w")
+  else:
+    arg_parser.error("no input files")
+
+  suffix_index = suffix.SuffixIndex.load(args.public_suffix_list, SUFFIX_CACHE)
+  scheduler = schedule.Scheduler(workers=args.workers, per_ip=args.per_ip,
+                                 per_provider=args.per_provider, ip_rate=args.ip_rate,
+                                 provider_rate=args.provider_rate,
+                                 provider_of=suffix_index.registrable_domain)
+  if args.nameserver:
+    dns_resolver = resolver.Resolver(nameservers=args.nameserver, port=args.dns_port)
+  probe_smtp = scheduler.wrap(functools.partial(probe.probe, port=args.smtp_port))
+  probe_cache = cache.ProbeCache(probe=probe_smtp)
+  version_scanner = None
+  if args.versions:
+    version_scanner = versions.VersionScanner(probe=probe_smtp,
+                                              workers=args.workers,
+                                              cipher_order=args.cipher_order)
+  trust_store = verify.TrustStore(cafile=args.ca_file, capath=args.ca_path)
+  result_writer = results.ResultWriter(results_file)
+
+  # Resolve every domain concurrently; the resolver also caches the
+  # addresses of MX hosts shared between domains. Only domains that are
+  # new, stale or whose MX hosts changed get probed; the rest are
+  # reported straight from the scan database. Domains before the
+  # checkpoint's position are skipped.
+  def resolved():
+    domains = scan_checkpoint.pending(read_domains(args.inputs))
+    for domain, mx_records, error in dns_resolver.resolve_many(domains):
+      if error is not None:
+        print("Resolving %s failed: %s" % (domain, error))
+        result_writer.write(results.DomainResult(domain, time.time(), [], None,
+                                                 "Resolving failed: %s" % error))
+        scan_checkpoint.finish(domain)
+      else:
+        yield domain, mx_records
+  # Probing happens in a pool of threads, and certificates are parsed in
+  # a pool of processes as results come in. The pipeline's threads mostly
+  # wait on the scheduler, so there are more of them than probe workers to
+  # keep many destinations queued and let them take turns.
+  to_scan = db.plan_rescans(scan_db, resolved(), args.max_age_hours * 3600, on_fresh=report)
+  scan_pipeline = pipeline.Pipeline(probe_cache.get, network_workers=4 * args.workers,
+                                    version_scanner=version_scanner)
+  for result in scan_pipeline.run(to_scan):
+    if result.error is not None:
+      # Not recorded, so the next run scans it again.
+      print("Scanning %s failed: %s" % (result.domain, result.error))
+      result_writer.write(results.DomainResult(result.domain, time.time(), [], None,
+                                               "Scanning failed: %s" % result.error))
+      scan_checkpoint.finish(result.domain)
+      continue
+    record(result)
+    report(result.domain)
+  if version_scanner is not None:
+    version_scanner.close()
+  scheduler.close()
+  results_file.close()
+  scan_checkpoint.save()
+
+  count = write_policy(args.results, args.output, args.author)
+  print("Wrote %d policies to %s" % (count, args.output), file=sys.stderr)
+  print("Probed %d MX hosts, reused %d results" % (probe_cache.misses, probe_cache.hits),
+        file=sys.stderr)
+  print("Slowest destinations:", file=sys.stderr)
+  print(scheduler.report(), file=sys.stderr)
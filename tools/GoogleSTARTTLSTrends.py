@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Keep monthly snapshots of Google's TLS delivery data from
+https://www.google.com/transparencyreport/saferemail/data/?hl=en
+in a columnar store, and look across all of them for outbound domains
+that have stayed able to negotiate an encrypted connection >99% of the
+time.
+
+Usage:
+  ./GoogleSTARTTLSTrends.py snapshots convert 2018-06 google-starttls-domains.csv
+  ./GoogleSTARTTLSTrends.py snapshots candidates
+  ./GoogleSTARTTLSTrends.py snapshots trends
+"""
+from __future__ import print_function
+import argparse
+import sys
+
+from starttls_policy.report import aggregate
+from starttls_policy.report import columnar
+
+def convert(store, args):
+  if args.label in store and not args.force:
+    print("Snapshot {} exists; use --force to replace it".format(args.label), file=sys.stderr)
+    sys.exit(1)
+  rows = store.add_file(args.label, args.report)
+  print("{}: {} rows".format(args.label, rows), file=sys.stderr)
+
+def candidates(store, args):
+  for suffix in store.candidates(args.threshold, args.min_snapshots, args.labels):
+    print(suffix)
+
+def trends(store, args):
+  for trend in store.trends(args.labels):
+    print("{} {} {:.6f} {:.6f} {:+.6f}".format(trend.suffix, trend.snapshots, trend.min_fraction,
+                                               trend.last_fraction, trend.slope))
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Analyze Google's STARTTLS delivery data across monthly reports.")
+  parser.add_argument("store", help="directory of columnar snapshots")
+  commands = parser.add_subparsers(dest="command")
+  parser_convert = commands.add_parser("convert", help="add a report CSV file as a snapshot")
+  parser_convert.add_argument("label", help="name of the snapshot, e.g. 2018-06; "
+                              "snapshots are ordered by name")
+  parser_convert.add_argument("report", help="CSV file of the report data")
+  parser_convert.add_argument("--force", action="store_true",
+                              help="replace an existing snapshot")
+  parser_convert.set_defaults(func=convert)
+  for name, func, description in (
+      ("candidates", candidates, "print domains that stayed above the threshold"),
+      ("trends", trends, "print each domain's snapshot count, minimum and latest "
+                         "fraction encrypted, and trend per snapshot")):
+    subparser = commands.add_parser(name, help=description)
+    subparser.add_argument("--labels", nargs="+", help="snapshots to use; all by default")
+    subparser.set_defaults(func=func)
+    if name == "candidates":
+      subparser.add_argument("--threshold", type=float, default=aggregate.DEFAULT_THRESHOLD)
+      subparser.add_argument("--min-snapshots", type=int,
+                             help="snapshots a domain must appear in; all by default")
+  args = parser.parse_args()
+  if args.command is None:
+    parser.error("a command is required")
+  args.func(columnar.SnapshotStore(args.store), args)
+
+if __name__ == '__main__':
+  main()
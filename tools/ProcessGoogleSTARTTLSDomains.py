@@ -5,30 +5,81 @@ https://www.google.com/transparencyreport/saferemail/data/?hl=en
 to look for outbound domains that can negotiate an encrypted
 connection >99% of the time.
 
+With --state, prints only what changed since the last run that used the
+same state file, checked against policy.json and the golden list.
+
 Usage:
   ./ProcessGoogleSTARTTLSDomains.py google-starttls-domains.csv
+  ./ProcessGoogleSTARTTLSDomains.py --state candidates.json google-starttls-domains.csv
 """
-import csv
-import codecs
+from __future__ import print_function
+import argparse
+import io
 import sys
-from collections import defaultdict
 
-csvreader = csv.reader(codecs.open(sys.argv[1], "rU", "utf-8"), delimiter=',', quotechar='"')
-d = defaultdict(set)
-# Google's report doesn't include gmail.com because it's local delivery, but we
-# know they support STARTTLS, so manually include them.
-d["gmail.com"] = set([1])
-for (address_suffix, hostname_suffix, direction, region, region_name, fraction_encrypted) in csvreader:
-  if direction == "outbound":
-    # Some domains exist in many TLDs and are summarized as, e.g. yahoo.{...}.
-    # We're tryingto get a solid list of the relevant TLDs, but in the meantime
-    # just use .com.
-    address_suffix = address_suffix.replace("{...}", "com")
-    try:
-      d[address_suffix].add(float(fraction_encrypted))
-    except ValueError:
-      pass
+from starttls_policy import policy
+from starttls_policy.report import aggregate
+from starttls_policy.report import delta
+from starttls_policy.report import ingest
+
+def print_delta(candidates, args):
+  """Print how the candidates differ from the last run's, and save them."""
+  config = policy.Config(args.policy)
+  config.load()
+  golden = set()
+  if args.golden:
+    with io.open(args.golden, encoding="utf-8") as f:
+      golden = delta.read_domain_list(f)
+  index = delta.CandidateIndex.load(args.state)
+  changes = index.update(candidates, config, golden)
+  for label, domains in (("qualified", changes.qualified),
+                         ("listed", changes.listed),
+                         ("disqualified", changes.disqualified),
+                         ("delisted", changes.delisted),
+                         ("golden-missing", changes.golden_missing)):
+    for domain in domains:
+      print(label, domain)
+  index.save(args.state)
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Print the mail domains in Google's STARTTLS delivery data "
+                "that encrypt outbound mail at least THRESHOLD of the time.")
+  parser.add_argument("reports", nargs="+", help="CSV files of the report data")
+  parser.add_argument("--threshold", type=float, default=aggregate.DEFAULT_THRESHOLD)
+  parser.add_argument("--stats", action="store_true",
+                      help="also print each domain's minimum fraction, rows and regions")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="processes to split large reports across; 0 for one per CPU")
+  parser.add_argument("--chunk-size", type=int, default=ingest.DEFAULT_CHUNK_SIZE,
+                      help="bytes of a report each process takes at a time")
+  parser.add_argument("--state",
+                      help="file of the last run's candidates; print only changes since then: "
+                           "domains that newly qualify without a policy (qualified) or with one "
+                           "(listed), that no longer qualify without a policy (disqualified) or "
+                           "with one (delisted), and golden domains that neither qualify nor "
+                           "have a policy (golden-missing)")
+  parser.add_argument("--policy", default="policy.json",
+                      help="policy list to check candidates against, with --state")
+  parser.add_argument("--golden", help="list of domains expected to qualify, with --state")
+  args = parser.parse_args()
+
+  if args.workers == 1:
+    aggregator = aggregate.aggregate(args.reports)
+  else:
+    aggregator = ingest.ingest(args.reports, workers=args.workers or None,
+                               chunk_size=args.chunk_size)
+  candidates = aggregator.candidates(args.threshold)
+  if args.state:
+    print_delta((stats.suffix for stats in candidates), args)
+  elif args.stats:
+    for stats in candidates:
+      print(stats.suffix, stats.min_fraction, stats.count, ",".join(stats.regions))
+  else:
+    for stats in candidates:
+      print(stats.suffix)
+  if aggregator.skipped:
+    print("Skipped {} malformed rows".format(aggregator.skipped), file=sys.stderr)
 
-for address_suffix, fraction_encrypted in d.iteritems():
-  if min(fraction_encrypted) >= 0.99:
-    print address_suffix
+if __name__ == '__main__':
+  main()